@@ -0,0 +1,12 @@
+"""
+Benchmarks for pyastgrep.
+
+- `benchmarks.suite` runs end-to-end scenarios against a synthetic corpus
+  made by `benchmarks.corpus`, and writes the results as JSON.
+- `benchmarks.conversion` has microbenchmarks for parsing and converting
+  to XML, for different kinds of code.
+- `benchmarks.rule_set`, `benchmarks.regex` and `benchmarks.output` are
+  benchmarks for specific parts of the search.
+
+These are run from the root of the repo, e.g. `python -m benchmarks.suite`.
+"""
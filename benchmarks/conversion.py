@@ -0,0 +1,175 @@
+"""
+Microbenchmarks for parsing Python and converting the AST to XML, timing
+`parse_python_file`, `ast_to_xml` and `_encoded_literal` separately for
+inputs with different kinds of nodes:
+
+- "literal-heavy": large tables of constants.
+- "nested-expressions": statements with deeply nested expressions.
+- "wide-classes": classes with many small methods.
+- "typical": a mix of functions and classes, for reference.
+
+For each, throughput is reported as AST nodes and source bytes per second,
+along with the memory blocks allocated and peak memory, measured using
+`tracemalloc`. Note that `tracemalloc` only sees memory allocated by Python,
+not by libxml2, so for `ast_to_xml` this is mostly the node mappings and
+attribute values.
+
+Usage:
+
+    python -m benchmarks.conversion [--output FILE] [--baseline FILE] [--repeat N]
+
+To judge a change to `asts.py`, save the results before the change with
+`--output baseline.json`, and run again after with `--baseline baseline.json`.
+"""
+from __future__ import annotations
+
+import argparse
+import ast
+import gc
+import json
+import time
+import tracemalloc
+from typing import Any, Callable
+
+from lxml.etree import _Element
+from pyastgrep.asts import _encoded_literal, ast_to_xml
+from pyastgrep.files import parse_python_file
+
+from .corpus import CodeGenerator
+from .suite import get_metadata
+
+
+def make_inputs(seed: int = 0) -> dict[str, bytes]:
+    generator = CodeGenerator(seed)
+    nested = "\n".join(f"x_{i} = {generator.expression(depth=6)}" for i in range(300)) + "\n"
+    wide = "\n".join(
+        "\n".join(generator.class_def(f"Class{i}", method_count=200, statement_count=1)) + "\n" for i in range(5)
+    )
+    return {
+        "literal-heavy": generator.data_module(table_count=4, rows=1000).encode(),
+        "nested-expressions": nested.encode(),
+        "wide-classes": wide.encode(),
+        "typical": generator.module(function_count=100, class_count=10).encode(),
+    }
+
+
+def get_literals(tree: ast.AST) -> list[Any]:
+    """
+    Returns the values that `ast_to_xml` passes to `_encoded_literal` for the tree.
+    """
+    literals: list[Any] = []
+    for node in ast.walk(tree):
+        for attr in ("lineno", "col_offset"):
+            value = getattr(node, attr, None)
+            if value is not None:
+                literals.append(value)
+        for field_name in node._fields:
+            value = getattr(node, field_name)
+            if isinstance(value, list):
+                literals.extend(item for item in value if not isinstance(item, ast.AST))
+            elif value is not None and not isinstance(value, ast.AST):
+                literals.extend([type(value).__name__, value])
+    return literals
+
+
+def encode_literals(literals: list[Any]) -> list[str]:
+    return [_encoded_literal(literal) for literal in literals]
+
+
+def convert(tree: ast.AST) -> tuple[_Element, dict[_Element, ast.AST]]:
+    node_mappings: dict[_Element, ast.AST] = {}
+    return ast_to_xml(tree, node_mappings), node_mappings
+
+
+def measure(func: Callable[[], object], repeat: int) -> dict[str, float]:
+    times = []
+    # As with `timeit`, garbage collection is turned off, so that it doesn't
+    # depend on the garbage left from earlier runs.
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        # Keep the result alive, so that its memory is counted
+        result = func()  # noqa: F841
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    return {"seconds": min(times), "allocated_blocks": blocks, "peak_memory_bytes": peak}
+
+
+def run(repeat: int) -> list[dict[str, Any]]:
+    results = []
+    for category, contents in make_inputs().items():
+        _, tree = parse_python_file(contents, category, auto_dedent=False)
+        node_count = sum(1 for _ in ast.walk(tree))
+        literals = get_literals(tree)
+        functions: dict[str, Callable[[], object]] = {
+            "parse_python_file": lambda: parse_python_file(contents, category, auto_dedent=False),
+            "ast_to_xml": lambda: convert(tree),
+            "_encoded_literal": lambda: encode_literals(literals),
+        }
+        for function, func in functions.items():
+            measured = measure(func, repeat)
+            results.append(
+                {
+                    "category": category,
+                    "function": function,
+                    "nodes": node_count,
+                    "bytes": len(contents),
+                    "nodes_per_second": round(node_count / measured["seconds"]),
+                    "bytes_per_second": round(len(contents) / measured["seconds"]),
+                    **measured,
+                }
+            )
+    return results
+
+
+def print_results(results: list[dict[str, Any]], baseline: list[dict[str, Any]] | None) -> None:
+    baseline_results = {(result["category"], result["function"]): result for result in baseline or []}
+    print(f"{'category':<20}{'function':<20}{'nodes/s':>12}{'MB/s':>8}{'blocks':>10}{'peak KiB':>10}")
+    for result in results:
+        line = (
+            f"{result['category']:<20}{result['function']:<20}{result['nodes_per_second']:>12}"
+            f"{result['bytes_per_second'] / 1e6:>8.2f}{result['allocated_blocks']:>10}"
+            f"{result['peak_memory_bytes'] / 1024:>10.0f}"
+        )
+        old = baseline_results.get((result["category"], result["function"]))
+        if old is not None:
+            line += (
+                f"   time {result['seconds'] / old['seconds']:.2f}x,"
+                f" blocks {result['allocated_blocks'] - old['allocated_blocks']:+}"
+            )
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="File to write JSON results to")
+    parser.add_argument("--baseline", help="JSON results from an earlier run to compare with")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": {**get_metadata(), "repeat": args.repeat}, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
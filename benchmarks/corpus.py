@@ -0,0 +1,268 @@
+"""
+Generation of synthetic code bases for benchmarks.
+
+The code is generated using a seeded random number generator, so the same
+arguments always produce the same files, and results from different commits
+can be compared. There are several shapes of corpus, each stressing different
+parts of the search:
+
+- "small-files": many small modules in a shallow tree, where the cost per
+  file (walking, reading, setting up the parse) dominates.
+- "huge-files": a few very large modules, where converting the AST and
+  evaluating expressions dominates.
+- "deep-tree": a deep directory tree with a `.gitignore` in every directory,
+  which stresses the walker and handling of ignore files.
+- "data-heavy": modules made up mostly of large literals, e.g. generated
+  tables, which have lots of constants and few statements.
+
+Usage:
+
+    python -m benchmarks.corpus DIRECTORY [--scale N] [--seed N]
+"""
+from __future__ import annotations
+
+import argparse
+import random
+from pathlib import Path
+from typing import Callable
+
+# Names used for calls. Some are rare, so that expressions which look for
+# them are selective.
+CALLEE_NAMES = ["print", "len", "isinstance", "getattr", "sorted", "str", "int", "open", "helper", "process"]
+RARE_CALLEE_NAMES = ["eval", "exec"]
+ATTRIBUTES = ["append", "join", "get", "items", "format", "split", "strip", "write", "read", "path"]
+BINARY_OPS = ["+", "-", "*", "/", "%", "//"]
+COMPARE_OPS = ["==", "!=", "<", ">", "is", "in"]
+
+
+class CodeGenerator:
+    """
+    Generator of random, syntactically valid, Python source code.
+    """
+
+    def __init__(self, seed: int):
+        self.random = random.Random(seed)
+
+    def name(self, prefix: str = "x") -> str:
+        return f"{prefix}_{self.random.randrange(50)}"
+
+    def constant(self) -> str:
+        kind = self.random.randrange(5)
+        if kind == 0:
+            return str(self.random.randrange(-1000, 1000))
+        if kind == 1:
+            return f"{self.random.random() * 1000:.3f}"
+        if kind == 2:
+            return repr(" ".join(self.name("word") for _ in range(self.random.randrange(1, 6))))
+        if kind == 3:
+            return repr(self.name("key").encode())
+        return self.random.choice(["None", "True", "False"])
+
+    def expression(self, depth: int = 2) -> str:
+        if depth <= 0:
+            return self.random.choice([self.name(), self.constant()])
+        kind = self.random.randrange(8)
+        sub = depth - 1
+        if kind == 0:
+            return self.call(depth)
+        if kind == 1:
+            return f"({self.expression(sub)}).{self.random.choice(ATTRIBUTES)}"
+        if kind == 2:
+            return f"({self.expression(sub)} {self.random.choice(BINARY_OPS)} {self.expression(sub)})"
+        if kind == 3:
+            return f"({self.expression(sub)} {self.random.choice(COMPARE_OPS)} {self.expression(sub)})"
+        if kind == 4:
+            return f"{self.name()}[{self.expression(sub)}]"
+        if kind == 5:
+            item = self.name("item")
+            return f"[{self.expression(sub)} for {item} in {self.name()} if {item}]"
+        if kind == 6:
+            return "{" + ", ".join(f"{self.constant()}: {self.expression(sub)}" for _ in range(3)) + "}"
+        return self.expression(0)
+
+    def call(self, depth: int = 2) -> str:
+        if self.random.random() < 0.02:
+            func = self.random.choice(RARE_CALLEE_NAMES)
+        elif self.random.random() < 0.3:
+            func = f"{self.name('obj')}.{self.random.choice(ATTRIBUTES)}"
+        else:
+            func = self.random.choice(CALLEE_NAMES)
+        args = [self.expression(depth - 1) for _ in range(self.random.randrange(4))]
+        if self.random.random() < 0.3:
+            args.append(f"{self.name('option')}={self.expression(depth - 1)}")
+        return f"{func}({', '.join(args)})"
+
+    def statements(self, indent: str, count: int, depth: int = 2) -> list[str]:
+        lines: list[str] = []
+        for _ in range(count):
+            lines.extend(self.statement(indent, depth))
+        return lines
+
+    def statement(self, indent: str, depth: int) -> list[str]:
+        kind = self.random.randrange(8) if depth > 0 else self.random.randrange(3)
+        inner = indent + "    "
+        body_count = self.random.randrange(1, 4)
+        if kind == 0:
+            return [f"{indent}{self.name()} = {self.expression()}"]
+        if kind == 1:
+            return [f"{indent}{self.call()}"]
+        if kind == 2:
+            return [f"{indent}{self.name()} += {self.expression(1)}"]
+        if kind == 3:
+            lines = [f"{indent}if {self.expression(1)}:"]
+            lines.extend(self.statements(inner, body_count, depth - 1))
+            if self.random.random() < 0.5:
+                lines.append(f"{indent}else:")
+                lines.extend(self.statements(inner, body_count, depth - 1))
+            return lines
+        if kind == 4:
+            return [f"{indent}for {self.name('item')} in {self.expression(1)}:"] + self.statements(
+                inner, body_count, depth - 1
+            )
+        if kind == 5:
+            lines = [f"{indent}try:"]
+            lines.extend(self.statements(inner, body_count, depth - 1))
+            lines.append(f"{indent}except {self.random.choice(['ValueError', 'KeyError', 'OSError'])}:")
+            lines.extend(self.statements(inner, 1, depth - 1))
+            return lines
+        if kind == 6:
+            return [f"{indent}with {self.call(1)} as {self.name('f')}:"] + self.statements(inner, body_count, depth - 1)
+        return [f"{indent}return {self.expression()}"]
+
+    def function(self, indent: str, name: str, *, method: bool = False, statement_count: int = 6) -> list[str]:
+        params = [self.name("arg") for _ in range(self.random.randrange(4))]
+        if method:
+            params.insert(0, "self")
+        lines = []
+        if self.random.random() < 0.2:
+            lines.append(f"{indent}@{self.random.choice(['staticmethod', 'decorator', 'cache'])}")
+        lines.append(f"{indent}def {name}({', '.join(dict.fromkeys(params))}):")
+        if self.random.random() < 0.5:
+            lines.append(f'{indent}    """{self.name("doc")} {self.name("doc")}."""')
+        lines.extend(self.statements(indent + "    ", statement_count))
+        return lines
+
+    def class_def(self, name: str, method_count: int, statement_count: int = 6) -> list[str]:
+        bases = self.random.choice(["", "(Base)", "(Mixin, Base)"])
+        lines = [f"class {name}{bases}:"]
+        for i in range(self.random.randrange(3)):
+            lines.append(f"    attr_{i} = {self.constant()}")
+        for i in range(method_count):
+            lines.extend(self.function("    ", f"method_{i}", method=True, statement_count=statement_count))
+        if len(lines) == 1:
+            lines.append("    pass")
+        return lines
+
+    def module(self, function_count: int, class_count: int, method_count: int = 4, statement_count: int = 6) -> str:
+        lines = [
+            "import os",
+            "import sys",
+            f"from {self.name('package')} import {self.name('thing')}, {self.name('thing')}",
+            "",
+        ]
+        for i in range(function_count):
+            lines.extend(self.function("", f"function_{i}", statement_count=statement_count))
+            lines.append("")
+        for i in range(class_count):
+            lines.extend(self.class_def(f"Class{i}", method_count, statement_count=statement_count))
+            lines.append("")
+        return "\n".join(lines) + "\n"
+
+    def data_module(self, table_count: int, rows: int) -> str:
+        lines = []
+        for i in range(table_count):
+            if i % 2:
+                lines.append(f"TABLE_{i} = [")
+                for _ in range(rows):
+                    row = ", ".join(self.constant() for _ in range(6))
+                    lines.append(f"    ({row}),")
+                lines.append("]")
+            else:
+                lines.append(f"MAPPING_{i} = {{")
+                for j in range(rows):
+                    lines.append(f"    {repr(f'key_{j}')}: {{'value': {self.constant()}, 'other': {self.constant()}}},")
+                lines.append("}")
+            lines.append("")
+        return "\n".join(lines) + "\n"
+
+
+def make_small_files(directory: Path, generator: CodeGenerator, scale: int) -> None:
+    for i in range(1000 * scale):
+        package = directory / f"package_{i // 100}"
+        package.mkdir(exist_ok=True)
+        class_count = generator.random.randrange(2)
+        (package / f"module_{i}.py").write_text(
+            generator.module(function_count=1, class_count=class_count, method_count=1, statement_count=2)
+        )
+
+
+def make_huge_files(directory: Path, generator: CodeGenerator, scale: int) -> None:
+    for i in range(2 * scale):
+        (directory / f"huge_{i}.py").write_text(generator.module(function_count=100, class_count=10, method_count=10))
+
+
+def make_deep_tree(directory: Path, generator: CodeGenerator, scale: int, depth: int = 7) -> None:
+    # Stops the search for `.gitignore` files in parent directories
+    (directory / ".git").mkdir()
+
+    def make_dir(path: Path, level: int) -> None:
+        path.mkdir(exist_ok=True)
+        (path / ".gitignore").write_text(
+            f"*_generated.py\n!keep_generated.py\n/build_{level}/\n{generator.name('ignored')}.py\n"
+        )
+        for name in ["module", "keep_generated", "other_generated"]:
+            (path / f"{name}.py").write_text(generator.module(function_count=1, class_count=0, statement_count=2))
+        (path / "README.txt").write_text("Not Python\n")
+        build = path / f"build_{level}"
+        build.mkdir()
+        (build / "output.py").write_text(generator.module(function_count=1, class_count=0, statement_count=2))
+        if level < depth:
+            for branch in range(2):
+                make_dir(path / f"dir_{level}_{branch}", level + 1)
+
+    for i in range(scale):
+        make_dir(directory / f"tree_{i}", 0)
+
+
+def make_data_heavy(directory: Path, generator: CodeGenerator, scale: int) -> None:
+    for i in range(10 * scale):
+        (directory / f"data_{i}.py").write_text(generator.data_module(table_count=4, rows=200))
+
+
+SHAPES: dict[str, Callable[[Path, CodeGenerator, int], None]] = {
+    "small-files": make_small_files,
+    "huge-files": make_huge_files,
+    "deep-tree": make_deep_tree,
+    "data-heavy": make_data_heavy,
+}
+
+
+def make_corpus(directory: Path, *, shapes: list[str] | None = None, scale: int = 1, seed: int = 0) -> dict[str, Path]:
+    """
+    Creates a corpus in `directory`, with a subdirectory for each shape, and
+    returns the subdirectories.
+    """
+    if shapes is None:
+        shapes = list(SHAPES)
+    paths = {}
+    for shape in shapes:
+        path = directory / shape
+        path.mkdir(parents=True)
+        # Separate seed for each shape, so that a shape is the same whichever others are generated
+        SHAPES[shape](path, CodeGenerator(seed * 1000 + list(SHAPES).index(shape)), scale)
+        paths[shape] = path
+    return paths
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", type=Path)
+    parser.add_argument("--shape", action="append", choices=list(SHAPES), dest="shapes")
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    make_corpus(args.directory, shapes=args.shapes, scale=args.scale, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
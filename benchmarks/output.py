@@ -0,0 +1,95 @@
+"""
+Benchmark for printing a large number of matches, to measure the cost of
+output formatting separately from searching.
+
+Usage:
+
+    python -m benchmarks.output [--matches N] [--function-bodies] [--unbuffered]
+
+With `--function-bodies`, the code is inside large function bodies rather than
+at module level, which is the expensive case for `--context=statement`.
+
+With `--unbuffered`, output is flushed after every line, as it is when writing
+to a terminal, which gives a baseline for the cost of unbuffered output.
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, TextIO
+
+from pyastgrep.api import search_python_files
+from pyastgrep.color import make_default_colorer
+from pyastgrep.context import ScopeContext, StatementContext, StaticContext
+from pyastgrep.printer import print_results
+from pyastgrep.search import Match
+
+NAMES_PER_LINE = 10
+LINES_PER_FILE = 5000
+
+
+def make_corpus(directory: Path, match_count: int, function_bodies: bool = False) -> None:
+    """
+    Creates files in `directory` with a total of `match_count` `Name` nodes.
+    """
+    line = " + ".join(f"name_{i}" for i in range(NAMES_PER_LINE - 1))
+    if function_bodies:
+        # Expression statements, which are found by searching the body
+        contents = "def func():\n" + "".join(f"    print({line})\n" for i in range(LINES_PER_FILE - 1))
+    else:
+        contents = "".join(f"x_{i} = {line}\n" for i in range(LINES_PER_FILE))
+    file_count = max(1, match_count // (NAMES_PER_LINE * LINES_PER_FILE))
+    for i in range(file_count):
+        (directory / f"module_{i}.py").write_text(contents)
+
+
+class TerminalOutput(io.TextIOWrapper):
+    """
+    Output that claims to be a terminal, so that it is flushed after every line.
+    """
+
+    def isatty(self) -> bool:
+        return True
+
+
+def open_output(unbuffered: bool) -> TextIO:
+    if unbuffered:
+        return TerminalOutput(open(os.devnull, "wb"))
+    return open(os.devnull, "w")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--matches", type=int, default=1_000_000)
+    parser.add_argument("--function-bodies", action="store_true")
+    parser.add_argument("--unbuffered", action="store_true", help="Flush output after every line")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_corpus(Path(directory), args.matches, function_bodies=args.function_bodies)
+        results = list(search_python_files([Path(directory)], ".//Name"))
+    match_count = sum(1 for result in results if isinstance(result, Match))
+    print(f"{match_count} matches")
+
+    scenarios: list[tuple[str, dict[str, Any]]] = [
+        ("no color", {}),
+        ("color", {"colorer": make_default_colorer()}),
+        ("-C 50", {"context": StaticContext(before=50, after=50)}),
+        ("--context=statement --heading", {"context": StatementContext(), "heading": True}),
+        ("--scope", {"scope": True}),
+        ("--context=function --heading", {"context": ScopeContext("function"), "heading": True}),
+    ]
+    for description, kwargs in scenarios:
+        with open_output(args.unbuffered) as output:
+            start = time.perf_counter()
+            print_results(results, stdout=output, **kwargs)
+            elapsed = time.perf_counter() - start
+        print(f"print_results, {description}: {elapsed:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
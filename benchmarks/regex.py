@@ -0,0 +1,82 @@
+"""
+Benchmark for expressions using the `re:match` and `re:search` functions,
+comparing evaluating them with libxml2 calling back into Python for every
+candidate node, with the evaluation used when searching, which checks
+candidates in Python where possible.
+
+Usage:
+
+    python -m benchmarks.regex [PATH] [--files N] [--repeat N]
+
+PATH defaults to the Python standard library.
+"""
+from __future__ import annotations
+
+import argparse
+import sysconfig
+import time
+from functools import partial
+from pathlib import Path
+from typing import Callable, Iterable
+
+from lxml.etree import _Element
+from pyastgrep.rules import regex_query
+from pyastgrep.search import Rule, query_rule
+from pyastgrep.xml import lxml_query
+
+from .rule_set import load_corpus
+
+EXPRESSIONS = [
+    # Checked in Python
+    './/Name[re:match("_", @id)]',
+    './/FunctionDef[re:search("^test_", @name)]',
+    './/Attribute[re:match("(get|set)_", @attr)]',
+    './/Constant[re:search("https?://", @value)]',
+    './/Call[func/Name][re:search("[A-Z]{2,}", @lineno)]',
+    './/ImportFrom[@level="0"][re:match("os|sys", @module)]',
+    './/ClassDef[re:search("Mixin$", @name) and re:search("^[A-Z]", @name)]',
+    # Evaluated by libxml2
+    './/Name[not(re:match("_", @id))]',
+    './/Call[re:search("^_", func/Name/@id)]',
+    './/*[re:search("foo", @*)]',
+]
+
+
+def timed(
+    corpus: list[_Element], query: Callable[[_Element], Iterable[object]], repeat: int
+) -> tuple[float, list[int]]:
+    best = float("inf")
+    counts: list[int] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        counts = [len(list(query(root))) for root in corpus]
+        best = min(best, time.perf_counter() - start)
+    return best, counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", default=sysconfig.get_paths()["stdlib"])
+    parser.add_argument("--files", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = [processed.xml for processed in load_corpus(Path(args.path), args.files)]
+    node_count = sum(1 for root in corpus for _ in root.iter())
+    print(f"{len(corpus)} files, {node_count} elements")
+    print(f"{'callbacks':>10} {'search':>10} {'speed up':>9}  expression")
+    total_callbacks = total_search = 0.0
+    for expression in EXPRESSIONS:
+        rule = Rule(expression)
+        callbacks_time, callbacks_counts = timed(corpus, partial(lxml_query, expression=expression), args.repeat)
+        search_time, search_counts = timed(corpus, partial(query_rule, query_func=lxml_query, rule=rule), args.repeat)
+        assert callbacks_counts == search_counts, f"Results differ for {expression}!"
+        total_callbacks += callbacks_time
+        total_search += search_time
+        checked = "" if regex_query(expression) is not None else " (libxml2)"
+        print(f"{callbacks_time:9.3f}s {search_time:9.3f}s {callbacks_time / search_time:8.2f}x  {expression}{checked}")
+    print(f"{total_callbacks:9.3f}s {total_search:9.3f}s {total_callbacks / total_search:8.2f}x  total")
+
+
+if __name__ == "__main__":
+    main()
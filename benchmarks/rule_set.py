@@ -0,0 +1,108 @@
+"""
+Benchmark for evaluating a large set of rules against each file, comparing the
+rule set evaluator with evaluating each expression in turn.
+
+Usage:
+
+    python -m benchmarks.rule_set [PATH] [--files N] [--rules N] [--regex]
+
+PATH defaults to the Python standard library. With --regex, some rules use
+`re:match` and `re:search` in predicates that are evaluated with XPath.
+"""
+from __future__ import annotations
+
+import argparse
+import sysconfig
+import time
+from pathlib import Path
+
+from pyastgrep.files import ProcessedPython, get_files_to_search, process_python_file
+from pyastgrep.rules import RuleSet
+from pyastgrep.xml import lxml_query
+
+NAMES = ["print", "eval", "exec", "open", "len", "getattr", "setattr", "isinstance", "self", "os", "sys", "re"]
+ATTRIBUTES = ["append", "join", "get", "items", "format", "split", "strip", "write", "read", "path"]
+
+
+REGEX_TEMPLATES = [
+    './/Call[re:match("{name}", func/Name/@id)]',
+    './/FunctionDef[re:search("{name}_{i}$", @name) and .//Return]',
+]
+
+
+def make_rules(count: int, *, regex: bool = False) -> list[str]:
+    """
+    Returns `count` expressions, similar in style to typical custom lint rules.
+    """
+    templates = [
+        './/Call[func/Name[@id="{name}"]]',
+        './/Name[@id="{name}_{i}"]',
+        './/Attribute[@attr="{attr}"]',
+        './/FunctionDef[@name="{name}_{i}"]',
+        './/Call[func/Attribute[@attr="{attr}"] and count(args/*) > {small}]',
+        './/ClassDef[@name="{name}_{i}"]',
+        './/Compare[ops/Is and comparators/Constant[@value="{small}"]]',
+        ".//ExceptHandler[not(type)]",
+        './/ImportFrom[@module="{name}"]',
+        './/keyword[@arg="{name}"]',
+    ]
+    if regex:
+        templates.extend(REGEX_TEMPLATES)
+    rules = []
+    for i in range(count):
+        template = templates[i % len(templates)]
+        rules.append(
+            template.format(
+                i=i,
+                name=NAMES[i % len(NAMES)],
+                attr=ATTRIBUTES[i % len(ATTRIBUTES)],
+                small=i % 4,
+            )
+        )
+    return rules
+
+
+def load_corpus(path: Path, max_files: int) -> list[ProcessedPython]:
+    corpus = []
+    for file_path in get_files_to_search([path], respect_vcs_ignores=False):
+        if not isinstance(file_path, Path):
+            continue
+        processed = process_python_file(file_path)
+        if isinstance(processed, ProcessedPython):
+            corpus.append(processed)
+        if len(corpus) >= max_files:
+            break
+    return corpus
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", default=sysconfig.get_paths()["stdlib"])
+    parser.add_argument("--files", type=int, default=300)
+    parser.add_argument("--rules", type=int, default=200)
+    parser.add_argument("--regex", action="store_true", help="Include rules using re:match and re:search")
+    args = parser.parse_args()
+
+    expressions = make_rules(args.rules, regex=args.regex)
+    corpus = load_corpus(Path(args.path), args.files)
+    node_count = sum(1 for processed in corpus for _ in processed.xml.iter())
+    print(f"{len(corpus)} files, {node_count} elements, {len(expressions)} rules")
+
+    start = time.perf_counter()
+    naive_counts = [[len(lxml_query(processed.xml, expression)) for expression in expressions] for processed in corpus]
+    naive_time = time.perf_counter() - start
+    print(f"Per-expression loop: {naive_time:.3f}s")
+
+    start = time.perf_counter()
+    rule_set = RuleSet(expressions)
+    rule_set_counts = [
+        [len(list(results)) for results in rule_set.evaluate(processed.xml, lxml_query)] for processed in corpus
+    ]
+    rule_set_time = time.perf_counter() - start
+    print(f"Rule set ({len(rule_set.anchored)} anchored): {rule_set_time:.3f}s")
+    print(f"Speed up: {naive_time / rule_set_time:.2f}x")
+    assert naive_counts == rule_set_counts, "Results differ!"
+
+
+if __name__ == "__main__":
+    main()
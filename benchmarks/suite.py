@@ -0,0 +1,182 @@
+"""
+End-to-end benchmarks, running a set of scenarios against each shape of
+synthetic corpus (see `benchmarks.corpus`), and writing the timings as JSON so
+that they can be compared between commits.
+
+Usage:
+
+    python -m benchmarks.suite [--output FILE] [--compare FILE] [--scale N] [--repeat N]
+                               [--scenario NAME] [--shape NAME] [--corpus DIR]
+
+For example, to compare a branch with master:
+
+    git checkout master
+    python -m benchmarks.suite --output master.json
+    git checkout my-branch
+    python -m benchmarks.suite --output my-branch.json --compare master.json
+
+With `--corpus DIR`, the corpus is generated in DIR if it doesn't exist, and
+re-used otherwise, which saves time when running the suite repeatedly.
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+import pyastgrep
+from lxml import etree
+from pyastgrep.cli import main as cli_main
+from pyastgrep.files import get_files_to_search, process_python_file
+
+from .corpus import SHAPES, make_corpus
+
+SELECTIVE_XPATH = './/Call[func/Name[@id="eval"]]'
+BROAD_XPATH = ".//Name"
+REGEX_XPATH = './/Name[re:match("_", @id)]'
+
+
+def walk(path: Path) -> None:
+    for _ in get_files_to_search([path]):
+        pass
+
+
+def convert(path: Path) -> None:
+    for file_path in get_files_to_search([path]):
+        if isinstance(file_path, Path):
+            process_python_file(file_path)
+
+
+def cli(*args: str) -> Callable[[Path], None]:
+    def run(path: Path) -> None:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            cli_main([*args, str(path)])
+
+    return run
+
+
+SCENARIOS: dict[str, Callable[[Path], None]] = {
+    "walk": walk,
+    "convert": convert,
+    "selective-xpath": cli(SELECTIVE_XPATH),
+    "broad-xpath": cli(BROAD_XPATH),
+    "regex-xpath": cli(REGEX_XPATH),
+    "xpath2": cli("--xpath2", SELECTIVE_XPATH),
+    "css": cli("--css", 'Call > func > Name[id="eval"]'),
+    "context-statement": cli("--context=statement", ".//Call[func/Attribute]"),
+    "heading": cli("--heading", BROAD_XPATH),
+}
+
+
+def run_scenario(scenario: Callable[[Path], None], path: Path, repeat: int) -> list[float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        scenario(path)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def describe_corpus(path: Path) -> dict[str, int]:
+    files = list(path.rglob("*.py"))
+    return {
+        "python_files": len(files),
+        "bytes": sum(file_path.stat().st_size for file_path in files),
+        "directories": sum(1 for p in path.rglob("*") if p.is_dir()),
+    }
+
+
+def get_metadata() -> dict[str, object]:
+    try:
+        commit: str | None = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "pyastgrep_version": pyastgrep.__version__,
+        "git_commit": commit,
+        "python": sys.version,
+        "lxml": etree.__version__,
+        "libxml2": ".".join(map(str, etree.LIBXML_VERSION)),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def compare(results: list[dict[str, Any]], baseline_file: Path) -> None:
+    baseline = {
+        (result["scenario"], result["corpus"]): result["min_seconds"]
+        for result in json.loads(baseline_file.read_text())["results"]
+    }
+    print(f"\nCompared to {baseline_file} (min times):")
+    for result in results:
+        old = baseline.get((result["scenario"], result["corpus"]))
+        if old is None:
+            continue
+        new = result["min_seconds"]
+        print(f"  {result['scenario']:<20}{result['corpus']:<14}{old:8.3f}s {new:8.3f}s {new / old:6.2f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", type=Path, help="File to write JSON results to")
+    parser.add_argument("--compare", type=Path, help="JSON results from an earlier run to compare with")
+    parser.add_argument("--scale", type=int, default=1, help="Multiplier for the size of the corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), dest="scenarios")
+    parser.add_argument("--shape", action="append", choices=list(SHAPES), dest="shapes")
+    parser.add_argument("--corpus", type=Path, help="Directory to generate the corpus in, or re-use it from")
+    args = parser.parse_args()
+    scenarios = args.scenarios or list(SCENARIOS)
+    shapes = args.shapes or list(SHAPES)
+
+    with contextlib.ExitStack() as stack:
+        if args.corpus is None:
+            corpus_dir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        else:
+            corpus_dir = args.corpus
+        missing = [shape for shape in shapes if not (corpus_dir / shape).exists()]
+        if missing:
+            print(f"Generating corpus in {corpus_dir}", file=sys.stderr)
+            make_corpus(corpus_dir, shapes=missing, scale=args.scale, seed=args.seed)
+
+        results: list[dict[str, Any]] = []
+        for scenario in scenarios:
+            for shape in shapes:
+                times = run_scenario(SCENARIOS[scenario], corpus_dir / shape, args.repeat)
+                results.append(
+                    {
+                        "scenario": scenario,
+                        "corpus": shape,
+                        "times_seconds": [round(t, 6) for t in times],
+                        "min_seconds": round(min(times), 6),
+                        "median_seconds": round(statistics.median(times), 6),
+                    }
+                )
+                print(f"{scenario:<20}{shape:<14}{min(times):8.3f}s")
+        corpora = {shape: describe_corpus(corpus_dir / shape) for shape in shapes}
+
+    output = {
+        "metadata": {**get_metadata(), "scale": args.scale, "seed": args.seed, "repeat": args.repeat},
+        "corpora": corpora,
+        "results": results,
+    }
+    if args.output is not None:
+        args.output.write_text(json.dumps(output, indent=2) + "\n")
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,18 @@
-from .files import ProcessedPython, ReadError, process_python_file, process_python_file_cached
-from .search import Match, Position, search_python_files
+from .async_search import search_python_files_async
+from .files import ProcessedPython, ReadError, SkippedFile, process_python_file, process_python_file_cached
+from .limits import Limits
+from .search import Match, Position, search_python_files, search_sources
 
 __all__ = [
     "search_python_files",
+    "search_python_files_async",
+    "search_sources",
     "Match",
     "Position",
     "process_python_file",
     "process_python_file_cached",
     "ProcessedPython",
     "ReadError",
+    "SkippedFile",
+    "Limits",
 ]
@@ -0,0 +1,69 @@
+"""
+Reading Python files from inside archives (wheels, sdists, zip files etc.)
+without extracting them to disk.
+"""
+from __future__ import annotations
+
+import fnmatch
+import tarfile
+import zipfile
+from pathlib import Path
+from typing import Iterable
+
+from .files import ReadError
+
+ZIP_SUFFIXES = (".whl", ".zip", ".egg")
+TAR_SUFFIXES = (".tar.gz", ".tgz")
+
+# Globs for finding archives when walking directories
+ARCHIVE_GLOBS = tuple(f"*{suffix}" for suffix in ZIP_SUFFIXES + TAR_SUFFIXES)
+
+# Separates the archive path from the member path in reported paths,
+# e.g. `dist/package.whl!/package/module.py`
+MEMBER_SEPARATOR = "!/"
+
+
+def is_archive(path: Path) -> bool:
+    return path.name.endswith(ZIP_SUFFIXES + TAR_SUFFIXES)
+
+
+def member_path(archive_path: Path, member_name: str) -> Path:
+    return Path(f"{archive_path}{MEMBER_SEPARATOR}{member_name}")
+
+
+def _is_python_member(name: str) -> bool:
+    return fnmatch.fnmatch(name.rsplit("/", 1)[-1], "*.py")
+
+
+def iter_archive_members(archive_path: Path) -> Iterable[tuple[Path, bytes] | ReadError]:
+    """
+    Yields (path, contents) for each Python file in the archive, reading one
+    member at a time. Paths are reported as `<archive path>!/<member name>`
+    """
+    try:
+        if archive_path.name.endswith(ZIP_SUFFIXES):
+            yield from _iter_zip_members(archive_path)
+        else:
+            yield from _iter_tar_members(archive_path)
+    except (OSError, zipfile.BadZipFile, tarfile.TarError, EOFError) as ex:
+        yield ReadError(str(archive_path), ex)
+
+
+def _iter_zip_members(archive_path: Path) -> Iterable[tuple[Path, bytes] | ReadError]:
+    with zipfile.ZipFile(archive_path) as zip_file:
+        for info in zip_file.infolist():
+            if info.is_dir() or not _is_python_member(info.filename):
+                continue
+            yield member_path(archive_path, info.filename), zip_file.read(info)
+
+
+def _iter_tar_members(archive_path: Path) -> Iterable[tuple[Path, bytes] | ReadError]:
+    # Stream mode ("r|*") avoids seeking back and forth in compressed data.
+    with tarfile.open(archive_path, "r|*") as tar_file:
+        for member in tar_file:
+            if not member.isfile() or not _is_python_member(member.name):
+                continue
+            extracted = tar_file.extractfile(member)
+            if extracted is None:
+                continue
+            yield member_path(archive_path, member.name), extracted.read()
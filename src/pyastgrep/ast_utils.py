@@ -4,7 +4,12 @@ Compatibility and utility module for different ast stdlib versions
 See https://docs.python.org/3/library/ast.html
 """
 
+from __future__ import annotations
+
 import ast
+import sys
+from bisect import bisect_right
+from dataclasses import dataclass
 
 """
 For changes between Python versions, try this one liner in bash/zsh:
@@ -80,3 +85,179 @@ def get_ast_statement_node(ast_node: ast.AST) -> ast.AST:
         current_node = parent
 
     return current_node
+
+
+class StatementSpans:
+    """
+    Table mapping each node in an AST to the line span of the statement it
+    belongs to (as defined by `get_ast_statement_node`), as a tuple of (first
+    line, end line). The first line includes any decorators. The end line is
+    None if unknown.
+
+    The table is built with a single walk of the tree, so that finding the
+    span is O(1) for each node, rather than climbing the tree and searching the
+    `body` of each block.
+    """
+
+    def __init__(self, root: ast.AST):
+        self.root = root
+        self.spans: dict[ast.AST, tuple[int, int | None]] = {}
+        # Nodes with the span of their statement, or None at the top level
+        stack: list[tuple[ast.AST, tuple[int, int | None] | None]] = [(root, None)]
+        while stack:
+            node, statement_span = stack.pop()
+            if isinstance(node, STATEMENT_AST) and hasattr(node, "lineno"):
+                statement_span = _statement_span(node)
+            if statement_span is not None and hasattr(node, "lineno"):
+                # Nodes without positions, like Load(), can be shared between parents
+                self.spans[node] = statement_span
+            is_block = isinstance(node, BLOCK_AST)
+            for field_name, value in ast.iter_fields(node):
+                children = value if isinstance(value, list) else [value]
+                for child in children:
+                    if not isinstance(child, ast.AST):
+                        continue
+                    if is_block and field_name == "body" and hasattr(child, "lineno"):
+                        # Directly in the body of a block, so statement-like
+                        stack.append((child, _statement_span(child)))
+                    else:
+                        stack.append((child, statement_span))
+
+
+def _statement_span(statement_node: ast.AST) -> tuple[int, int | None]:
+    first_line: int = statement_node.lineno  # type: ignore[attr-defined]
+    for decorator in getattr(statement_node, "decorator_list", ()):
+        first_line = min(first_line, decorator.lineno)
+    end_line = getattr(statement_node, "end_lineno", None)
+    return (first_line, end_line if isinstance(end_line, int) else None)
+
+
+def get_statement_span(ast_node: ast.AST) -> tuple[int, int | None]:
+    """
+    For a given AST node, return the line span of the statement it belongs
+    to, as a tuple of (first line, end line), including decorators. The end
+    line is None if unknown.
+    """
+    root = get_root(ast_node)
+    # Stored on the tree itself, so it is freed along with the tree.
+    statement_spans: StatementSpans | None = getattr(root, "statement_spans", None)
+    if statement_spans is None:
+        statement_spans = StatementSpans(root)
+        root.statement_spans = statement_spans  # type: ignore[attr-defined]
+    span = statement_spans.spans.get(ast_node)
+    if span is None:
+        # Not in the table e.g. a `Module`
+        return _statement_span(get_ast_statement_node(ast_node))
+    return span
+
+
+def get_root(ast_node: ast.AST) -> ast.AST:
+    """
+    Return the root of the tree that the node belongs to, using `parent` links.
+    """
+    root = ast_node
+    while (parent := getattr(root, "parent", None)) is not None:
+        root = parent
+    return root
+
+
+SCOPE_AST = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+_STATEMENT_LIST_AST = tuple(i for i in [ast.stmt, ast.excepthandler, getattr(ast, "match_case", None)] if i)
+
+
+@dataclass(frozen=True, eq=False)
+class Scope:
+    """
+    A function or class definition.
+    """
+
+    node: ast.AST
+    # Dotted name including enclosing scopes e.g. `MyClass.my_method`
+    name: str
+    parent: Scope | None
+    # First line including decorators, and end line
+    first_line: int
+    end_line: int
+
+
+class ScopeIndex:
+    """
+    Index of the scopes (functions and classes) in an AST, for finding the
+    innermost scope enclosing a position in O(log n).
+
+    Scopes are nested intervals of (line, column) positions. We flatten them
+    into a sorted list of boundaries, each of which starts a region that has
+    the same innermost scope, so that a lookup is a single bisect.
+    """
+
+    def __init__(self, root: ast.AST):
+        self.root = root
+        scopes: list[tuple[tuple[int, int], tuple[int, int], Scope]] = []
+        stack: list[tuple[ast.AST, Scope | None]] = [(root, None)]
+        while stack:
+            node, parent_scope = stack.pop()
+            if isinstance(node, SCOPE_AST):
+                name = node.name if parent_scope is None else f"{parent_scope.name}.{node.name}"
+                first_line = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+                end = (node.end_lineno or node.lineno, node.end_col_offset or 0)
+                parent_scope = Scope(node=node, name=name, parent=parent_scope, first_line=first_line, end_line=end[0])
+                scopes.append(((node.lineno, node.col_offset), end, parent_scope))
+            # Definitions can only be found in lists of statements (including
+            # `except` handlers and `match` cases), never in expressions.
+            for field in node._fields:
+                value = getattr(node, field, None)
+                if isinstance(value, list):
+                    stack.extend((child, parent_scope) for child in value if isinstance(child, _STATEMENT_LIST_AST))
+        scopes.sort(key=lambda item: item[0])
+
+        # Boundaries as (line, column), and the innermost scope from there on.
+        self.starts: list[tuple[int, int]] = []
+        self.scopes: list[Scope | None] = []
+        open_scopes: list[tuple[tuple[int, int], Scope]] = []
+
+        def close_scopes_before(position: tuple[int, int]) -> None:
+            while open_scopes and open_scopes[-1][0] <= position:
+                end, _ = open_scopes.pop()
+                self.starts.append(end)
+                self.scopes.append(open_scopes[-1][1] if open_scopes else None)
+
+        for start, end, scope in scopes:
+            close_scopes_before(start)
+            open_scopes.append((end, scope))
+            self.starts.append(start)
+            self.scopes.append(scope)
+        close_scopes_before((sys.maxsize, 0))
+
+    def find(self, lineno: int, col_offset: int) -> Scope | None:
+        """
+        Return the innermost scope containing the position, or None for module level.
+        """
+        idx = bisect_right(self.starts, (lineno, col_offset)) - 1
+        return self.scopes[idx] if idx >= 0 else None
+
+
+def get_scope_index(ast_node: ast.AST) -> ScopeIndex:
+    """
+    Return the ScopeIndex for the tree containing the node, building it if needed.
+    """
+    root = get_root(ast_node)
+    # Stored on the tree itself, as for `get_statement_span`
+    scope_index: ScopeIndex | None = getattr(root, "scope_index", None)
+    if scope_index is None:
+        scope_index = ScopeIndex(root)
+        root.scope_index = scope_index  # type: ignore[attr-defined]
+    return scope_index
+
+
+def get_enclosing_scope(
+    ast_node: ast.AST, lineno: int, col_offset: int, scope_types: tuple[type[ast.AST], ...] = SCOPE_AST
+) -> Scope | None:
+    """
+    For a given AST node at the given position, return the innermost scope of
+    one of `scope_types` containing it, or None if there isn't one.
+    """
+    scope = get_scope_index(ast_node).find(lineno, col_offset)
+    while scope is not None and not isinstance(scope.node, scope_types):
+        scope = scope.parent
+    return scope
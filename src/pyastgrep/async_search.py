@@ -0,0 +1,160 @@
+"""
+Searching from asyncio code, without blocking the event loop.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import AsyncGenerator, BinaryIO, Generator, Iterator, Sequence, Union
+
+from typing_extensions import TypeAlias
+
+from .archives import is_archive
+from .files import MissingPath, ReadError, SkippedFile, get_files_to_search
+from .ignores import WalkError
+from .limits import Limits, time_limit_exceeded
+from .search import (
+    Expressions,
+    FileFinished,
+    Match,
+    NonElementReturned,
+    Rule,
+    SearchedContents,
+    XMLQueryFunc,
+    get_query_func,
+    limit_file_time,
+    make_rules,
+    search_archive,
+    search_python_file,
+)
+
+AsyncSearchResult: TypeAlias = Union[Match, MissingPath, ReadError, WalkError, NonElementReturned, FileFinished]
+
+# Default number of files searched ahead of the consumer
+DEFAULT_MAX_PENDING = 16
+
+
+async def search_python_files_async(
+    paths: Sequence[Path | BinaryIO],
+    expression: Expressions,
+    *,
+    xpath2: bool = False,
+    include_hidden: bool = False,
+    respect_global_ignores: bool = True,
+    respect_vcs_ignores: bool = True,
+    respect_dot_ignores: bool = True,
+    search_archives: bool = False,
+    limits: Limits | None = None,
+    executor: Executor | None = None,
+    max_pending: int = DEFAULT_MAX_PENDING,
+) -> AsyncGenerator[AsyncSearchResult, None]:
+    """
+    Async version of `search_python_files`, returning the same results in
+    the same order.
+
+    Walking directories, and reading, parsing and searching each file, are
+    done in `executor`, or the event loop's default executor if it is None.
+    The executor can be shared by any number of searches. It must use threads,
+    since results contain lxml elements, which can't be passed between processes.
+
+    At most `max_pending` files are searched ahead of the consumer, so a slow
+    consumer holds up the search rather than results building up in memory.
+    If the consumer stops early, or is cancelled, files not yet started are
+    not searched.
+    """
+    if isinstance(executor, ProcessPoolExecutor):
+        raise TypeError("search_python_files_async needs an executor that uses threads, not processes")
+    if max_pending < 1:
+        raise ValueError("max_pending must be at least 1")
+    loop = asyncio.get_running_loop()
+    start_time = time.monotonic()
+    query_func = get_query_func(xpath2=xpath2)
+    rules = make_rules(expression)
+    searched_contents = SearchedContents()
+
+    files_to_search = iter(
+        get_files_to_search(
+            paths,
+            include_hidden=include_hidden,
+            respect_global_ignores=respect_global_ignores,
+            respect_vcs_ignores=respect_vcs_ignores,
+            respect_dot_ignores=respect_dot_ignores,
+            search_archives=search_archives,
+        )
+    )
+    # Results for each file, in the order the files were found
+    pending: deque[asyncio.Future[list[AsyncSearchResult]]] = deque()
+
+    def done(results: list[AsyncSearchResult]) -> asyncio.Future[list[AsyncSearchResult]]:
+        future: asyncio.Future[list[AsyncSearchResult]] = loop.create_future()
+        future.set_result(results)
+        return future
+
+    walk: asyncio.Future[list[Path | BinaryIO | MissingPath | WalkError]] | None = None
+    try:
+        walking = True
+        while walking or pending:
+            if walking and len(pending) < max_pending:
+                wanted = max_pending - len(pending)
+                walk = loop.run_in_executor(executor, _take, files_to_search, wanted)
+                found = await walk
+                walking = len(found) == wanted
+                for path in found:
+                    if isinstance(path, (MissingPath, WalkError)):
+                        pending.append(done([path]))
+                    elif (exceeded := time_limit_exceeded(start_time, limits)) is not None:
+                        pending.append(
+                            done([SkippedFile(str(path) if isinstance(path, Path) else "<stdin>", exceeded)])
+                        )
+                        walking = False
+                        break
+                    else:
+                        pending.append(
+                            loop.run_in_executor(
+                                executor, _search_path, path, query_func, rules, searched_contents, limits
+                            )
+                        )
+            if pending:
+                for result in await pending.popleft():
+                    yield result
+    finally:
+        # Files already being searched can't be interrupted, but their results are dropped
+        for future in pending:
+            future.cancel()
+        # The walk can't be stopped while it is running in the executor
+        if (walk is None or walk.done()) and isinstance(files_to_search, Generator):
+            files_to_search.close()
+
+
+def _take(
+    iterator: Iterator[Path | BinaryIO | MissingPath | WalkError], count: int
+) -> list[Path | BinaryIO | MissingPath | WalkError]:
+    items = []
+    for item in iterator:
+        items.append(item)
+        if len(items) == count:
+            break
+    return items
+
+
+def _search_path(
+    path: Path | BinaryIO,
+    query_func: XMLQueryFunc,
+    rules: Sequence[Rule],
+    searched_contents: SearchedContents,
+    limits: Limits | None,
+) -> list[AsyncSearchResult]:
+    if isinstance(path, Path) and is_archive(path):
+        return list(search_archive(path, query_func, rules, searched_contents=searched_contents, limits=limits))
+    results: list[AsyncSearchResult] = list(
+        limit_file_time(
+            search_python_file(path, query_func, rules, limits=limits),
+            str(path) if isinstance(path, Path) else "<stdin>",
+            limits,
+        )
+    )
+    results.append(FileFinished(path))
+    return results
@@ -0,0 +1,113 @@
+"""
+Content-addressed cache of search results, stored in a SQLite file.
+
+Results are keyed on a hash of the file contents, and a hash of the query
+(including the versions of pyastgrep, Python and lxml, which can all affect
+results), so the cache is independent of file paths and modification times.
+This makes it suitable for sharing between CI runs, by saving and restoring the
+cache file as a CI cache artifact.
+
+The database uses WAL mode, so that concurrent processes can share the same
+cache file.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import sys
+from pathlib import Path
+from typing import Callable
+
+from lxml import etree
+
+from . import __version__
+
+# Number of writes we batch up in a single transaction
+WRITE_BATCH_SIZE = 100
+
+
+class ResultCache:
+    def __init__(self, path: Path | str):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                content_hash BLOB NOT NULL,
+                query_hash BLOB NOT NULL,
+                matches TEXT NOT NULL,
+                PRIMARY KEY (content_hash, query_hash)
+            ) WITHOUT ROWID
+            """
+        )
+        self.connection.commit()
+        self.pending_writes = 0
+        self.query_keys: dict[str, bytes] = {}
+
+    def query_key(self, query_func: Callable[..., object], expression: str) -> bytes:
+        """
+        Returns the key used for the query part of cache lookups.
+        """
+        query_func_name = f"{query_func.__module__}.{query_func.__qualname__}"
+        versions = f"{__version__}\0{sys.version}\0{etree.__version__}\0{_elementpath_version()}"
+        key = f"{versions}\0{query_func_name}\0{expression}"
+        if key not in self.query_keys:
+            self.query_keys[key] = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        return self.query_keys[key]
+
+    def get(self, content_key: bytes, query_key: bytes) -> list[tuple[int, int, int]] | None:
+        """
+        Returns stored matches as a list of (element index, lineno, col_offset),
+        or None if not found. Element index is the index of the matched XML
+        element in document order.
+        """
+        row = self.connection.execute(
+            "SELECT matches FROM results WHERE content_hash = ? AND query_hash = ?", (content_key, query_key)
+        ).fetchone()
+        if row is None:
+            return None
+        return [(element_index, lineno, col_offset) for element_index, lineno, col_offset in json.loads(row[0])]
+
+    def put(self, content_key: bytes, query_key: bytes, matches: list[tuple[int, int, int]]) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO results (content_hash, query_hash, matches) VALUES (?, ?, ?)",
+            (content_key, query_key, json.dumps(matches, separators=(",", ":"))),
+        )
+        self.pending_writes += 1
+        if self.pending_writes >= WRITE_BATCH_SIZE:
+            self.commit()
+
+    def commit(self) -> None:
+        self.connection.commit()
+        self.pending_writes = 0
+
+    def close(self) -> None:
+        """
+        Commits pending writes and closes the cache. The WAL is checkpointed, so that
+        the cache is contained in the single SQLite file, ready to be saved.
+        """
+        self.commit()
+        try:
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.OperationalError:
+            # Another process is using the database, and it will do the checkpoint
+            pass
+        self.connection.close()
+
+    def __enter__(self) -> ResultCache:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
+def _elementpath_version() -> str:
+    # Only relevant if elementpath has been imported for XPath 2.0 queries,
+    # and we don't want to import it otherwise.
+    elementpath = sys.modules.get("elementpath")
+    if elementpath is None:
+        return ""
+    return str(getattr(elementpath, "__version__", ""))
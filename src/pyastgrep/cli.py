@@ -9,17 +9,24 @@ For more help use::
 from __future__ import annotations
 
 import argparse
+import contextlib
+import sqlite3
 import sys
 from pathlib import Path
-from typing import BinaryIO
+from typing import BinaryIO, Iterable
 
-from lxml.etree import XPathEvalError
+from lxml.etree import XPathError
 
-from . import __version__
+from . import __version__, git, profiling, stats, trace, xml
+from .cache import ResultCache
 from .color import Colorer, NullColorer, UseColor, make_default_colorer
-from .context import StatementContext, StaticContext
-from .printer import print_results
-from .search import search_python_files
+from .context import SCOPE_TYPES, ScopeContext, StatementContext, StaticContext
+from .files import MissingPath, ReadError
+from .ignores import WalkError
+from .index import DEFAULT_INDEX_FILE, SearchIndex, build_index
+from .limits import Limits
+from .printer import print_json_results, print_results
+from .search import FileFinished, Match, NonElementReturned, search_python_files
 
 NAME_AND_VERSION = "pyastgrep " + __version__
 parser = argparse.ArgumentParser(
@@ -30,12 +37,31 @@ parser = argparse.ArgumentParser(
 )
 
 
-def context_parameter(param: str) -> int | StatementContext:
+def context_parameter(param: str) -> int | StatementContext | ScopeContext:
     if param == "statement":
         return StatementContext()
+    if param in SCOPE_TYPES:
+        return ScopeContext(kind=param)
     return int(param)  # Will raise ValueError if invalid, which is handled by argparse
 
 
+FILESIZE_SUFFIXES = {"K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+def filesize_parameter(param: str) -> int:
+    multiplier = FILESIZE_SUFFIXES.get(param[-1:].upper(), None)
+    if multiplier is not None:
+        return int(param[:-1]) * multiplier
+    return int(param)
+
+
+def non_negative_int_parameter(param: str) -> int:
+    value = int(param)
+    if value < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or more, not {value}")
+    return value
+
+
 # Names of arguments:
 #
 # We try to match names from ripgrep where the behaviour is basically the same
@@ -67,6 +93,24 @@ parser.add_argument(
     help="Pretty-print the matching XML elements\n\n",
     action="store_true",
 )
+parser.add_argument(
+    "--json",
+    help="""Print results as JSON Lines, with one JSON object per
+match, and begin, end and summary records, similar to
+ripgrep's JSON output. Errors are printed to stderr
+as usual
+    """,
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "--json-source",
+    help="""With --json, include the source code of each matched
+node in match records
+    """,
+    action="store_true",
+    default=False,
+)
 parser.add_argument(
     "-A",
     "--after-context",
@@ -94,6 +138,10 @@ complete statement of a match. When combined with
   - multiple matches within the same statement won't be
     printed twice.
   - matches are not colored
+
+Similarly, '--context=function' and '--context=class'
+print the whole enclosing function or class (or the
+statement, for matches outside one).
     """,
     type=context_parameter,
     default=0,
@@ -111,6 +159,32 @@ parser.add_argument(
     default=UseColor.AUTO,
     choices=list(UseColor),
 )
+parser.add_argument(
+    "-e",
+    "--expression",
+    help="""XPath expression to search for. Can be passed multiple
+times, to evaluate all the expressions against each file
+parsed only once. With more than one expression,
+matches are labelled with the expression. When used,
+all positional arguments are treated as paths
+    """,
+    metavar="EXPR",
+    dest="expressions",
+    action="append",
+    default=[],
+)
+parser.add_argument(
+    "-f",
+    "--file",
+    help="""Read rules from the given file, one per line, formatted as
+`rule_id: expression`. Blank lines and lines starting
+with # are ignored. Matches are labelled with the rule
+id. When used, all positional arguments are treated
+as paths
+    """,
+    metavar="RULES_FILE",
+    dest="rules_file",
+)
 parser.add_argument(
     "--css",
     help="Interpret expression as a CSS selector\n\n",
@@ -118,9 +192,17 @@ parser.add_argument(
 )
 parser.add_argument(
     "--xpath2",
-    help="""Use XPath 2.0 functions and selectors. This currently
-makes matching significantly slower, and re:match and
-re:search functions are not supported
+    help="""Use XPath 2.0 functions and selectors. This is
+significantly slower than the default XPath 1.0 matching.
+    """,
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "--scope",
+    help="""Print the name of the enclosing function or class of each
+match, e.g. `MyClass.method`, after the column number,
+or `<module>` at module level
     """,
     action="store_true",
     default=False,
@@ -133,6 +215,23 @@ parser.add_argument(
     action="store_true",
     default=False,
 )
+parser.add_argument(
+    "-M",
+    "--max-columns",
+    help="""Don't print lines longer than NUM characters, printing
+a message instead. 0 means no limit
+    """,
+    type=non_negative_int_parameter,
+    metavar="NUM",
+)
+parser.add_argument(
+    "--max-columns-preview",
+    help="""With --max-columns, print a preview of long lines,
+shortened to NUM characters around the match
+    """,
+    action="store_true",
+    default=False,
+)
 parser.add_argument(
     "-.",
     "--hidden",
@@ -168,6 +267,149 @@ parser.add_argument(
     action="store_true",
     default=False,
 )
+parser.add_argument(
+    "--search-archives",
+    help="""Search inside wheels, eggs, zip files and .tar.gz sdists
+found while walking directories. Archives passed
+directly as paths are always searched. Matches are
+reported with paths like `package.whl!/module.py`
+    """,
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "--dedupe",
+    help="""Parse and search files with identical contents only
+once, reporting the matches for each of them. This
+uses more memory, as results have to be kept for
+the whole run. Always done with --rev and --rev-range
+    """,
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "--cache",
+    help="""Path of a SQLite file to use as a cache of results. The
+cache is keyed on file contents and the expression, not
+file paths or modification times, so it can be shared
+between machines e.g. as a CI cache artifact
+    """,
+    metavar="FILE",
+)
+parser.add_argument(
+    "--index",
+    help="""Path of an index file created with `pyastgrep index build`,
+used to skip files that cannot match. Files not in the
+index, or changed since it was built, are always
+searched
+    """,
+    metavar="FILE",
+)
+parser.add_argument(
+    "--changed-since",
+    help="""Search only Python files changed since the merge base
+of the given git revision and HEAD, including
+uncommitted changes in the working tree
+    """,
+    metavar="REV",
+)
+parser.add_argument(
+    "--staged",
+    help="""Search only Python files with changes staged in the
+git index. The staged contents are searched, rather
+than the contents of the working tree
+    """,
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "--changed-lines",
+    help="""With --changed-since or --staged, only report matches
+that start on added or modified lines
+    """,
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "--rev",
+    help="""Search Python files in the given git revision, read
+directly from the git object store. Can be passed
+multiple times. Paths are reported as REV:PATH
+    """,
+    metavar="REV",
+    action="append",
+    default=[],
+)
+parser.add_argument(
+    "--rev-range",
+    help="""Search Python files in every commit in the given git
+revision range e.g. v1.0..main. Files that are
+unchanged between commits are only parsed once
+    """,
+    metavar="A..B",
+)
+parser.add_argument(
+    "--max-filesize",
+    help="""Skip files larger than NUM bytes. Suffixes K, M and G
+can be used e.g. 2M
+    """,
+    type=filesize_parameter,
+    metavar="NUM",
+)
+parser.add_argument(
+    "--max-nodes",
+    help="Skip files with more than NUM AST nodes\n\n",
+    type=int,
+    metavar="NUM",
+)
+parser.add_argument(
+    "--file-timeout",
+    help="""Stop searching a file after SECONDS, reporting any
+matches found so far
+    """,
+    type=float,
+    metavar="SECONDS",
+)
+parser.add_argument(
+    "--time-limit",
+    help="""Stop the whole search after SECONDS, reporting any
+matches found so far
+    """,
+    type=float,
+    metavar="SECONDS",
+)
+parser.add_argument(
+    "--stats",
+    help="""Print statistics to stderr at the end of the search:
+files and directories walked, bytes read, cache hits,
+peak memory use and time spent in each phase
+    """,
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "--stats-json",
+    help="Print statistics to stderr as a JSON object\n\n",
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "--trace",
+    help="""Write timings of each phase of processing each file and
+directory to FILE, as Chrome trace events, which can be
+viewed using https://ui.perfetto.dev
+    """,
+    metavar="FILE",
+)
+parser.add_argument(
+    "--profile",
+    help="""Run the search under cProfile, writing the profile to
+FILE (which can be loaded using `pstats`), and print the
+slowest files to stderr, with their size, number of AST
+nodes and parse, convert and query times
+    """,
+    metavar="FILE",
+)
 parser.add_argument(
     "--debug",
     help="""Print debugging information, especially for why files
@@ -178,7 +420,8 @@ are skipped
 )
 parser.add_argument(
     "expr",
-    help="XPath search expression\n\n",
+    help="XPath search expression, unless -e or -f is used\n\n",
+    nargs="?",
 )
 parser.add_argument(
     "path",
@@ -189,6 +432,34 @@ Use - for stdin
     nargs="*",
 )
 
+index_parser = argparse.ArgumentParser(
+    prog="pyastgrep index",
+    description="Build or update an index used to speed up searches with --index",
+)
+index_parser.add_argument(
+    "action",
+    help="`build` to create the index from scratch, `update` to re-index only files that have changed",
+    choices=["build", "update"],
+)
+index_parser.add_argument(
+    "--index",
+    help=f"Path of the index file (default {DEFAULT_INDEX_FILE})",
+    metavar="FILE",
+    default=DEFAULT_INDEX_FILE,
+)
+index_parser.add_argument(
+    "-.",
+    "--hidden",
+    help="Index hidden files and directories",
+    action="store_true",
+    default=False,
+)
+index_parser.add_argument(
+    "path",
+    help="Files or directories to index. Defaults to current directory",
+    nargs="*",
+)
+
 MATCH_FOUND = 0
 NO_MATCH_FOUND = 1
 ERROR = 2
@@ -196,6 +467,10 @@ ERROR = 2
 
 def main(sys_args: list[str] | None = None, stdin: BinaryIO | None = None) -> int:
     """Entrypoint for CLI."""
+    if sys_args is None:
+        sys_args = sys.argv[1:]
+    if sys_args[:1] == ["index"]:
+        return index_main(sys_args[1:])
     args = parser.parse_args(args=sys_args)
 
     if args.debug:
@@ -210,10 +485,10 @@ def main(sys_args: list[str] | None = None, stdin: BinaryIO | None = None) -> in
 
         logging.basicConfig(level=logging.DEBUG)
 
-    context: StaticContext | StatementContext
-    if isinstance(args.context, StatementContext):
+    context: StaticContext | StatementContext | ScopeContext
+    if isinstance(args.context, (StatementContext, ScopeContext)):
         if args.before_context or args.after_context:
-            print("ERROR: -A or -B when using --context=statement.", file=sys.stderr)
+            print("ERROR: -A or -B when using --context=statement, function or class.", file=sys.stderr)
         context = args.context
     else:
         before_context = args.before_context or args.context
@@ -223,26 +498,119 @@ def main(sys_args: list[str] | None = None, stdin: BinaryIO | None = None) -> in
             return ERROR
         context = StaticContext(before=before_context, after=after_context)
 
+    if args.json and (args.heading or args.ast or args.xml or context != StaticContext()):
+        print("ERROR: --json cannot be used with --heading, --ast, --xml or context options.", file=sys.stderr)
+        return ERROR
+
+    if args.scope and args.heading:
+        print("ERROR: --scope cannot be used with --heading.", file=sys.stderr)
+        return ERROR
+
+    path_args: list[str] = list(args.path)
+    # Rule ids to expressions
+    expressions: dict[str, str]
+    if args.expressions or args.rules_file is not None:
+        if args.expr is not None:
+            path_args.insert(0, args.expr)
+        expressions = {expression: expression for expression in args.expressions}
+        if args.rules_file is not None:
+            try:
+                expressions.update(load_rules_file(args.rules_file))
+            except (OSError, ValueError) as ex:
+                print(f"ERROR: {ex}", file=sys.stderr)
+                return ERROR
+    elif args.expr is not None:
+        expressions = {args.expr: args.expr}
+    else:
+        print("ERROR: No expression given.", file=sys.stderr)
+        return ERROR
+
     if stdin is None:
         # Need to use .buffer here, to get bytes version, not text
         stdin = sys.stdin.buffer
     assert stdin is not None
 
     paths: list[Path | BinaryIO]
-    if len(args.path) == 0:
+    if len(path_args) == 0:
         paths = [Path(".")]
     else:
-        paths = [stdin if p == "-" else Path(p) for p in args.path]
+        paths = [stdin if p == "-" else Path(p) for p in path_args]
 
-    expr = args.expr
-    if args.css:
-        import cssselect
+    changed_files: list[git.ChangedFile] | None = None
+    changed_lines = None
+    revisions: list[str] = list(args.rev)
+    if revisions or args.rev_range is not None:
+        if args.changed_since is not None or args.staged:
+            print("ERROR: --rev and --rev-range cannot be used with --changed-since or --staged.", file=sys.stderr)
+            return ERROR
+        if any(not isinstance(p, Path) for p in paths):
+            print("ERROR: stdin cannot be searched with --rev or --rev-range.", file=sys.stderr)
+            return ERROR
+        if args.cache is not None or args.index is not None or args.search_archives:
+            print(
+                "ERROR: --rev and --rev-range cannot be used with --cache, --index or --search-archives.",
+                file=sys.stderr,
+            )
+            return ERROR
+        if args.rev_range is not None:
+            try:
+                revisions.extend(git.get_revisions_in_range(args.rev_range))
+            except git.GitError as ex:
+                print(f"ERROR: {ex}", file=sys.stderr)
+                return ERROR
 
+    if args.changed_since is not None or args.staged:
+        if any(not isinstance(p, Path) for p in paths):
+            print("ERROR: stdin cannot be searched with --changed-since or --staged.", file=sys.stderr)
+            return ERROR
         try:
-            expr = cssselect.GenericTranslator().css_to_xpath(expr, prefix=".//")
-        except cssselect.SelectorError:
-            print(f"Invalid CSS selector: {expr}", file=sys.stderr)
+            changed_files = git.restrict_to_paths(
+                git.get_changed_files(since=args.changed_since, staged=args.staged),
+                [p for p in paths if isinstance(p, Path)],
+            )
+            if args.changed_lines:
+                changed_lines = git.get_changed_lines(since=args.changed_since, staged=args.staged)
+        except git.GitError as ex:
+            print(f"ERROR: {ex}", file=sys.stderr)
             return ERROR
+        paths = [f.path for f in changed_files]
+    elif args.changed_lines:
+        print("ERROR: --changed-lines requires --changed-since or --staged.", file=sys.stderr)
+        return ERROR
+
+    if args.css:
+        import cssselect
+
+        translator = cssselect.GenericTranslator()
+        for rule_id, selector in expressions.items():
+            try:
+                expressions[rule_id] = translator.css_to_xpath(selector, prefix=".//")
+            except cssselect.SelectorError:
+                print(f"Invalid CSS selector: {selector}", file=sys.stderr)
+                return ERROR
+
+    if args.xpath2:
+        from elementpath import ElementPathError
+
+        from .xpath2 import compile_xpath2
+
+        for expr in expressions.values():
+            try:
+                compile_xpath2(expr)
+            except ElementPathError as ex:
+                print(f"Invalid XPath 2.0 expression: {expr}: {ex}", file=sys.stderr)
+                return ERROR
+    else:
+        for expr in expressions.values():
+            try:
+                xml.compile_xpath(expr)
+            except XPathError:
+                print(f"Invalid XPath expression: {expr}", file=sys.stderr)
+                return ERROR
+    # A single expression is searched without labelling matches
+    expression: str | dict[str, str] = (
+        expressions if len(expressions) > 1 or args.rules_file is not None else next(iter(expressions.values()))
+    )
 
     colorer: Colorer
     color: UseColor = args.color
@@ -256,29 +624,123 @@ def main(sys_args: list[str] | None = None, stdin: BinaryIO | None = None) -> in
     elif color == UseColor.ALWAYS:
         colorer = make_default_colorer()
 
-    try:
-        matches, errors = print_results(
-            search_python_files(
-                paths,
-                expr,
-                xpath2=args.xpath2,
-                include_hidden=args.hidden,
-                respect_global_ignores=not args.no_ignore_global,
-                respect_vcs_ignores=not args.no_ignore_vcs,
-                respect_dot_ignores=not args.no_ignore_dot,
-            ),
-            print_xml=args.xml,
-            print_ast=args.ast,
-            quiet=args.quiet,
-            context=context,
-            heading=args.heading,
-            colorer=colorer,
+    result_cache: ResultCache | None = None
+    if args.cache is not None:
+        try:
+            result_cache = ResultCache(args.cache)
+        except sqlite3.Error as ex:
+            print(f"ERROR: could not open cache {args.cache}: {ex}", file=sys.stderr)
+            return ERROR
+
+    index: SearchIndex | None = None
+    if args.index is not None:
+        if not Path(args.index).exists():
+            print(f"ERROR: index {args.index} does not exist, use `pyastgrep index build`", file=sys.stderr)
+            return ERROR
+        try:
+            index = SearchIndex(args.index)
+        except sqlite3.Error as ex:
+            print(f"ERROR: could not open index {args.index}: {ex}", file=sys.stderr)
+            return ERROR
+
+    limits = Limits(
+        max_filesize=args.max_filesize,
+        max_nodes=args.max_nodes,
+        file_timeout=args.file_timeout,
+        time_limit=args.time_limit,
+    )
+
+    results: Iterable[Match | MissingPath | ReadError | WalkError | NonElementReturned | FileFinished]
+    if revisions or args.rev_range is not None:
+        results = git.search_git_revisions(
+            revisions,
+            expression,
+            paths=[p for p in paths if isinstance(p, Path)],
+            xpath2=args.xpath2,
+            include_hidden=args.hidden,
+            limits=limits,
+        )
+    elif args.staged:
+        # Staged files are read from the index, and may not exist in the working tree
+        assert changed_files is not None
+        results = git.search_staged_files(
+            changed_files,
+            expression,
+            xpath2=args.xpath2,
+            deduplicate=args.dedupe,
+            result_cache=result_cache,
+            limits=limits,
+        )
+    else:
+        results = search_python_files(
+            paths,
+            expression,
+            xpath2=args.xpath2,
+            include_hidden=args.hidden,
+            respect_global_ignores=not args.no_ignore_global,
+            respect_vcs_ignores=not args.no_ignore_vcs,
+            respect_dot_ignores=not args.no_ignore_dot,
+            search_archives=args.search_archives,
+            deduplicate=args.dedupe,
+            result_cache=result_cache,
+            index=index,
+            limits=limits,
         )
-    except XPathEvalError:
-        print(f"Invalid XPath expression: {expr}", file=sys.stderr)
+    if changed_lines is not None:
+        results = git.filter_changed_lines(results, changed_lines)
+
+    collected_stats: stats.Stats | None = None
+    tracer: trace.Tracer | None = None
+    profiler: profiling.Profiler | None = None
+    try:
+        with contextlib.ExitStack() as exit_stack:
+            if args.stats or args.stats_json:
+                collected_stats = exit_stack.enter_context(stats.collect_stats())
+            if args.trace is not None:
+                tracer = exit_stack.enter_context(trace.collect_trace())
+            if args.profile is not None:
+                profiler = exit_stack.enter_context(profiling.collect_profile())
+            # Time spent in the search that isn't in a specific phase isn't printing
+            results = stats.timed_iter(results, "other")
+            with stats.timed("print"):
+                if args.json:
+                    matches, errors = print_json_results(
+                        results, quiet=args.quiet, scope=args.scope, source=args.json_source
+                    )
+                else:
+                    matches, errors = print_results(
+                        results,
+                        print_xml=args.xml,
+                        print_ast=args.ast,
+                        quiet=args.quiet,
+                        context=context,
+                        heading=args.heading,
+                        colorer=colorer,
+                        scope=args.scope,
+                        # Like ripgrep, 0 means no limit
+                        max_columns=args.max_columns or None,
+                        max_columns_preview=args.max_columns_preview,
+                    )
+    except XPathError:
+        print(f"Invalid XPath expression: {' '.join(expressions.values())}", file=sys.stderr)
+        return ERROR
+    except git.GitError as ex:
+        print(f"ERROR: {ex}", file=sys.stderr)
         return ERROR
     except KeyboardInterrupt:
         sys.exit(1)
+    finally:
+        if result_cache is not None:
+            result_cache.close()
+        if index is not None:
+            index.close()
+        if collected_stats is not None:
+            print(collected_stats.to_json() if args.stats_json else collected_stats.to_text(), file=sys.stderr)
+        if tracer is not None:
+            tracer.write(args.trace)
+        if profiler is not None:
+            profiler.write(args.profile)
+            print(profiler.report(), file=sys.stderr)
     # Match ripgrep:
     if errors and not args.quiet:
         return ERROR
@@ -287,5 +749,38 @@ def main(sys_args: list[str] | None = None, stdin: BinaryIO | None = None) -> in
     return NO_MATCH_FOUND
 
 
+def load_rules_file(filename: str) -> dict[str, str]:
+    """
+    Load rules from a file with lines formatted as `rule_id: expression`
+    """
+    rules: dict[str, str] = {}
+    with open(filename, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            rule_id, _, expression = line.partition(":")
+            rule_id, expression = rule_id.strip(), expression.strip()
+            if not rule_id or not expression or any(c.isspace() for c in rule_id):
+                raise ValueError(f"{filename}:{lineno}: expected `rule_id: expression`")
+            if rule_id in rules:
+                raise ValueError(f"{filename}:{lineno}: duplicate rule id {rule_id}")
+            rules[rule_id] = expression
+    return rules
+
+
+def index_main(sys_args: list[str]) -> int:
+    """Entrypoint for `pyastgrep index`"""
+    args = index_parser.parse_args(args=sys_args)
+    paths = [Path(p) for p in args.path] or [Path(".")]
+    try:
+        total, parsed = build_index(args.index, paths, rebuild=args.action == "build", include_hidden=args.hidden)
+    except sqlite3.Error as ex:
+        print(f"ERROR: could not write index {args.index}: {ex}", file=sys.stderr)
+        return ERROR
+    print(f"Indexed {total} files ({parsed} parsed) in {args.index}", file=sys.stderr)
+    return 0
+
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -46,7 +46,10 @@ class Colorer(Protocol):
     def color_lineno(self, lineno: int) -> str:
         ...
 
-    def color_match(self, match: Match) -> str:
+    def color_match(self, match: Match, start: int = 0, stop: int | None = None) -> str:
+        """
+        Returns the matching line, or the columns `start:stop` of it, colored.
+        """
         ...
 
 
@@ -57,8 +60,8 @@ class NullColorer:
     def color_lineno(self, lineno: int) -> str:
         return str(lineno)
 
-    def color_match(self, match: Match) -> str:
-        return match.matching_line
+    def color_match(self, match: Match, start: int = 0, stop: int | None = None) -> str:
+        return match.matching_line[start:stop]
 
 
 class AnsiColorer:
@@ -73,7 +76,7 @@ class AnsiColorer:
     def color_lineno(self, lineno: int) -> str:
         return f"{self.lineno_color}{lineno}{Styles.END}"
 
-    def color_match(self, match: Match) -> str:
+    def color_match(self, match: Match, start: int = 0, stop: int | None = None) -> str:
         # A match could be an AST node as big as a function or class. In this
         # case:
         # 1) it doesn't make much sense to color it
@@ -89,13 +92,18 @@ class AnsiColorer:
             and match.position.lineno == ast_node.lineno == ast_node.end_lineno  # type: ignore [attr-defined]
         ):
             raw_line = match.matching_line
-            before = raw_line[0 : ast_node.col_offset]  # type: ignore [attr-defined]
-            matched = raw_line[ast_node.col_offset : ast_node.end_col_offset]  # type: ignore [attr-defined]
-            after = raw_line[ast_node.end_col_offset :]  # type: ignore [attr-defined]
+            if stop is None:
+                stop = len(raw_line)
+            # Only the part of the match between start and stop is colored
+            match_start = min(max(ast_node.col_offset, start), stop)  # type: ignore [attr-defined]
+            match_end = min(max(ast_node.end_col_offset, match_start), stop)  # type: ignore [attr-defined]
+            before = raw_line[start:match_start]
+            matched = raw_line[match_start:match_end]
+            after = raw_line[match_end:stop]
             return f"{before}{self.match_color}{matched}{Styles.END}{after}"
 
         else:
-            return match.matching_line
+            return match.matching_line[start:stop]
 
 
 # Based on ripgrep - https://github.com/BurntSushi/ripgrep/blob/304a60e8e9d4b2a42dc3dfb1ba4cef6d7bf92515/crates/printer/src/color.rs#L14
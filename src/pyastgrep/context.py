@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import ast
 from dataclasses import dataclass
 from typing import Protocol
 
@@ -30,14 +31,36 @@ class StaticContext:
 class StatementContext:
     def get_context_lines_for_result(self, result: Match) -> tuple[int, int]:
         result_node = result.ast_node
-        statement_node = ast_utils.get_ast_statement_node(result_node)
-        first_line = statement_node.lineno  # type: ignore [attr-defined]
-        if hasattr(statement_node, "decorator_list"):
-            decorator_list = statement_node.decorator_list  # type: ignore[reportAttributeAccessIssue]
-            first_line = min((first_line, *(n.lineno for n in decorator_list)))
+        first_line, end_line = ast_utils.get_statement_span(result_node)
         before_context = result_node.lineno - first_line  # type: ignore [attr-defined]
-        if isinstance(statement_node.end_lineno, int):  # type: ignore [attr-defined]
-            after_context = statement_node.end_lineno - result_node.lineno  # type: ignore [attr-defined]
+        if end_line is not None:
+            after_context = end_line - result_node.lineno  # type: ignore [attr-defined]
         else:
             after_context = 0
         return (before_context, after_context)
+
+
+@dataclass(frozen=True)
+class ScopeContext:
+    """
+    Context of the whole enclosing function or class, found using
+    `ast_utils.ScopeIndex`. Matches outside any function or class use the
+    statement context.
+    """
+
+    kind: str  # "function" or "class"
+
+    def get_context_lines_for_result(self, result: Match) -> tuple[int, int]:
+        scope = ast_utils.get_enclosing_scope(
+            result.ast_node, result.position.lineno, result.position.col_offset, SCOPE_TYPES[self.kind]
+        )
+        if scope is None:
+            return StatementContext().get_context_lines_for_result(result)
+        lineno = result.position.lineno
+        return (lineno - scope.first_line, max(0, scope.end_line - lineno))
+
+
+SCOPE_TYPES: dict[str, tuple[type[ast.AST], ...]] = {
+    "function": (ast.FunctionDef, ast.AsyncFunctionDef),
+    "class": (ast.ClassDef,),
+}
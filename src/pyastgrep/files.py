@@ -1,20 +1,24 @@
 from __future__ import annotations
 
 import ast
+import hashlib
 import os
 import re
 from dataclasses import dataclass
 from functools import cache
 from pathlib import Path
-from typing import BinaryIO, Callable, Iterable, Literal, Sequence, Union
+from typing import BinaryIO, Callable, Iterable, Sequence, Union
 
 from lxml.etree import _Element
 from typing_extensions import TypeAlias
 
+from . import stats
 from .asts import ast_to_xml
 from .ignores import DirWalker, WalkError
+from .limits import LimitExceeded, Limits, check_deadline, check_filesize
 
-Pathlike: TypeAlias = Union[Path, Literal["<stdin>"]]
+# Names of in-memory sources, e.g. "<stdin>", are plain strings
+Pathlike: TypeAlias = Union[Path, str]
 
 
 @dataclass(frozen=True)
@@ -28,12 +32,23 @@ class ReadError:
     exception: Exception
 
 
+@dataclass(frozen=True)
+class SkippedFile(ReadError):
+    """
+    A file that was skipped, or only partially searched, because it exceeded
+    one of the `Limits` for the search.
+    """
+
+    exception: LimitExceeded
+
+
 def get_files_to_search(
     paths: Sequence[Path | BinaryIO],
     include_hidden: bool = False,
     respect_global_ignores: bool = True,
     respect_vcs_ignores: bool = True,
     respect_dot_ignores: bool = True,
+    search_archives: bool = False,
 ) -> Iterable[Path | BinaryIO | MissingPath | WalkError]:
     """
     Entry-point function for finding files to search.
@@ -43,15 +58,38 @@ def get_files_to_search(
 
     By default, global .gitignore file will be respected - pass
     `respect_global_ignores=False` to ignore it
+
+    Archives (wheels, zip files etc.) found while walking directories are
+    included if `search_archives=True`.
+
+    If overlapping paths are passed (e.g. `.` and `src`), each file is only
+    returned once.
     """
+    if search_archives:
+        from .archives import ARCHIVE_GLOBS
+
+        extra_globs: Sequence[str] = ARCHIVE_GLOBS
+    else:
+        extra_globs = ()
     walker = DirWalker(
         glob="*.py",
+        extra_globs=extra_globs,
         include_hidden=include_hidden,
         respect_global_ignores=respect_global_ignores,
         respect_vcs_ignores=respect_vcs_ignores,
         respect_dot_ignores=respect_dot_ignores,
     )
     working_dir = Path(os.getcwd())
+    found = _get_files_to_search(paths, walker, working_dir)
+    if len(paths) > 1:
+        # Only with multiple paths can we find the same file twice
+        found = _without_duplicate_files(found)
+    yield from found
+
+
+def _get_files_to_search(
+    paths: Sequence[Path | BinaryIO], walker: DirWalker, working_dir: Path
+) -> Iterable[Path | BinaryIO | MissingPath | WalkError]:
     for path in paths:
         if isinstance(path, Path):
             if not path.exists():
@@ -65,6 +103,43 @@ def get_files_to_search(
             yield path
 
 
+def _without_duplicate_files(
+    found: Iterable[Path | BinaryIO | MissingPath | WalkError],
+) -> Iterable[Path | BinaryIO | MissingPath | WalkError]:
+    # Paths can be spelled differently, so we compare by inode
+    seen: set[tuple[int, int]] = set()
+    for item in found:
+        if isinstance(item, Path):
+            stats.count("stat_calls", subject=item)
+            try:
+                stat_result = item.stat()
+            except OSError:
+                pass
+            else:
+                file_id = (stat_result.st_dev, stat_result.st_ino)
+                if file_id in seen:
+                    continue
+                seen.add(file_id)
+        yield item
+
+
+def read_file(path: Path) -> bytes:
+    """
+    Returns the contents of the file, recording stats.
+    """
+    with stats.timed("read", path):
+        contents = path.read_bytes()
+    stats.count("bytes_read", len(contents), subject=path)
+    return contents
+
+
+def content_hash(contents: bytes) -> bytes:
+    """
+    Returns a hash of file contents, for finding files with identical contents.
+    """
+    return hashlib.blake2b(contents, digest_size=16).digest()
+
+
 # See https://peps.python.org/pep-0263/
 # I couldn't find a stdlib function for this
 _ENCODING_RE = re.compile(b"^[ \t\f]*#.*?coding[:=][ \t]*([-_.a-zA-Z0-9]+)")
@@ -91,23 +166,40 @@ def get_encoding(python_file_bytes: bytes) -> str:
     return "utf-8"
 
 
-def parse_python_file(contents: bytes, filename: str | Path, *, auto_dedent: bool) -> tuple[str, ast.AST]:
+def parse_python_file(
+    contents: bytes, filename: str | Path, *, auto_dedent: bool, max_nodes: int | None = None
+) -> tuple[str, ast.AST]:
     """
     Parse Python file and return a tuple of (contents as string, AST of parsed contents)
+
+    Raises LimitExceeded if the AST has more than `max_nodes` nodes.
     """
+    if b"\0" in contents:
+        # Most likely a binary file. ast.parse would reject it, but only after
+        # decoding all of it, which can be slow for large files.
+        raise ValueError("source code string cannot contain null bytes")
     if auto_dedent:
         contents = auto_dedent_code(contents)
 
-    parsed_ast: ast.AST = ast.parse(contents, str(filename))
-    # Need `parent` backlinks for StatementContext and for position_from_node:
-    for node in ast.walk(parsed_ast):
-        for child in ast.iter_child_nodes(node):
-            child.parent = node  # type: ignore
+    with stats.timed("parse", filename):
+        parsed_ast: ast.AST = ast.parse(contents, str(filename))
+        # ast.parse does it's own encoding detection, which we have to replicate
+        # here since we can't assume utf-8
+        encoding = get_encoding(contents)
+        str_contents = contents.decode(encoding)
+    stats.count("files_parsed", subject=filename)
+    check_deadline()
+
+    with stats.timed("link", filename):
+        # Need `parent` backlinks for StatementContext and for position_from_node:
+        node_count = 0
+        for node in ast.walk(parsed_ast):
+            node_count += 1
+            if max_nodes is not None and node_count > max_nodes:
+                raise LimitExceeded(f"more than {max_nodes} AST nodes")
+            for child in ast.iter_child_nodes(node):
+                child.parent = node  # type: ignore
 
-    # ast.parse does it's own encoding detection, which we have to replicate
-    # here since we can't assume utf-8
-    encoding = get_encoding(contents)
-    str_contents = contents.decode(encoding)
     return str_contents, parsed_ast
 
 
@@ -150,19 +242,34 @@ class ProcessedPython:
     node_mappings: dict[_Element, ast.AST]
 
 
-def process_python_file(path: Path) -> ProcessedPython | ReadError:
+def process_python_file(path: Path, *, limits: Limits | None = None) -> ProcessedPython | ReadError:
     """
     Reads the Python file at Python, and converts to XML format.
     Returns a `ProcessessPython` object.
 
-    Returns ReadError for cases of OSError when reading or SyntaxError in the file.
+    Returns ReadError for cases of OSError when reading or SyntaxError in the file,
+    and SkippedFile if the file exceeds `limits`.
     """
     try:
-        contents = path.read_bytes()
+        contents = read_file_within_limits(path, limits)
+    except LimitExceeded as ex:
+        return SkippedFile(str(path), ex)
     except OSError as ex:
         return ReadError(str(path), ex)
 
-    return process_python_source(filename=path, contents=contents, auto_dedent=False)
+    return process_python_source(filename=path, contents=contents, auto_dedent=False, limits=limits)
+
+
+def read_file_within_limits(path: Path, limits: Limits | None) -> bytes:
+    """
+    Reads the file at `path`, raising LimitExceeded, without reading it, if it
+    is larger than `limits` allow.
+    """
+    if limits is not None and limits.max_filesize is not None:
+        # Avoid reading huge files at all
+        stats.count("stat_calls", subject=path)
+        check_filesize(path.stat().st_size, limits)
+    return read_file(path)
 
 
 process_python_file_cached: Callable[[Path], ProcessedPython | ReadError] = cache(process_python_file)
@@ -173,18 +280,28 @@ def process_python_source(
     filename: Pathlike,
     contents: bytes,
     auto_dedent: bool,
+    limits: Limits | None = None,
 ) -> ProcessedPython | ReadError:
     node_mappings: dict[_Element, ast.AST] = {}
 
     try:
-        str_contents, parsed_ast = parse_python_file(contents, filename, auto_dedent=auto_dedent)
+        check_filesize(len(contents), limits)
+        str_contents, parsed_ast = parse_python_file(
+            contents, filename, auto_dedent=auto_dedent, max_nodes=limits.max_nodes if limits is not None else None
+        )
+        check_deadline()
+    except LimitExceeded as ex:
+        return SkippedFile(str(filename), ex)
     except (SyntaxError, ValueError) as ex:
         return ReadError(str(filename), ex)
 
-    xml_ast = ast_to_xml(
-        parsed_ast,
-        node_mappings,
-    )
+    with stats.timed("convert", filename):
+        xml_ast = ast_to_xml(
+            parsed_ast,
+            node_mappings,
+        )
+    stats.count("files_converted", subject=filename)
+    stats.count("ast_nodes", len(node_mappings), subject=filename)
     return ProcessedPython(
         path=filename,
         contents=str_contents,
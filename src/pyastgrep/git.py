@@ -0,0 +1,407 @@
+"""
+Integration with git, for searching only the files that have changed, and for
+searching revisions directly from the git object store.
+
+All paths are returned relative to the current working directory, to match
+what the directory walker produces, and only files below the current working
+directory are considered.
+"""
+from __future__ import annotations
+
+import bisect
+import codecs
+import fnmatch
+import re
+import subprocess
+import time
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import IO, Callable, Iterable, Sequence, TypeVar
+
+from .cache import ResultCache
+from .files import ProcessedPython, ReadError, SkippedFile, content_hash, process_python_source
+from .limits import Limits, time_limit_exceeded
+from .search import (
+    Expressions,
+    FileFinished,
+    Match,
+    NonElementReturned,
+    SearchedContents,
+    get_query_func,
+    limit_file_time,
+    make_rules,
+    process_and_search,
+    search_with_result_cache,
+)
+
+T = TypeVar("T")
+
+PYTHON_GLOB = "*.py"
+
+
+class GitError(Exception):
+    """
+    Raised when a git command fails, e.g. not a git repo, or an unknown revision.
+    """
+
+
+def run_git(args: list[str]) -> bytes:
+    try:
+        completed = subprocess.run(["git", "-c", "core.quotepath=off", *args], capture_output=True)
+    except OSError as ex:
+        raise GitError(f"Could not run git: {ex}") from ex
+    if completed.returncode != 0:
+        raise GitError(completed.stderr.decode("utf-8", errors="replace").strip())
+    return completed.stdout
+
+
+def get_merge_base(rev: str) -> str:
+    """
+    Returns the commit SHA of the merge base of `rev` and HEAD
+    """
+    return run_git(["merge-base", rev, "HEAD"]).decode("ascii").strip()
+
+
+def _diff_args(*, base: str | None, staged: bool) -> list[str]:
+    args = ["diff", "--no-renames", "--relative"]
+    if staged:
+        args.append("--cached")
+    if base is not None:
+        args.append(base)
+    return args
+
+
+def _is_python_path(path: str) -> bool:
+    return fnmatch.fnmatch(path.rsplit("/", 1)[-1], PYTHON_GLOB)
+
+
+@dataclass(frozen=True)
+class ChangedFile:
+    path: Path
+    # SHA of the blob in the index, for staged files only.
+    blob_sha: str | None = None
+
+
+def get_changed_files(*, since: str | None = None, staged: bool = False) -> list[ChangedFile]:
+    """
+    Returns the Python files changed since the merge base of `since` and HEAD,
+    or the Python files with staged changes if `staged=True`.
+
+    Deleted files are not included.
+    """
+    if since is None and not staged:
+        raise ValueError("One of `since` or `staged` must be provided")
+    base = get_merge_base(since) if since is not None else None
+    # --raw gives us the SHA of the blob in the index, which we need for
+    # staged files, and is no more expensive than --name-only
+    output = run_git(_diff_args(base=base, staged=staged) + ["--raw", "-z", "--no-abbrev", "--diff-filter=d"])
+    # Format is ":<old mode> <new mode> <old sha> <new sha> <status>\0<path>\0"
+    fields = output.split(b"\0")
+    changed = []
+    for info, raw_path in zip(fields[0::2], fields[1::2]):
+        path = raw_path.decode("utf-8", errors="surrogateescape")
+        if not _is_python_path(path):
+            continue
+        new_sha = info.split(b" ")[3].decode("ascii")
+        changed.append(ChangedFile(path=Path(path), blob_sha=new_sha if staged else None))
+    return changed
+
+
+def restrict_to_paths(changed_files: Sequence[ChangedFile], paths: Sequence[Path]) -> list[ChangedFile]:
+    """
+    Filter `changed_files` to those that are equal to or under one of `paths`.
+    """
+    if not paths:
+        return list(changed_files)
+    parents = [p.parts for p in paths if p != Path(".")]
+    if len(parents) < len(paths):
+        # "." was passed, which includes everything
+        return list(changed_files)
+    return [f for f in changed_files if any(f.path.parts[: len(parts)] == parts for parts in parents)]
+
+
+def search_staged_files(
+    changed_files: Sequence[ChangedFile],
+    expression: Expressions,
+    *,
+    xpath2: bool = False,
+    deduplicate: bool = False,
+    result_cache: ResultCache | None = None,
+    limits: Limits | None = None,
+) -> Iterable[Match | ReadError | NonElementReturned | FileFinished]:
+    """
+    Search the staged contents of `changed_files`, as returned by
+    `get_changed_files(staged=True)`, reading them from the git index.
+
+    The working tree is not used at all, so files that have been changed or
+    deleted since they were staged are searched as staged.
+
+    `deduplicate`, `result_cache` and `limits` are applied as for
+    `search_python_files`, with files identified by their staged contents.
+    """
+    start_time = time.monotonic()
+    query_func = get_query_func(xpath2=xpath2)
+    rules = make_rules(expression)
+    searched_contents = SearchedContents() if deduplicate else None
+
+    with GitCatFile() as cat_file:
+
+        def search_staged_file(changed_file: ChangedFile) -> Iterable[Match | ReadError | NonElementReturned]:
+            if changed_file.blob_sha is None:
+                yield ReadError(str(changed_file.path), LookupError("File is not staged"))
+                return
+            try:
+                contents = cat_file.read_blob(changed_file.blob_sha)
+            except GitError as ex:
+                yield ReadError(str(changed_file.path), ex)
+                return
+            process = partial(
+                process_python_source, filename=changed_file.path, contents=contents, auto_dedent=False, limits=limits
+            )
+            if result_cache is not None:
+                yield from search_with_result_cache(
+                    content_hash(contents), process, query_func, rules, result_cache=result_cache, limits=limits
+                )
+            else:
+                yield from process_and_search(process, query_func, rules)
+
+        for changed_file in changed_files:
+            if (exceeded := time_limit_exceeded(start_time, limits)) is not None:
+                yield SkippedFile(str(changed_file.path), exceeded)
+                return
+            search = partial(search_staged_file, changed_file)
+            if searched_contents is not None and changed_file.blob_sha is not None:
+                results = searched_contents.search(changed_file.path, changed_file.blob_sha, search)
+            else:
+                results = search()
+            yield from limit_file_time(results, str(changed_file.path), limits)
+            yield FileFinished(changed_file.path)
+
+
+# Changed lines
+
+_HUNK_HEADER_RE = re.compile(rb"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+
+
+class ChangedLines:
+    """
+    Line ranges of new/modified lines, for each changed file.
+    """
+
+    def __init__(self, ranges: dict[Path, list[tuple[int, int]]]):
+        # For each path, a sorted list of non-overlapping (start, stop) 1-indexed line ranges,
+        # `stop` being exclusive. We store starts separately for bisect.
+        self.ranges = ranges
+        self.starts = {path: [start for start, _ in path_ranges] for path, path_ranges in ranges.items()}
+
+    def contains(self, path: Path, lineno: int) -> bool:
+        starts = self.starts.get(path)
+        if not starts:
+            return False
+        idx = bisect.bisect_right(starts, lineno) - 1
+        return idx >= 0 and lineno < self.ranges[path][idx][1]
+
+
+def _unquote_diff_path(raw_path: bytes) -> str:
+    # git uses C-style quoting for paths with unusual characters
+    if raw_path.startswith(b'"') and raw_path.endswith(b'"'):
+        raw_path = codecs.escape_decode(raw_path[1:-1])[0]
+    return raw_path.decode("utf-8", errors="surrogateescape")
+
+
+def get_changed_lines(*, since: str | None = None, staged: bool = False) -> ChangedLines:
+    """
+    Returns the line ranges that were added or modified, with the same
+    meaning of `since` and `staged` as for `get_changed_files`.
+    """
+    if since is None and not staged:
+        raise ValueError("One of `since` or `staged` must be provided")
+    base = get_merge_base(since) if since is not None else None
+    output = run_git(
+        _diff_args(base=base, staged=staged)
+        + [
+            "-U0",
+            "--no-color",
+            "--no-ext-diff",
+            "--src-prefix=a/",
+            "--dst-prefix=b/",
+            "--diff-filter=d",
+        ]
+    )
+    ranges: dict[Path, list[tuple[int, int]]] = {}
+    current: list[tuple[int, int]] | None = None
+    for line in output.split(b"\n"):
+        if line.startswith(b"+++ "):
+            # git adds a tab after paths containing spaces
+            target = line[4:].rstrip(b"\t")
+            if target == b"/dev/null":
+                current = None
+                continue
+            path = _unquote_diff_path(target)
+            # strip "b/" prefix
+            path = path.split("/", 1)[1] if "/" in path else path
+            current = ranges.setdefault(Path(path), [])
+        elif line.startswith(b"@@") and current is not None:
+            hunk_match = _HUNK_HEADER_RE.match(line)
+            if hunk_match is None:
+                continue
+            start = int(hunk_match.group(1))
+            count = int(hunk_match.group(2)) if hunk_match.group(2) is not None else 1
+            if count > 0:
+                current.append((start, start + count))
+    return ChangedLines(ranges)
+
+
+def filter_changed_lines(results: Iterable[T], changed_lines: ChangedLines) -> Iterable[T]:
+    """
+    Filter search results, removing `Match` objects that are not on changed lines.
+
+    Other result types are passed through unchanged.
+    """
+    for result in results:
+        if isinstance(result, Match) and isinstance(result.path, Path):
+            if not changed_lines.contains(result.path, result.position.lineno):
+                continue
+        yield result
+
+
+# Searching revisions
+
+
+class GitCatFile:
+    """
+    Reads objects from the git object store, using a single long-lived
+    `git cat-file --batch` process.
+    """
+
+    def __init__(self) -> None:
+        try:
+            self.process = subprocess.Popen(
+                ["git", "cat-file", "--batch"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError as ex:
+            raise GitError(f"Could not run git: {ex}") from ex
+        assert self.process.stdin is not None and self.process.stdout is not None
+        self.stdin: IO[bytes] = self.process.stdin
+        self.stdout: IO[bytes] = self.process.stdout
+
+    def read_blob(self, sha: str) -> bytes:
+        self.stdin.write(sha.encode("ascii") + b"\n")
+        self.stdin.flush()
+        # Header is "<sha> <type> <size>\n", or "<object> missing\n"
+        header = self.stdout.readline().split()
+        if len(header) != 3:
+            raise GitError(f"Could not read object {sha}")
+        _, object_type, size = header
+        contents = self.stdout.read(int(size))
+        self.stdout.read(1)  # trailing newline
+        if object_type != b"blob":
+            raise GitError(f"Object {sha} is a {object_type.decode('ascii')}, not a blob")
+        return contents
+
+    def close(self) -> None:
+        self.stdin.close()
+        self.process.wait()
+        self.stdout.close()
+
+    def __enter__(self) -> GitCatFile:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
+@dataclass(frozen=True)
+class TreeEntry:
+    path: Path
+    blob_sha: str
+
+
+def get_revisions_in_range(rev_range: str) -> list[str]:
+    """
+    Returns abbreviated commit SHAs for the revision range e.g. `v1.0..main`,
+    oldest first.
+    """
+    output = run_git(["rev-list", "--reverse", "--abbrev-commit", rev_range])
+    return output.decode("ascii").split()
+
+
+def get_python_tree_entries(
+    revision: str, paths: Sequence[Path] = (), *, include_hidden: bool = False
+) -> list[TreeEntry]:
+    """
+    Returns the Python files in the given revision, restricted to `paths`
+    if passed.
+    """
+    output = run_git(["ls-tree", "-r", "-z", revision, "--", *(str(p) for p in paths)])
+    entries = []
+    # Format is "<mode> <type> <sha>\t<path>\0"
+    for line in output.split(b"\0"):
+        if not line:
+            continue
+        info, raw_path = line.split(b"\t", 1)
+        _, object_type, sha = info.split(b" ")
+        path = raw_path.decode("utf-8", errors="surrogateescape")
+        if object_type != b"blob" or not _is_python_path(path):
+            continue
+        if not include_hidden and any(part.startswith(".") for part in path.split("/")):
+            continue
+        entries.append(TreeEntry(path=Path(path), blob_sha=sha.decode("ascii")))
+    return entries
+
+
+def search_git_revisions(
+    revisions: Sequence[str],
+    expression: Expressions,
+    *,
+    paths: Sequence[Path] = (),
+    xpath2: bool = False,
+    include_hidden: bool = False,
+    limits: Limits | None = None,
+) -> Iterable[Match | ReadError | NonElementReturned | FileFinished]:
+    """
+    Search Python files in the given git revisions, reading them directly from
+    the git object store without checking anything out.
+
+    Paths are reported as "<revision>:<path>". Each distinct blob is parsed
+    and searched only once, however many revisions and paths refer to it.
+
+    `limits` are applied as for `search_python_files`.
+    """
+    start_time = time.monotonic()
+    query_func = get_query_func(xpath2=xpath2)
+    rules = make_rules(expression)
+    searched_contents = SearchedContents()
+
+    with GitCatFile() as cat_file:
+
+        def reader(display_path: Path, blob_sha: str) -> Callable[[], ProcessedPython | ReadError]:
+            def process() -> ProcessedPython | ReadError:
+                try:
+                    contents = cat_file.read_blob(blob_sha)
+                except GitError as ex:
+                    return ReadError(str(display_path), ex)
+                return process_python_source(filename=display_path, contents=contents, auto_dedent=False, limits=limits)
+
+            return process
+
+        for revision in revisions:
+            for entry in get_python_tree_entries(revision, paths, include_hidden=include_hidden):
+                display_path = Path(f"{revision}:{entry.path.as_posix()}")
+                if (exceeded := time_limit_exceeded(start_time, limits)) is not None:
+                    yield SkippedFile(str(display_path), exceeded)
+                    return
+                yield from limit_file_time(
+                    searched_contents.search(
+                        display_path,
+                        entry.blob_sha,
+                        lambda: process_and_search(reader(display_path, entry.blob_sha), query_func, rules),
+                    ),
+                    str(display_path),
+                    limits,
+                )
+                yield FileFinished(display_path)
@@ -18,15 +18,19 @@ With some known differences/unimplemented features/bugs:
 """
 from __future__ import annotations
 
+import fnmatch
 import logging
+import os
 import subprocess
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Iterable, Union, overload
+from typing import Any, Iterable, Sequence, Union, overload
 
 from pathspec import GitIgnoreSpec, PathSpec
 from pathspec.patterns.gitignore.spec import GitIgnoreSpecPattern
 
+from . import stats
+
 logger = logging.getLogger(__name__)
 
 
@@ -52,7 +56,7 @@ class DirectoryPathSpec:
         self.location = location
         self.pathspec = pathspec
 
-    def match_file(self, path: Path) -> bool:
+    def match_file(self, path: Path, *, is_dir: bool = False) -> bool:
         try:
             relative = path.relative_to(self.location)
         except ValueError:
@@ -63,7 +67,7 @@ class DirectoryPathSpec:
             # Rather than crash, we ignore the file
             return False
         else:
-            return self.pathspec.match_file(relative)
+            return self.pathspec.match_file(with_trailing_slash(relative) if is_dir else relative)
 
     def __repr__(self) -> str:
         return f"<DirectoryPathSpec {self.location!r} {self.pathspec!r}>"
@@ -77,6 +81,14 @@ class GlobalGitIgnoreSpec(GitIgnoreSpec):
 PathSpecLike = Union[PathSpec, DirectoryPathSpec]
 
 
+def with_trailing_slash(directory: Path) -> str:
+    """
+    Returns the directory path with a trailing slash, which is how pathspecs
+    know it is a directory.
+    """
+    return os.path.join(directory, "")
+
+
 class _Default:
     """
     Sentinel for default values to function/method args
@@ -104,14 +116,15 @@ def add_negative_dir_pattern(pathspec: PathSpec | DirectoryPathSpec, directory:
 
 class DirWalker:
     """
-    Walks a directory recursively, returning files that match a glob,
-    while automatically respecting dot-ignore files
+    Walks a directory recursively, returning files that match a glob
+    (or one of `extra_globs`), while automatically respecting dot-ignore files
     """
 
     def __init__(
         self,
         *,
         glob: str,
+        extra_globs: Sequence[str] = (),
         pathspecs: list[PathSpecLike] = DEFAULT,
         init_global_pathspecs: bool = True,
         start_directory: Path | None = None,
@@ -124,6 +137,7 @@ class DirWalker:
     ):
         # DirWalker is immutable outside __init__
         self.glob: str = glob
+        self.extra_globs: Sequence[str] = extra_globs
         if pathspecs is DEFAULT:
             pathspecs = []
         if init_global_pathspecs:
@@ -153,15 +167,16 @@ class DirWalker:
         # more needed, up to and including the current directory.
         base_directory = directory.resolve()
         pathspecs = self.pathspecs
-        if self.respect_vcs_ignores:
-            pathspecs = pathspecs + [
-                pathspec_for_gitignore(ignorepath)
-                for ignorepath in find_gitignore_files(base_directory, recurse_up=True)
-            ]
-        if self.respect_dot_ignores:
-            pathspecs = pathspecs + [
-                pathspec_for_rgignore(ignorepath) for ignorepath in find_rgignore_files(base_directory)
-            ]
+        with stats.timed("ignore", base_directory):
+            if self.respect_vcs_ignores:
+                pathspecs = pathspecs + [
+                    pathspec_for_gitignore(ignorepath)
+                    for ignorepath in find_gitignore_files(base_directory, recurse_up=True)
+                ]
+            if self.respect_dot_ignores:
+                pathspecs = pathspecs + [
+                    pathspec_for_rgignore(ignorepath) for ignorepath in find_rgignore_files(base_directory)
+                ]
 
         # We also need to add a negative override to ensure that paths specified
         # directly are not ignored.
@@ -188,14 +203,16 @@ class DirWalker:
         if self.start_directory is None:
             raise AssertionError("Must use `for_dir` before `for_subdir`")
         extra_pathspecs = []
-        if self.respect_vcs_ignores:
-            extra_pathspecs: list[PathSpecLike] = extra_pathspecs + [
-                pathspec_for_gitignore(ignorepath) for ignorepath in find_gitignore_files(directory, recurse_up=False)
-            ]
-        if self.respect_dot_ignores:
-            extra_pathspecs: list[PathSpecLike] = extra_pathspecs + [
-                pathspec_for_rgignore(ignorepath) for ignorepath in find_rgignore_files(directory)
-            ]
+        with stats.timed("ignore", directory):
+            if self.respect_vcs_ignores:
+                extra_pathspecs: list[PathSpecLike] = extra_pathspecs + [
+                    pathspec_for_gitignore(ignorepath)
+                    for ignorepath in find_gitignore_files(directory, recurse_up=False)
+                ]
+            if self.respect_dot_ignores:
+                extra_pathspecs: list[PathSpecLike] = extra_pathspecs + [
+                    pathspec_for_rgignore(ignorepath) for ignorepath in find_rgignore_files(directory, recurse_up=False)
+                ]
 
         return self._clone(
             pathspecs=self.pathspecs + extra_pathspecs,
@@ -205,48 +222,71 @@ class DirWalker:
     def walk(self) -> Iterable[Path | WalkError]:
         if self.start_directory is None or self.working_dir is None:
             raise AssertionError("Must use `for_dir` before `walk`")
-        for filepath in self.start_directory.glob(self.glob):
-            if filepath.is_symlink():
-                # Follow default behaviour of ripgrep, and avoid issues with
-                # `resolve().relative_to(working_dir)
-                logger.debug("Ignoring symlink %s", filepath)
-                continue
-            if filepath.is_file():
-                pathspec_matched = False
-                for pathspec in self.pathspecs:
-                    if pathspec.match_file(filepath):
-                        pathspec_matched = True
-                        logger.debug("Ignoring path %s because it matches pathspec %s", filepath, pathspec)
-                        break
-                if pathspec_matched:
+        # The directory is listed once, and we use the file types from the
+        # listing, which usually avoids a `stat` call for each entry.
+        stats.count("dirs_visited", subject=self.start_directory)
+        with stats.timed("walk", self.start_directory):
+            try:
+                with os.scandir(self.start_directory) as scandir_it:
+                    entries = list(scandir_it)
+            except PermissionError as e:
+                yield WalkError(self.start_directory, e)
+                return
+        for glob in [self.glob, *self.extra_globs]:
+            for entry in entries:
+                if not fnmatch.fnmatch(entry.name, glob):
                     continue
-                if self.absolute_base:
-                    yield filepath
-                else:
-                    yield filepath.resolve().relative_to(self.working_dir)
-
-        for subdir in tolerant_iterdir(self.start_directory):
-            if not isinstance(subdir, Path):
-                yield subdir
-                continue
+                filepath = Path(entry.path)
+                if entry.is_symlink():
+                    # Follow default behaviour of ripgrep, and avoid issues with
+                    # `relative_to(working_dir)`
+                    logger.debug("Ignoring symlink %s", filepath)
+                    stats.count("files_ignored")
+                    continue
+                if entry.is_file():
+                    with stats.timed("ignore", filepath):
+                        pathspec_matched = self._matches_pathspec(filepath)
+                    if pathspec_matched:
+                        stats.count("files_ignored")
+                        continue
+                    if self.absolute_base:
+                        yield filepath
+                    else:
+                        # `start_directory` is resolved, and we don't follow
+                        # symlinks, so `filepath` doesn't need resolving.
+                        yield filepath.relative_to(self.working_dir)
+
+        for entry in entries:
+            subdir = Path(entry.path)
             try:
-                if subdir.is_symlink():
+                if entry.is_symlink():
                     logger.debug("Ignoring symlink %s", subdir)
                     continue
+                is_dir = entry.is_dir()
             except PermissionError:
                 logger.debug("Ignoring unreadable file %s", subdir)
                 continue
-            if subdir.is_dir():
-                pathspec_matched = False
-                for pathspec in self.pathspecs:
-                    if pathspec.match_file(subdir):
-                        pathspec_matched = True
-                        logger.debug("Ignoring path %s because it matches pathspec %s", subdir, pathspec)
-                        break
+            if is_dir:
+                with stats.timed("ignore", subdir):
+                    # Directory patterns like `build/` only match with a
+                    # trailing slash. Matching directories means we don't walk
+                    # ignored directories such as `node_modules` at all.
+                    pathspec_matched = self._matches_pathspec(subdir, is_dir=True)
                 if pathspec_matched:
                     continue
                 yield from self.for_subdir(subdir).walk()
 
+    def _matches_pathspec(self, path: Path, *, is_dir: bool = False) -> bool:
+        for pathspec in self.pathspecs:
+            if isinstance(pathspec, DirectoryPathSpec):
+                matched = pathspec.match_file(path, is_dir=is_dir)
+            else:
+                matched = pathspec.match_file(with_trailing_slash(path) if is_dir else path)
+            if matched:
+                logger.debug("Ignoring path %s because it matches pathspec %s", path, pathspec)
+                return True
+        return False
+
     def _clone(
         self,
         *,
@@ -257,6 +297,7 @@ class DirWalker:
     ) -> DirWalker:
         return DirWalker(
             glob=self.glob,
+            extra_globs=self.extra_globs,
             pathspecs=pathspecs,
             init_global_pathspecs=False,
             start_directory=start_directory,
@@ -267,13 +308,6 @@ class DirWalker:
         )
 
 
-def tolerant_iterdir(directory: Path) -> Iterable[Path | WalkError]:
-    try:
-        yield from directory.iterdir()
-    except PermissionError as e:
-        yield WalkError(directory, e)
-
-
 def pathspec_for_rgignore(rgignore_file: Path) -> PathSpec | DirectoryPathSpec:
     return pathspec_for_gitignore(rgignore_file)
 
@@ -283,6 +317,7 @@ def pathspec_for_gitignore(gitignore_file: Path, is_global_gitignore: bool = Fal
 
 
 def _pathspec_for_ignore_general(ignore_file: Path, is_global_gitignore: bool = False) -> PathSpec | DirectoryPathSpec:
+    stats.count("ignore_files_read", subject=ignore_file)
     try:
         with open(ignore_file) as fp:
             if is_global_gitignore:
@@ -303,15 +338,12 @@ def find_gitignore_files(starting_path: Path, *, recurse_up: bool = True) -> lis
     return _find_ignore_files_general(starting_path, ignore_file_name=".gitignore", recurse_up=recurse_up)
 
 
-def find_rgignore_files(starting_path: Path) -> list[Path]:
+def find_rgignore_files(starting_path: Path, *, recurse_up: bool = True) -> list[Path]:
     """
     For a given working dir, returns a list of .rgignore files
     that apply to it.
     """
-    # We don't recurse up here, because there is no implied stopping point of a top level `.git` folder
-    # that we necessarily expect.
-
-    return _find_ignore_files_general(starting_path, ignore_file_name=".rgignore")
+    return _find_ignore_files_general(starting_path, ignore_file_name=".rgignore", recurse_up=recurse_up)
 
 
 def _find_ignore_files_general(starting_path: Path, *, ignore_file_name: str, recurse_up: bool = True) -> list[Path]:
@@ -323,9 +355,12 @@ def _find_ignore_files_general(starting_path: Path, *, ignore_file_name: str, re
 
     # Not 100% sure this is correct or what ripgrep does,
     # but it probably covers the most common setups
-    current_path = starting_path.resolve()
+    # When not recursing up, the path is used as it is, to avoid the cost of
+    # resolving it for every directory we walk.
+    current_path = starting_path.resolve() if recurse_up else starting_path
     while True:
         candidate = current_path / ignore_file_name
+        stats.count("stat_calls", subject=current_path)
         try:
             if candidate.exists():
                 files.append(candidate)
@@ -334,6 +369,7 @@ def _find_ignore_files_general(starting_path: Path, *, ignore_file_name: str, re
             logger.debug("Ignoring unreadable dir %s", current_path)
         if not recurse_up:
             break
+        stats.count("stat_calls", subject=current_path)
         try:
             if (current_path / ".git").exists():
                 # Found the root git repo, stop searching
@@ -0,0 +1,438 @@
+"""
+Persistent inverted index of AST facts, for narrowing down the files that
+need to be searched.
+
+For each file, we store a set of "facts" - the XML element tags it contains, and
+the values of some key attributes e.g. `Name/@id`. For an expression, we
+conservatively work out which facts are required for it to match anything, and
+then skip files that are known (from the index) not to have them. Files that are
+not in the index, or that have changed since they were indexed, are always
+searched, so using the index never changes results, only which files get
+evaluated.
+
+The index is stored in a SQLite file, and can be updated incrementally.
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import sys
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable, Sequence
+
+from lxml.etree import _Element
+
+from . import __version__
+from .files import ReadError, content_hash, get_files_to_search, process_python_source
+from .ignores import WalkError
+from .xpath_syntax import Token, attribute_equality, split_conjuncts, split_top_level, tokenize
+
+DEFAULT_INDEX_FILE = ".pyastgrep-index.sqlite"
+
+# The attributes we index values for, by element tag
+INDEXED_ATTRIBUTES: dict[str, tuple[str, ...]] = {
+    "Name": ("id",),
+    "Attribute": ("attr",),
+    "FunctionDef": ("name",),
+    "AsyncFunctionDef": ("name",),
+    "ClassDef": ("name",),
+    "ImportFrom": ("module",),
+    "alias": ("name",),
+    "arg": ("arg",),
+    "keyword": ("arg",),
+    "Constant": ("value",),
+}
+
+# Longer attribute values are not indexed, to keep the index small
+MAX_VALUE_LENGTH = 100
+
+
+def tag_fact(tag: str) -> str:
+    return tag
+
+
+def attribute_fact(tag: str, attribute: str, value: str) -> str:
+    return f"{tag}/@{attribute}={value}"
+
+
+def extract_facts(xml_root: _Element, tag_counts: Counter[str] | None = None) -> set[str]:
+    """
+    Returns the facts for the document. If `tag_counts` is passed, it is
+    updated with the number of elements with each tag.
+    """
+    facts = set()
+    for element in xml_root.iter():
+        tag = element.tag
+        assert isinstance(tag, str)
+        facts.add(tag_fact(tag))
+        if tag_counts is not None:
+            tag_counts[tag] += 1
+        for attribute in INDEXED_ATTRIBUTES.get(tag, ()):
+            value = element.get(attribute)
+            if value is not None and len(value) <= MAX_VALUE_LENGTH:
+                facts.add(attribute_fact(tag, attribute, value))
+    return facts
+
+
+# Expression analysis
+#
+# For anything we don't understand, we return fewer required facts (possibly
+# none), which is always safe.
+
+_PATH_OPS = {"/", "//", ".", "..", "@", "*", "::", ":"}
+# Operators that can come before a name in a location path
+_NAME_PREFIX_OPS = {"/", "//", "@", "::", ":"}
+_NON_ELEMENT_AXES = {"attribute", "namespace"}
+
+
+def required_facts(expression: str) -> set[str]:
+    """
+    Returns a set of facts that a document must have for the expression to
+    return any elements. This is conservative - it may return fewer facts than
+    are actually required, including none at all.
+    """
+    try:
+        return _path_required_facts(tokenize(expression))
+    except ValueError:
+        return set()
+
+
+def _path_required_facts(tokens: list[Token]) -> set[str]:
+    try:
+        items = split_top_level(tokens)
+    except ValueError:
+        return set()
+    # Check we have a pure location path, with nothing we don't understand at
+    # the top level (function calls, unions, operators, literals etc.)
+    for idx, item in enumerate(items):
+        if isinstance(item, list):
+            continue
+        if item.kind == "name":
+            next_item = items[idx + 1] if idx + 1 < len(items) else None
+            if isinstance(next_item, Token) and next_item.text == "(":
+                return set()
+            prev_item = items[idx - 1] if idx > 0 else None
+            if prev_item is not None and (isinstance(prev_item, list) or prev_item.text not in _NAME_PREFIX_OPS):
+                # A name following an operand is an operator e.g. `or`, `and`, `div`
+                return set()
+        elif item.kind != "op" or item.text not in _PATH_OPS:
+            return set()
+
+    facts: set[str] = set()
+    for step in _split_steps(items):
+        facts |= _step_required_facts(step)
+    return facts
+
+
+def _split_steps(items: list[Token | list[Token]]) -> list[list[Token | list[Token]]]:
+    steps: list[list[Token | list[Token]]] = []
+    current: list[Token | list[Token]] = []
+    for item in items:
+        if isinstance(item, Token) and item.text in ("/", "//"):
+            if current:
+                steps.append(current)
+            current = []
+        else:
+            current.append(item)
+    if current:
+        steps.append(current)
+    return steps
+
+
+def _step_required_facts(step: list[Token | list[Token]]) -> set[str]:
+    node_test = [item for item in step if isinstance(item, Token)]
+    predicates = [item for item in step if isinstance(item, list)]
+    texts = [token.text for token in node_test]
+    if len(texts) == 3 and texts[1] == "::":
+        axis = texts[0]
+        texts = texts[2:]
+        node_test = node_test[2:]
+    else:
+        axis = "child"
+    if texts and texts[0] == "@":
+        axis = "attribute"
+        node_test = node_test[1:]
+    if axis in _NON_ELEMENT_AXES or len(node_test) != 1 or node_test[0].kind != "name":
+        # Not an element with a tag we can know, e.g. `*`, `.`, `re:thing`
+        return set()
+
+    tag = node_test[0].text
+    facts = {tag_fact(tag)}
+    for predicate in predicates:
+        facts |= _predicate_required_facts(tag, predicate)
+    return facts
+
+
+def _predicate_required_facts(tag: str, predicate: list[Token]) -> set[str]:
+    conjuncts = split_conjuncts(predicate)
+    if conjuncts is None:
+        return set()
+    facts: set[str] = set()
+    for conjunct in conjuncts:
+        facts |= _conjunct_required_facts(tag, conjunct)
+    return facts
+
+
+def _conjunct_required_facts(tag: str, conjunct: list[Token]) -> set[str]:
+    equality = attribute_equality(conjunct)
+    if equality is not None:
+        attribute, value = equality
+        if attribute in INDEXED_ATTRIBUTES.get(tag, ()) and len(value) <= MAX_VALUE_LENGTH:
+            return {attribute_fact(tag, attribute, value)}
+        return set()
+    # A relative location path inside a predicate must match something for the
+    # predicate to be true.
+    return _path_required_facts(conjunct)
+
+
+# Storage
+
+
+def _index_version() -> str:
+    # The AST, and therefore the XML, depends on the Python version.
+    return f"{__version__} {sys.version}"
+
+
+@dataclass(frozen=True)
+class IndexedFile:
+    id: int
+    mtime_ns: int
+    size: int
+    parse_ok: bool
+
+
+class SearchIndex:
+    def __init__(self, path: Path | str):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                content_hash BLOB NOT NULL,
+                parse_ok INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS facts (
+                id INTEGER PRIMARY KEY,
+                fact TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                fact_id INTEGER NOT NULL,
+                file_id INTEGER NOT NULL,
+                PRIMARY KEY (fact_id, file_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_file_id ON postings (file_id);
+            """
+        )
+        self.connection.commit()
+
+    def is_current_version(self) -> bool:
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row is not None and row[0] == _index_version()
+
+    def load_files(self) -> dict[str, IndexedFile]:
+        return {
+            path: IndexedFile(id=file_id, mtime_ns=mtime_ns, size=size, parse_ok=bool(parse_ok))
+            for path, file_id, mtime_ns, size, parse_ok in self.connection.execute(
+                "SELECT path, id, mtime_ns, size, parse_ok FROM files"
+            )
+        }
+
+    def candidate_file_ids(self, facts: set[str]) -> set[int]:
+        """
+        Returns the ids of files that have all the given facts.
+        """
+        fact_ids = []
+        for fact in facts:
+            row = self.connection.execute("SELECT id FROM facts WHERE fact = ?", (fact,)).fetchone()
+            if row is None:
+                return set()
+            fact_ids.append(row[0])
+        placeholders = ",".join("?" * len(fact_ids))
+        return {
+            file_id
+            for (file_id,) in self.connection.execute(
+                f"SELECT file_id FROM postings WHERE fact_id IN ({placeholders}) "
+                "GROUP BY file_id HAVING COUNT(*) = ?",
+                (*fact_ids, len(fact_ids)),
+            )
+        }
+
+    def file_filter(self, expressions: Iterable[str]) -> Callable[[Path], bool] | None:
+        """
+        Returns a function that returns False for files that are known not to
+        match any of the expressions, or None if the index can't help.
+        """
+        if not self.is_current_version():
+            return None
+        candidates: set[int] = set()
+        for expression in expressions:
+            facts = required_facts(expression)
+            if not facts:
+                return None
+            candidates |= self.candidate_file_ids(facts)
+        indexed_files = self.load_files()
+
+        def may_match(path: Path) -> bool:
+            indexed_file = indexed_files.get(os.path.abspath(path))
+            if indexed_file is None or not indexed_file.parse_ok:
+                return True
+            try:
+                stat_result = path.stat()
+            except OSError:
+                return True
+            if stat_result.st_mtime_ns != indexed_file.mtime_ns or stat_result.st_size != indexed_file.size:
+                # Changed since indexing, so we know nothing about it.
+                return True
+            return indexed_file.id in candidates
+
+        return may_match
+
+    def update(
+        self,
+        paths: Iterable[Path | WalkError | object],
+        *,
+        roots: Sequence[Path] | None = None,
+        rebuild: bool = False,
+    ) -> tuple[int, int]:
+        """
+        Updates the index for the given files (which is typically the output of
+        `get_files_to_search`), and removes any indexed files not in `paths`.
+        If `roots` is passed, only indexed files equal to or under one of `roots`
+        are removed, so that different parts of a tree can be updated separately.
+
+        Files are only parsed if they have changed since they were last
+        indexed. Returns a tuple of (number of files indexed, number of files
+        parsed).
+        """
+        if rebuild or not self.is_current_version():
+            self.connection.executescript("DELETE FROM postings; DELETE FROM files; DELETE FROM facts;")
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (_index_version(),)
+            )
+        indexed_files = self.load_files()
+        seen: set[int] = set()
+        total = 0
+        parsed = 0
+        for path in paths:
+            if not isinstance(path, Path):
+                continue
+            total += 1
+            abs_path = os.path.abspath(path)
+            try:
+                stat_result = path.stat()
+            except OSError:
+                continue
+            indexed_file = indexed_files.get(abs_path)
+            if indexed_file is not None:
+                seen.add(indexed_file.id)
+                if stat_result.st_mtime_ns == indexed_file.mtime_ns and stat_result.st_size == indexed_file.size:
+                    continue
+            try:
+                contents = path.read_bytes()
+            except OSError:
+                continue
+            hash_value = content_hash(contents)
+            if indexed_file is not None:
+                row = self.connection.execute(
+                    "SELECT content_hash FROM files WHERE id = ?", (indexed_file.id,)
+                ).fetchone()
+                if row is not None and row[0] == hash_value:
+                    # Touched but not changed
+                    self.connection.execute(
+                        "UPDATE files SET mtime_ns = ?, size = ? WHERE id = ?",
+                        (stat_result.st_mtime_ns, stat_result.st_size, indexed_file.id),
+                    )
+                    continue
+            parsed += 1
+            processed_python = process_python_source(filename=path, contents=contents, auto_dedent=False)
+            facts = set() if isinstance(processed_python, ReadError) else extract_facts(processed_python.xml)
+            file_id = self._store_file(
+                abs_path,
+                stat_result.st_mtime_ns,
+                stat_result.st_size,
+                hash_value,
+                parse_ok=not isinstance(processed_python, ReadError),
+                facts=facts,
+            )
+            seen.add(file_id)
+
+        in_roots = _path_filter(roots) if roots is not None else None
+        removed = [
+            (file.id,)
+            for file_path, file in indexed_files.items()
+            if file.id not in seen and (in_roots is None or in_roots(file_path))
+        ]
+        self.connection.executemany("DELETE FROM postings WHERE file_id = ?", removed)
+        self.connection.executemany("DELETE FROM files WHERE id = ?", removed)
+        self.connection.commit()
+        return total, parsed
+
+    def _store_file(
+        self, path: str, mtime_ns: int, size: int, hash_value: bytes, *, parse_ok: bool, facts: set[str]
+    ) -> int:
+        cursor = self.connection.execute(
+            "INSERT INTO files (path, mtime_ns, size, content_hash, parse_ok) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (path) DO UPDATE SET mtime_ns = excluded.mtime_ns, size = excluded.size, "
+            "content_hash = excluded.content_hash, parse_ok = excluded.parse_ok "
+            "RETURNING id",
+            (path, mtime_ns, size, hash_value, int(parse_ok)),
+        )
+        file_id: int = cursor.fetchone()[0]
+        self.connection.execute("DELETE FROM postings WHERE file_id = ?", (file_id,))
+        self.connection.executemany("INSERT OR IGNORE INTO facts (fact) VALUES (?)", [(fact,) for fact in facts])
+        self.connection.executemany(
+            "INSERT INTO postings (fact_id, file_id) SELECT id, ? FROM facts WHERE fact = ?",
+            [(file_id, fact) for fact in facts],
+        )
+        return file_id
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> SearchIndex:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
+def build_index(
+    index_path: Path | str,
+    paths: list[Path],
+    *,
+    rebuild: bool = False,
+    include_hidden: bool = False,
+) -> tuple[int, int]:
+    """
+    Builds or incrementally updates the index at `index_path` for the Python
+    files found in `paths`. Returns (number of files indexed, number of files parsed)
+    """
+    with SearchIndex(index_path) as index:
+        return index.update(
+            get_files_to_search(list(paths), include_hidden=include_hidden),
+            roots=paths,
+            rebuild=rebuild,
+        )
+
+
+def _path_filter(roots: Sequence[Path]) -> Callable[[str], bool]:
+    """
+    Returns a function that checks whether an absolute path is equal to or under one of `roots`.
+    """
+    abs_roots = [os.path.abspath(root) for root in roots]
+    prefixes = tuple(root.rstrip(os.sep) + os.sep for root in abs_roots)
+
+    def in_roots(path: str) -> bool:
+        return path in abs_roots or path.startswith(prefixes)
+
+    return in_roots
@@ -0,0 +1,88 @@
+"""
+Limits on the work done for each file, and on the time taken by a whole
+search, for predictable run times when a code base has outliers such as huge
+generated modules.
+
+Time limits are cooperative: the deadline is checked between the phases of
+processing a file, for each call to our `re:` functions and for each match.
+A single step, such as parsing a file or one call to `re.search`, can't be
+interrupted, so limits on file size and number of nodes should be used to
+avoid doing expensive steps at all.
+"""
+from __future__ import annotations
+
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Iterable, Iterator, TypeVar
+
+
+@dataclass(frozen=True)
+class Limits:
+    """
+    Limits for a search. Files exceeding a limit are skipped, or for time
+    limits, only partially searched.
+    """
+
+    max_filesize: int | None = None  # bytes
+    max_nodes: int | None = None  # AST nodes
+    file_timeout: float | None = None  # seconds for each file
+    time_limit: float | None = None  # seconds for the whole search
+
+
+class LimitExceeded(Exception):
+    pass
+
+
+# Deadline for processing the current file, and the message to use when it is exceeded
+_deadline: ContextVar[tuple[float, str] | None] = ContextVar("_deadline", default=None)
+
+
+def check_deadline() -> None:
+    """
+    Raises LimitExceeded if the deadline for the current file has passed.
+    """
+    deadline = _deadline.get()
+    if deadline is not None and time.monotonic() > deadline[0]:
+        raise LimitExceeded(deadline[1])
+
+
+def check_filesize(size: int, limits: Limits | None) -> None:
+    """
+    Raises LimitExceeded if `size` (in bytes) exceeds the limit.
+    """
+    if limits is not None and limits.max_filesize is not None and size > limits.max_filesize:
+        raise LimitExceeded(f"file size of {size} bytes exceeds limit of {limits.max_filesize} bytes")
+
+
+def time_limit_exceeded(start_time: float, limits: Limits | None) -> LimitExceeded | None:
+    """
+    Returns LimitExceeded if the time limit for a search started at `start_time`
+    (from `time.monotonic()`) has been reached.
+    """
+    if limits is not None and limits.time_limit is not None and time.monotonic() - start_time > limits.time_limit:
+        return LimitExceeded(f"time limit of {limits.time_limit}s reached, search stopped")
+    return None
+
+
+T = TypeVar("T")
+
+
+def with_deadline(iterable: Iterable[T], deadline: float, message: str) -> Iterator[T]:
+    """
+    Wraps an iterable (typically a generator), so that `check_deadline()`
+    raises LimitExceeded with `message` after `deadline` (from `time.monotonic()`)
+    while producing each item.
+    """
+    # The deadline is set only while producing each item, not while the
+    # consumer has control.
+    iterator = iter(iterable)
+    while True:
+        token = _deadline.set((deadline, message))
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _deadline.reset(token)
+        yield item
@@ -1,15 +1,19 @@
 from __future__ import annotations
 
+import json
 import sys
 import textwrap
-from typing import Callable, Iterable, Protocol, TextIO
+import time
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Protocol, TextIO
 
 from pyastgrep.ignores import WalkError
 
-from . import xml
+from . import ast_utils, stats, xml
 from .color import Colorer, NullColorer
-from .context import ContextType, StatementContext, StaticContext
-from .files import MissingPath, Pathlike, ReadError
+from .context import ContextType, ScopeContext, StatementContext, StaticContext
+from .files import MissingPath, Pathlike, ReadError, SkippedFile
 from .search import FileFinished, Match, NonElementReturned
 
 
@@ -45,7 +49,16 @@ def print_results(
     quiet: bool = False,
     heading: bool = False,
     colorer: Colorer | None = None,
+    scope: bool = False,
+    max_columns: int | None = None,
+    max_columns_preview: bool = False,
 ) -> tuple[int, int]:
+    """
+    Print results, returning a tuple of (number of matches, number of errors).
+
+    Lines longer than `max_columns` are omitted, or with `max_columns_preview`,
+    shortened to `max_columns` around the match.
+    """
     if print_ast:
         # Don't import unless needed
         import astpretty
@@ -59,44 +72,55 @@ def print_results(
     matches = 0
     errors = 0
 
+    # Interactive output is written line by line, otherwise in blocks,
+    # flushed at the end of each file.
+    writer = BufferedWriter(stdout, line_buffered=stdout.isatty())
+
     def do_error(message: str) -> None:
         nonlocal errors
+        # Keep stdout and stderr in order
+        writer.flush()
         print(message, file=stderr)
         errors += 1
 
-    def line_printer(line: str) -> None:
-        print(line, file=stdout)
+    def do_notice(message: str) -> None:
+        writer.flush()
+        print(message, file=stderr)
 
+    line_printer = writer.write_line
+
+    line_limit = LineLimit(max_columns, preview=max_columns_preview) if max_columns is not None else None
     context_handler: ContextHandler
     if heading:
-        if isinstance(context, StatementContext):
+        formatter = HeadingFormatter(colorer=colorer, line_limit=line_limit)
+        if isinstance(context, (StatementContext, ScopeContext)):
             context_handler = StatementWithHeadingContextHandler(
-                line_printer=line_printer, formatter=HeadingFormatter(colorer=colorer)
+                context_type=context, line_printer=line_printer, formatter=formatter
             )
         else:
             context_handler = DefaultContextHandler(
-                context_type=context, line_printer=line_printer, formatter=HeadingFormatter(colorer=colorer)
+                context_type=context, line_printer=line_printer, formatter=formatter
             )
     else:
         context_handler = DefaultContextHandler(
-            context_type=context, line_printer=line_printer, formatter=DefaultFormatter(colorer=colorer)
+            context_type=context,
+            line_printer=line_printer,
+            formatter=DefaultFormatter(colorer=colorer, scope=scope, line_limit=line_limit),
         )
 
     for result in results:
-        if isinstance(result, MissingPath):
-            do_error(f"{result.path}: No such file or directory")
-            continue
-        elif isinstance(result, ReadError):
-            do_error(f"{result.path}: {result.exception}")
-            continue
-        elif isinstance(result, WalkError):
-            do_error(f"{result.path}: {result.exception}")
-            continue
-        elif isinstance(result, NonElementReturned):
-            do_error(f"Error: XPath expression returned a value that is not an AST node: {result.args[0]}")
-            continue
-        elif isinstance(result, FileFinished):
-            context_handler.flush()
+        if not isinstance(result, Match):
+            if isinstance(result, FileFinished):
+                with stats.timed("print", result.source):
+                    context_handler.flush()
+                    writer.flush()
+            elif isinstance(result, SkippedFile):
+                # Skipping files is requested by the user, so it isn't an error
+                do_notice(format_notice(result))
+            else:
+                error = format_error(result)
+                assert error is not None
+                do_error(error)
             continue
 
         matches += 1
@@ -113,13 +137,245 @@ def print_results(
 
     # Last result
     context_handler.flush()
+    writer.flush()
 
     return (matches, errors)
 
 
+def print_json_results(
+    results: Iterable[Match | MissingPath | ReadError | WalkError | NonElementReturned | FileFinished],
+    stdout: TextIO | None = None,
+    stderr: TextIO | None = None,
+    quiet: bool = False,
+    scope: bool = False,
+    source: bool = False,
+) -> tuple[int, int]:
+    """
+    Print results as JSON Lines, with one record per match, in the style of
+    ripgrep's JSON output. Each record is an object with "type" and "data" keys.
+    There are "begin" and "end" records around the matches for each file that
+    has matches, and a final "summary" record.
+
+    With `scope=True`, match records include the name of the enclosing
+    function or class. With `source=True`, they include the source code of the
+    matched node.
+
+    Errors, and notices of skipped files, are printed to stderr as for
+    `print_results`.
+    """
+    if stdout is None:
+        stdout = sys.stdout
+    if stderr is None:
+        stderr = sys.stderr
+    start_time = time.perf_counter()
+    writer = BufferedWriter(stdout)
+    encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+    def write_record(record_type: str, data: dict[str, Any]) -> None:
+        writer.write(encode({"type": record_type, "data": data}) + "\n")
+
+    matches = 0
+    errors = 0
+    skipped = 0
+    files_searched = 0
+    files_with_matches = 0
+    current_path: Pathlike | None = None
+    current_path_matches = 0
+
+    def end_file() -> None:
+        nonlocal current_path
+        if current_path is not None:
+            write_record("end", {"path": str(current_path), "matches": current_path_matches})
+            current_path = None
+
+    for result in results:
+        if isinstance(result, FileFinished):
+            files_searched += 1
+            end_file()
+            continue
+        if isinstance(result, SkippedFile):
+            writer.flush()
+            print(format_notice(result), file=stderr)
+            skipped += 1
+            continue
+        error = format_error(result)
+        if error is not None:
+            # Keep stdout and stderr in order
+            writer.flush()
+            print(error, file=stderr)
+            errors += 1
+            continue
+        assert isinstance(result, Match)
+
+        matches += 1
+        if quiet:
+            continue
+        if result.path != current_path:
+            end_file()
+            current_path = result.path
+            current_path_matches = 0
+            files_with_matches += 1
+            write_record("begin", {"path": str(result.path)})
+        current_path_matches += 1
+        data = match_to_json(result)
+        if scope:
+            data["scope"] = scope_name(result)
+        if source:
+            data["source"] = source_segment(result) if data["end_line"] is not None else None
+        write_record("match", data)
+
+    end_file()
+    if not quiet:
+        write_record(
+            "summary",
+            {
+                "elapsed_seconds": round(time.perf_counter() - start_time, 6),
+                "files_searched": files_searched,
+                "files_with_matches": files_with_matches,
+                "matches": matches,
+                "errors": errors,
+                "skipped": skipped,
+            },
+        )
+    writer.flush()
+    return (matches, errors)
+
+
+def format_notice(result: SkippedFile) -> str:
+    return f"{result.path}: skipped: {result.exception}"
+
+
+def format_error(result: Match | MissingPath | ReadError | WalkError | NonElementReturned) -> str | None:
+    if isinstance(result, MissingPath):
+        return f"{result.path}: No such file or directory"
+    elif isinstance(result, ReadError):
+        return f"{result.path}: {result.exception}"
+    elif isinstance(result, WalkError):
+        return f"{result.path}: {result.exception}"
+    elif isinstance(result, NonElementReturned):
+        return f"Error: XPath expression returned a value that is not an AST node: {result.args[0]}"
+    return None
+
+
+def match_to_json(result: Match) -> dict[str, Any]:
+    """
+    Returns a JSON-serializable dict for a match. Lines and columns are
+    1-based, and the end column is exclusive. The end position is null for
+    nodes without position information.
+    """
+    ast_node = result.ast_node
+    end_lineno: int | None = getattr(ast_node, "end_lineno", None)
+    end_col_offset: int | None = getattr(ast_node, "end_col_offset", None)
+    has_end = end_lineno is not None and end_col_offset is not None and hasattr(ast_node, "lineno")
+    return {
+        "path": str(result.path),
+        "line": result.position.lineno,
+        "column": result.position.col_offset + 1,
+        "end_line": end_lineno if has_end else None,
+        "end_column": end_col_offset + 1 if has_end and end_col_offset is not None else None,
+        "node_type": ast_node.__class__.__name__,
+        "rule_id": result.rule_id,
+    }
+
+
+def scope_name(result: Match) -> str | None:
+    """
+    Returns the dotted name of the innermost function or class enclosing the
+    match, or None for module level.
+    """
+    enclosing = ast_utils.get_enclosing_scope(result.ast_node, result.position.lineno, result.position.col_offset)
+    return None if enclosing is None else enclosing.name
+
+
+def source_segment(result: Match) -> str:
+    """
+    Returns the source code for the matched node.
+    """
+    end_lineno: int = result.ast_node.end_lineno  # type: ignore[attr-defined]
+    end_col_offset: int = result.ast_node.end_col_offset  # type: ignore[attr-defined]
+    # AST column offsets are UTF-8 byte offsets
+    lines = [line.encode("utf-8") for line in result.file_lines[result.position.lineno - 1 : end_lineno]]
+    lines[-1] = lines[-1][:end_col_offset]
+    lines[0] = lines[0][result.position.col_offset :]
+    return b"\n".join(lines).decode("utf-8", errors="replace")
+
+
+class BufferedWriter:
+    """
+    Collects output and writes it in large blocks, rather than one write per line.
+    """
+
+    def __init__(self, stream: TextIO, buffer_size: int = 65536, line_buffered: bool = False):
+        self.stream = stream
+        # With line buffering, we flush after every write
+        self.buffer_size = 0 if line_buffered else buffer_size
+        self.buffer: list[str] = []
+        self.buffered_length = 0
+
+    def write(self, text: str) -> None:
+        self.buffer.append(text)
+        self.buffered_length += len(text)
+        if self.buffered_length >= self.buffer_size:
+            self.flush()
+
+    def write_line(self, line: str) -> None:
+        self.write(line + "\n")
+
+    def flush(self) -> None:
+        if self.buffer:
+            self.stream.write("".join(self.buffer))
+            self.buffer.clear()
+            self.buffered_length = 0
+            self.stream.flush()
+
+
 # Context handlers
 
 
+class LineSet:
+    """
+    A set of line indices, stored as sorted, non-overlapping [start, stop) ranges.
+    """
+
+    def __init__(self) -> None:
+        self.starts: list[int] = []
+        self.stops: list[int] = []
+
+    def __contains__(self, line_index: int) -> bool:
+        idx = bisect_right(self.starts, line_index) - 1
+        return idx >= 0 and line_index < self.stops[idx]
+
+    def add_range(self, start: int, stop: int) -> None:
+        if start >= stop:
+            return
+        # Ranges that overlap or are adjacent to the new range are merged with it
+        lo = bisect_left(self.stops, start)
+        hi = bisect_right(self.starts, stop)
+        if lo < hi:
+            start = min(start, self.starts[lo])
+            stop = max(stop, self.stops[hi - 1])
+        self.starts[lo:hi] = [start]
+        self.stops[lo:hi] = [stop]
+
+    def add(self, line_index: int) -> None:
+        self.add_range(line_index, line_index + 1)
+
+    def gaps(self, start: int, stop: int) -> Iterable[tuple[int, int]]:
+        """
+        Yields the (start, stop) ranges between `start` and `stop` that are not in the set.
+        """
+        idx = bisect_right(self.stops, start)
+        while start < stop:
+            if idx < len(self.starts) and self.starts[idx] < stop:
+                if start < self.starts[idx]:
+                    yield (start, self.starts[idx])
+                start = self.stops[idx]
+                idx += 1
+            else:
+                yield (start, stop)
+                return
+
+
 class DefaultContextHandler:
     # Helper class to manage context lines:
     #
@@ -134,6 +390,9 @@ class DefaultContextHandler:
     #   means we have to wait to print the 'after' lines of a previous result
     #   to be sure they don't contain a match line.
     # - edge conditions
+    #
+    # State is kept only for the current file, so that memory use doesn't grow
+    # with the total output.
 
     def __init__(self, *, context_type: ContextType, line_printer: LinePrinter, formatter: Formatter):
         # Configuration from outside:
@@ -141,83 +400,80 @@ class DefaultContextHandler:
         self.line_printer = line_printer
         self.formatter = formatter
 
-        # Internal state this class manages:
-        self.printed_context_lines: set[tuple[Pathlike, int]] = set()
-        self.queued_context_lines: list[tuple[Pathlike, int, str]] = []
+        # Internal state this class manages, for the current file:
+        self.current_path: Pathlike | None = None
+        self.printed_lines = LineSet()
+        # Ranges of context lines to print, as (result, start, stop)
+        self.queued_context_lines: list[tuple[Match, int, int]] = []
 
     def handle_result(self, result: Match) -> None:
+        if result.path is not self.current_path and result.path != self.current_path:
+            self.flush()
+            self.current_path = result.path
+
         before_context, after_context = self.context_type.get_context_lines_for_result(result)
 
         line_index = result.position.lineno - 1
 
         # Previous result's 'after' lines
-        self.flush_context_lines(
-            before_result_path=result.path,
-            before_result_line=result.position.lineno - before_context - 1,
-        )
+        self.flush_context_lines(before_line=line_index - before_context)
 
         # This result's 'before' lines
-        self.queue_context_lines(result, list(range(max(0, line_index - before_context), line_index)))
-        self.flush_context_lines()
+        if before_context:
+            self.queued_context_lines.append((result, max(0, line_index - before_context), line_index))
+            self.flush_context_lines()
 
         # The actual result
         self.print_match_line(result, line_index)
 
         # This result's 'after' lines
-        self.queue_context_lines(
-            result, list(range(line_index + 1, min(len(result.file_lines), line_index + after_context + 1)))
-        )
+        if after_context:
+            self.queued_context_lines.append(
+                (result, line_index + 1, min(len(result.file_lines), line_index + after_context + 1))
+            )
 
     def flush(self) -> None:
+        """
+        Print remaining context lines for the current file, and reset.
+        """
         self.flush_context_lines()
+        self.current_path = None
+        self.printed_lines = LineSet()
 
     def print_match_line(self, result: Match, line_index: int) -> None:
         self.maybe_print_header(result.path, line_index)
         self.line_printer(self.formatter.format_match_line(result))
-        self.printed_context_lines.add((result.path, line_index))
+        self.printed_lines.add(line_index)
 
     def maybe_print_header(self, path: Pathlike, line_index: int) -> None:
         # We print the header only if there is a gap
-        if (path, line_index - 1) not in self.printed_context_lines:
+        if (line_index - 1) not in self.printed_lines:
             header = self.formatter.format_header(path, line_index)
             if header is not None:
                 self.line_printer(header)
 
-    def queue_context_lines(self, result: Match, context_line_indices: list[int]) -> None:
-        for context_line_index in context_line_indices:
-            if (result.path, context_line_index) not in self.printed_context_lines:
-                context_line = result.file_lines[context_line_index]
-                self.queued_context_lines.append(
-                    (
-                        result.path,
-                        context_line_index,
-                        self.formatter.format_context_line(result, context_line, context_line_index),
-                    )
-                )
-
-    def flush_context_lines(
-        self, *, before_result_path: Pathlike | None = None, before_result_line: int | None = None
-    ) -> None:
+    def flush_context_lines(self, *, before_line: int | None = None) -> None:
         """
         Print queued context lines.
 
-        If passed, print only the context lines that come before before_result_path and before_result_line.
+        If passed, print only the context lines that come before before_line,
+        discarding the others.
         """
-
-        for path, line_index, to_print in self.queued_context_lines:
-            if (
-                before_result_path is None
-                or path != before_result_path
-                # from a different file => print
-            ) or (
-                before_result_line is None
-                or line_index < before_result_line
-                # Before the context for current result => print
-            ):
-                self.maybe_print_header(path, line_index)
-                self.line_printer(to_print)
-                self.printed_context_lines.add((path, line_index))
-        self.queued_context_lines[:] = []
+        if not self.queued_context_lines:
+            return
+        for result, start, stop in self.queued_context_lines:
+            if before_line is not None:
+                stop = min(stop, before_line)
+            for gap_start, gap_stop in list(self.printed_lines.gaps(start, stop)):
+                self.maybe_print_header(result.path, gap_start)
+                for context_line_index in range(gap_start, gap_stop):
+                    self.line_printer(
+                        self.formatter.format_context_line(
+                            result, result.file_lines[context_line_index], context_line_index
+                        )
+                    )
+                self.printed_lines.add_range(gap_start, gap_stop)
+        self.queued_context_lines.clear()
 
 
 class StatementWithHeadingContextHandler:
@@ -232,72 +488,143 @@ class StatementWithHeadingContextHandler:
     # For cases of overlapping or nested matches, we don't print the same lines
     # multiple times.
 
-    def __init__(self, *, line_printer: LinePrinter, formatter: Formatter):
+    # The same applies to whole functions or classes (ScopeContext).
+
+    def __init__(
+        self,
+        *,
+        line_printer: LinePrinter,
+        formatter: Formatter,
+        context_type: StatementContext | ScopeContext = StatementContext(),
+    ):
         # Configuration from outside:
         self.line_printer = line_printer
         self.formatter = formatter
-        self.context_type = StatementContext()
+        self.context_type = context_type
 
-        # Managed state:
-        self.printed_context_lines: set[tuple[Pathlike, int]] = set()
+        # Managed state, for the current file:
+        self.current_path: Pathlike | None = None
+        self.printed_lines = LineSet()
 
     def handle_result(self, result: Match) -> None:
         line_index = result.position.lineno - 1
         path = result.path
+        if path is not self.current_path and path != self.current_path:
+            self.flush()
+            self.current_path = path
 
         before_context, after_context = self.context_type.get_context_lines_for_result(result)
         start_line_idx = line_index - before_context
         end_line_idx = line_index + after_context
         stop_line_idx = end_line_idx + 1
 
-        if (path, end_line_idx) in self.printed_context_lines:
+        if end_line_idx in self.printed_lines:
             # Already printed
             return
 
-        if (path, start_line_idx - 1) not in self.printed_context_lines:
+        if (start_line_idx - 1) not in self.printed_lines:
             header = self.formatter.format_header(path, start_line_idx)
             if header is not None:
                 self.line_printer(header)
 
         code = "\n".join(result.file_lines[start_line_idx:stop_line_idx])
-        to_print = textwrap.dedent(code)
-        self.line_printer(to_print.rstrip("\n"))
-        for idx in range(start_line_idx, stop_line_idx):
-            self.printed_context_lines.add((path, idx))
+        to_print = textwrap.dedent(code).rstrip("\n")
+        # Lines go through the formatter for --max-columns
+        for offset, line in enumerate(to_print.split("\n")):
+            self.line_printer(self.formatter.format_context_line(result, line, start_line_idx + offset))
+        self.printed_lines.add_range(start_line_idx, stop_line_idx)
 
     def flush(self) -> None:
-        pass
+        self.current_path = None
+        self.printed_lines = LineSet()
 
 
 # Formatters
 
 
+@dataclass(frozen=True)
+class LineLimit:
+    """
+    Limit on the length of lines printed, for long lines such as minified code
+    or embedded data. Lines longer than `max_columns` are omitted, or with
+    `preview=True`, shortened to `max_columns` around the match, so that
+    megabyte-long lines are never copied or colored as a whole.
+    """
+
+    max_columns: int
+    preview: bool = False
+
+    def format_match_line(self, colorer: Colorer, result: Match) -> str:
+        line_length = len(result.matching_line)
+        if line_length <= self.max_columns:
+            return colorer.color_match(result)
+        if not self.preview:
+            return "[Omitted long matching line]"
+        column = result.position.col_offset
+        # Show the start of the line if the match is near it, otherwise start
+        # a little before the match.
+        start = 0 if column < self.max_columns * 3 // 4 else column - self.max_columns // 4
+        start = min(start, line_length - self.max_columns)
+        stop = start + self.max_columns
+        return (
+            ("[...]" if start > 0 else "")
+            + colorer.color_match(result, start, stop)
+            + (" [...]" if stop < line_length else "")
+        )
+
+    def format_context_line(self, context_line: str) -> str:
+        if len(context_line) <= self.max_columns:
+            return context_line
+        if not self.preview:
+            return "[Omitted long context line]"
+        return context_line[: self.max_columns] + " [...]"
+
+
 class DefaultFormatter:
-    def __init__(self, colorer: Colorer):
+    def __init__(self, colorer: Colorer, scope: bool = False, line_limit: LineLimit | None = None):
         self.colorer = colorer
+        # Whether to include the enclosing function or class
+        self.scope = scope
+        self.line_limit = line_limit
+        # Formatted path for the current file, which is the same for every line
+        self.current_path: Pathlike | None = None
+        self.current_path_s = ""
 
     # Same formatting as ripgrep:
     def format_header(self, path: Pathlike, context_line_index: int) -> str | None:
         return None
 
+    def format_path(self, path: Pathlike) -> str:
+        if path is not self.current_path:
+            self.current_path = path
+            self.current_path_s = self.colorer.color_path(str(path))
+        return self.current_path_s
+
     def format_context_line(self, result: Match, context_line: str, context_line_index: int) -> str:
-        c = self.colorer
-        path_s = c.color_path(str(result.path))
-        lineno_s = c.color_lineno(context_line_index + 1)
+        path_s = self.format_path(result.path)
+        lineno_s = self.colorer.color_lineno(context_line_index + 1)
+        if self.line_limit is not None:
+            context_line = self.line_limit.format_context_line(context_line)
         return f"{path_s}-{lineno_s}-{context_line}"
 
     def format_match_line(self, result: Match) -> str:
         c = self.colorer
-        path_s = c.color_path(str(result.path))
+        path_s = self.format_path(result.path)
         lineno_s = c.color_lineno(result.position.lineno)
-        match_s = c.color_match(result)
+        match_s = c.color_match(result) if self.line_limit is None else self.line_limit.format_match_line(c, result)
         colum = result.position.col_offset + 1
-        return f"{path_s}:{lineno_s}:{colum}:{match_s}"
+        prefix = f"{path_s}:{lineno_s}:{colum}:"
+        if self.scope:
+            prefix += f"{scope_name(result) or '<module>'}:"
+        if result.rule_id is not None:
+            return f"{prefix}[{result.rule_id}] {match_s}"
+        return f"{prefix}{match_s}"
 
 
 class HeadingFormatter:
-    def __init__(self, colorer: Colorer):
+    def __init__(self, colorer: Colorer, line_limit: LineLimit | None = None):
         self.colorer = colorer
+        self.line_limit = line_limit
         self.first_result_printed = False
 
     def format_header(self, path: Pathlike, context_line_index: int) -> str | None:
@@ -313,7 +640,11 @@ class HeadingFormatter:
         return spacer + f"# {path_s}:{lineno_s}:"
 
     def format_context_line(self, result: Match, context_line: str, context_line_index: int) -> str:
+        if self.line_limit is not None:
+            return self.line_limit.format_context_line(context_line)
         return context_line
 
     def format_match_line(self, result: Match) -> str:
+        if self.line_limit is not None:
+            return self.line_limit.format_match_line(self.colorer, result)
         return self.colorer.color_match(result)
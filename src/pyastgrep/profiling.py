@@ -0,0 +1,119 @@
+"""
+Profiling of a search using cProfile, with a report of the slowest files.
+
+The time spent on each file is recorded for each phase of processing it
+(reading, parsing, converting to XML and evaluating expressions), along with
+its size and number of AST nodes, which makes it easy to find pathological
+files (e.g. large generated files) that could be ignored.
+
+Times are measured while cProfile is running, which slows everything down, so
+they are only useful for comparing files with each other.
+"""
+from __future__ import annotations
+
+import contextlib
+import cProfile
+import threading
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+
+from . import stats
+
+# Phases of processing a file, in pipeline order.
+FILE_PHASES = ("read", "parse", "link", "convert", "query", "materialize")
+
+# Default number of files to report
+SLOWEST_FILES_COUNT = 20
+
+
+@dataclass(frozen=True)
+class FileProfile:
+    path: str
+    size: int
+    nodes: int
+    phase_seconds: dict[str, float]
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(self.phase_seconds.values())
+
+
+class Profiler:
+    """
+    Recorder of the time spent on each file, for use with `stats.recording()`,
+    along with a cProfile profile.
+    """
+
+    def __init__(self) -> None:
+        self.profile = cProfile.Profile()
+        self.file_times: defaultdict[object, dict[str, float]] = defaultdict(lambda: dict.fromkeys(FILE_PHASES, 0.0))
+        self.operations: Counter[tuple[str, object]] = Counter()
+        self._local = threading.local()
+
+    def _stack(self) -> list[tuple[str, object, float]]:
+        try:
+            return self._local.stack  # type: ignore[no-any-return]
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack  # type: ignore[no-any-return]
+
+    def enter(self, phase: str, subject: object = None) -> None:
+        self._stack().append((phase, subject, time.perf_counter()))
+
+    def exit(self) -> None:
+        phase, subject, start = self._stack().pop()
+        if subject is not None and phase in FILE_PHASES:
+            self.file_times[subject][phase] += time.perf_counter() - start
+
+    def slowest_files(self, count: int = SLOWEST_FILES_COUNT) -> list[FileProfile]:
+        profiles = [
+            FileProfile(
+                path=str(subject),
+                size=self.operations["bytes_read", subject],
+                nodes=self.operations["ast_nodes", subject],
+                phase_seconds=dict(times),
+            )
+            for subject, times in self.file_times.items()
+        ]
+        profiles.sort(key=lambda profile: profile.total_seconds, reverse=True)
+        return profiles[:count]
+
+    def report(self, count: int = SLOWEST_FILES_COUNT) -> str:
+        """
+        Returns a report of the slowest files, as text.
+        """
+        lines = [
+            f"Slowest files (seconds, measured while profiling):\n"
+            f"{'total':>8} {'parse':>8} {'convert':>8} {'query':>8} {'bytes':>10} {'nodes':>8}  path"
+        ]
+        for profile in self.slowest_files(count):
+            seconds = profile.phase_seconds
+            lines.append(
+                f"{profile.total_seconds:8.3f} {seconds['parse'] + seconds['link']:8.3f} {seconds['convert']:8.3f}"
+                f" {seconds['query'] + seconds['materialize']:8.3f} {profile.size:10} {profile.nodes:8}  {profile.path}"
+            )
+        return "\n".join(lines)
+
+    def write(self, path: Path | str) -> None:
+        """
+        Writes the cProfile profile, for loading using `pstats`.
+        """
+        self.profile.dump_stats(path)
+
+
+@contextlib.contextmanager
+def collect_profile() -> Iterator[Profiler]:
+    """
+    Profile the code run in the block.
+    """
+    profiler = Profiler()
+    with stats.recording(profiler), stats.count_operations() as operations:
+        profiler.operations = operations
+        profiler.profile.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.profile.disable()
@@ -0,0 +1,344 @@
+"""
+Efficient evaluation of sets of rules against the same document.
+
+Evaluating hundreds of expressions like `.//Call[...]` one after another means
+hundreds of full traversals of the tree. Instead, we analyse the expressions,
+and for those that are "anchored" on an element tag, we find all candidate
+elements in a single traversal, and then check the rest of the expression
+(the predicates) for each candidate. Expressions we can't analyse are
+evaluated normally.
+"""
+from __future__ import annotations
+
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Iterable, Sequence, Union
+
+from lxml import etree
+from lxml.etree import _Element, _ElementUnicodeResult
+
+from .index import extract_facts, required_facts
+from .limits import check_deadline
+from .xml import XPathEvaluator, compile_regex, compile_xpath
+from .xpath_syntax import (
+    Token,
+    attribute_equality,
+    attribute_regex,
+    is_name,
+    split_conjuncts,
+    split_top_level,
+    tokenize,
+)
+
+# Forms of expression we can anchor, as token texts before the tag, mapped to
+# whether the context (root) element itself can match.
+ANCHOR_PREFIXES: dict[tuple[str, ...], bool] = {
+    (".", "//"): False,
+    ("//",): True,
+    ("descendant", "::"): False,
+    ("descendant-or-self", "::"): True,
+}
+
+# Functions that return booleans, so are safe as predicates
+BOOLEAN_FUNCTIONS = {"not", "boolean", "true", "false", "contains", "starts-with", "lang"}
+BOOLEAN_EXTENSION_FUNCTIONS = {("re", "match"), ("re", "search")}
+
+# Approximate cost of evaluating a residual expression for one candidate,
+# relative to lxml visiting one element when evaluating a whole expression.
+RESIDUAL_COST_FACTOR = 100
+
+COMPARISON_OPS = {"=", "!=", "<", ">", "<=", ">="}
+PATH_OPS = {"/", "//", ".", "..", "@", "*", "::", ":"}
+
+
+@dataclass(frozen=True)
+class AnchoredRule:
+    """
+    A rule that matches elements with `tag` for which all `attribute_checks`
+    and `regex_checks` pass, and for which the residual XPath expression (if
+    any) returns true.
+    """
+
+    index: int
+    tag: str
+    include_root: bool
+    attribute_checks: tuple[tuple[str, str], ...]
+    residual: XPathEvaluator | None
+    # Attribute names, and the `match` or `search` method of a compiled regex,
+    # for `re:` functions that can be checked without calling back from libxml2.
+    regex_checks: tuple[tuple[str, Callable[[str], object]], ...] = ()
+
+    def check_regexes(self, element: _Element) -> bool:
+        for attribute, regex_method in self.regex_checks:
+            value = element.get(attribute)
+            if value is None or regex_method(value) is None:
+                return False
+        return True
+
+
+def anchor_tag(expression: str) -> str | None:
+    """
+    Returns the tag that every element selected by the expression has, if the
+    expression has the form `.//Tag[...]`, otherwise None.
+    """
+    parts = _anchored_parts(expression)
+    return None if parts is None else parts[0].text
+
+
+def _anchored_parts(expression: str) -> tuple[Token, bool, list[list[Token]]] | None:
+    """
+    For an expression of the form `.//Tag[...]`, returns the tag token,
+    whether the root element can match, and the predicates, otherwise None.
+    """
+    tokens = tokenize(expression)
+    try:
+        items = split_top_level(tokens)
+    except ValueError:
+        return None
+    head: list[Token] = []
+    predicates: list[list[Token]] = []
+    for item in items:
+        if isinstance(item, list):
+            predicates.append(item)
+        elif predicates:
+            # Something after the predicates e.g. another step
+            return None
+        else:
+            head.append(item)
+    if len(head) < 2 or head[-1].kind != "name":
+        return None
+    include_root = ANCHOR_PREFIXES.get(tuple(token.text for token in head[:-1]), None)
+    if include_root is None:
+        return None
+    return head[-1], include_root, predicates
+
+
+def anchor_rule(index: int, expression: str) -> AnchoredRule | None:
+    """
+    Returns an AnchoredRule for the expression, or None if the expression
+    can't be anchored on a single element tag.
+    """
+    parts = _anchored_parts(expression)
+    if parts is None:
+        return None
+    tag, include_root, predicates = parts
+    if not all(_is_boolean_predicate(predicate) for predicate in predicates):
+        return None
+
+    attribute_checks: list[tuple[str, str]] = []
+    regex_checks: list[tuple[str, Callable[[str], object]]] = []
+    residual_needed = False
+    for predicate in predicates:
+        conjuncts = split_conjuncts(predicate)
+        if conjuncts is None:
+            residual_needed = True
+            continue
+        for conjunct in conjuncts:
+            equality = attribute_equality(conjunct)
+            if equality is not None:
+                attribute_checks.append(equality)
+                continue
+            regex_check = _regex_check(conjunct)
+            if regex_check is not None:
+                regex_checks.append(regex_check)
+                continue
+            residual_needed = True
+
+    residual = None
+    if residual_needed:
+        # The predicates, evaluated with the candidate as the context node.
+        try:
+            residual = compile_xpath(f"boolean(self::node(){expression[tag.end:]})")
+        except etree.XPathError:
+            return None
+    return AnchoredRule(
+        index=index,
+        tag=tag.text,
+        include_root=include_root,
+        attribute_checks=tuple(attribute_checks),
+        residual=residual,
+        regex_checks=tuple(regex_checks),
+    )
+
+
+def _regex_check(conjunct: list[Token]) -> tuple[str, Callable[[str], object]] | None:
+    regex = attribute_regex(conjunct)
+    if regex is None:
+        return None
+    function_name, attribute, pattern = regex
+    try:
+        compiled = compile_regex(pattern)
+    except re.error:
+        # Leave it to the residual, so the error is reported as normal
+        return None
+    return attribute, compiled.match if function_name == "match" else compiled.search
+
+
+def _is_boolean_predicate(predicate: list[Token]) -> bool:
+    """
+    Returns True if the predicate definitely evaluates to a boolean or node-set,
+    rather than a number (which would be a test of position), and doesn't
+    depend on the position of the context node.
+    """
+    if any(token.kind == "name" and token.text in ("position", "last") for token in predicate):
+        return False
+    if any(token.text == "$" for token in predicate):
+        return False
+    try:
+        items = split_top_level(predicate)
+    except ValueError:
+        return False
+    if any(is_name(item, "and") or is_name(item, "or") for item in items):
+        return True
+    # Top level comparisons, ignoring anything inside parentheses
+    depth = 0
+    for item in items:
+        if isinstance(item, Token) and item.kind == "op":
+            if item.text == "(":
+                depth += 1
+            elif item.text == ")":
+                depth -= 1
+            elif depth == 0 and item.text in COMPARISON_OPS:
+                return True
+    # A single function call
+    texts = [item.text if isinstance(item, Token) else "[]" for item in items]
+    if texts and texts[-1] == ")":
+        if len(texts) >= 3 and texts[1] == "(" and texts[0] in BOOLEAN_FUNCTIONS:
+            return _is_single_call(items[1:])
+        if (
+            len(texts) >= 5
+            and texts[1] == ":"
+            and texts[3] == "("
+            and (texts[0], texts[2]) in BOOLEAN_EXTENSION_FUNCTIONS
+        ):
+            return _is_single_call(items[3:])
+        return False
+    # A location path, which is true if it selects any nodes
+    for idx, item in enumerate(items):
+        if isinstance(item, list):
+            continue
+        if item.kind == "name":
+            if idx + 1 < len(items) and isinstance(items[idx + 1], Token) and texts[idx + 1] == "(":
+                return False
+        elif item.kind != "op" or item.text not in PATH_OPS:
+            return False
+    return True
+
+
+def _is_single_call(items: Sequence[Token | list[Token]]) -> bool:
+    # Check the opening parenthesis at the start closes only at the end
+    depth = 0
+    for idx, item in enumerate(items):
+        if isinstance(item, Token) and item.kind == "op":
+            if item.text == "(":
+                depth += 1
+            elif item.text == ")":
+                depth -= 1
+                if depth == 0 and idx != len(items) - 1:
+                    return False
+    return depth == 0
+
+
+QueryFunc = Callable[[_Element, str], Iterable[Union[_Element, _ElementUnicodeResult]]]
+
+
+class RuleSet:
+    """
+    A set of expressions that can be evaluated together against a document.
+    """
+
+    def __init__(self, expressions: Sequence[str]):
+        self.expressions = list(expressions)
+        self.required_facts = [required_facts(expression) for expression in self.expressions]
+        self.anchored: dict[int, AnchoredRule] = {}
+        for index, expression in enumerate(self.expressions):
+            anchored = anchor_rule(index, expression)
+            if anchored is not None:
+                self.anchored[index] = anchored
+
+    def evaluate(self, root: _Element, query_func: QueryFunc) -> list[Iterable[_Element | _ElementUnicodeResult]]:
+        """
+        Returns the results for each expression, in the same order as the
+        expressions. Anchored expressions are evaluated using a single
+        traversal, others using `query_func`.
+        """
+        results: list[Iterable[_Element | _ElementUnicodeResult]] = [[] for _ in self.expressions]
+
+        # Skip rules that need tags or attribute values the document doesn't have.
+        # This is a single traversal, and typically rules out most rules.
+        tag_counts: Counter[str] = Counter()
+        document_facts = extract_facts(root, tag_counts)
+        element_count = sum(tag_counts.values())
+        anchored_by_tag: dict[str, list[AnchoredRule]] = defaultdict(list)
+        for index, expression in enumerate(self.expressions):
+            if not self.required_facts[index] <= document_facts:
+                continue
+            anchored = self.anchored.get(index)
+            if anchored is None or (
+                anchored.residual is not None and tag_counts[anchored.tag] * RESIDUAL_COST_FACTOR > element_count
+            ):
+                # For common tags, evaluating the residual for every candidate
+                # is slower than a traversal by lxml.
+                results[index] = query_func(root, expression)
+            else:
+                anchored_by_tag[anchored.tag].append(anchored)
+        if not anchored_by_tag:
+            return results
+
+        anchored_results: dict[int, list[_Element]] = {
+            anchored.index: [] for anchored_list in anchored_by_tag.values() for anchored in anchored_list
+        }
+        for element in root.iter(*anchored_by_tag):
+            for anchored in anchored_by_tag[element.tag]:  # type: ignore[index]
+                if not anchored.include_root and element is root:
+                    continue
+                if any(element.get(attribute) != value for attribute, value in anchored.attribute_checks):
+                    continue
+                if anchored.regex_checks and not anchored.check_regexes(element):
+                    continue
+                if anchored.residual is not None and not anchored.residual(element):
+                    continue
+                anchored_results[anchored.index].append(element)
+        for index, elements in anchored_results.items():
+            results[index] = elements
+        return results
+
+
+@lru_cache(maxsize=None)
+def regex_query(expression: str) -> Callable[[_Element], list[_Element]] | None:
+    """
+    For an expression that uses `re:` functions, and can be evaluated without
+    them (i.e. anchored, with only attribute checks), returns a function that
+    evaluates it, otherwise None.
+
+    libxml2 calls back into Python for every candidate node for `re:`
+    functions, which is much slower than checking the candidates in Python.
+    """
+    if "re:" not in expression:
+        return None
+    anchored = anchor_rule(0, expression)
+    if anchored is None or anchored.residual is not None or not anchored.regex_checks:
+        return None
+
+    def evaluate(root: _Element) -> list[_Element]:
+        results = []
+        for element in root.iter(anchored.tag):
+            check_deadline()
+            if not anchored.include_root and element is root:
+                continue
+            if anchored.attribute_checks and any(
+                element.get(attribute) != value for attribute, value in anchored.attribute_checks
+            ):
+                continue
+            if anchored.check_regexes(element):
+                results.append(element)
+        return results
+
+    return evaluate
+
+
+@lru_cache(maxsize=16)
+def compile_rule_set(expressions: tuple[str, ...]) -> RuleSet:
+    return RuleSet(expressions)
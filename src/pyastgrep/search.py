@@ -2,25 +2,39 @@
 from __future__ import annotations
 
 import ast
+import copy
+import dataclasses
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import BinaryIO, Callable, Iterable, Sequence, Union
+from typing import BinaryIO, Callable, Iterable, Iterator, Mapping, Sequence, TypeVar, Union
 
 from lxml.etree import _Element, _ElementUnicodeResult
 from typing_extensions import TypeAlias
 
 from pyastgrep.ignores import WalkError
 
-from . import xml
+from . import stats, xml
+from .archives import is_archive, iter_archive_members
+from .cache import ResultCache
 from .files import (
     MissingPath,
     Pathlike,
     ProcessedPython,
     ReadError,
+    SkippedFile,
+    content_hash,
     get_files_to_search,
     process_python_file,
     process_python_source,
+    read_file_within_limits,
 )
+from .index import SearchIndex
+from .limits import LimitExceeded, Limits, check_deadline, time_limit_exceeded, with_deadline
+from .rules import compile_rule_set, regex_query
 
 
 @dataclass(frozen=True)
@@ -30,6 +44,7 @@ class Match:
     xml_element: _Element
     position: Position
     ast_node: ast.AST
+    rule_id: str | None = None
 
     @property
     def matching_line(self) -> str:
@@ -42,6 +57,29 @@ class Position:
     col_offset: int  # 0-indexed, as per AST
 
 
+@dataclass(frozen=True)
+class Rule:
+    """
+    An XPath expression to search for, with an optional id used to label matches
+    """
+
+    expression: str
+    id: str | None = None
+
+
+# A single expression, a list of expressions, or a mapping of rule ids to expressions
+Expressions: TypeAlias = Union[str, Sequence[str], Mapping[str, str]]
+
+
+def make_rules(expressions: Expressions) -> list[Rule]:
+    if isinstance(expressions, str):
+        return [Rule(expressions)]
+    if isinstance(expressions, Mapping):
+        return [Rule(expression, rule_id) for rule_id, expression in expressions.items()]
+    # Without explicit ids, each expression labels its own matches
+    return [Rule(expression, expression) for expression in expressions]
+
+
 class NonElementReturned(ValueError):
     pass
 
@@ -79,65 +117,519 @@ def get_query_func(*, xpath2: bool) -> XMLQueryFunc:
 
 def search_python_files(
     paths: Sequence[Path | BinaryIO],
-    expression: str,
+    expression: Expressions,
     *,
     xpath2: bool = False,
     include_hidden: bool = False,
     respect_global_ignores: bool = True,
     respect_vcs_ignores: bool = True,
     respect_dot_ignores: bool = True,
+    search_archives: bool = False,
+    deduplicate: bool = False,
+    result_cache: ResultCache | None = None,
+    index: SearchIndex | None = None,
     python_file_processor: Callable[[Path], ProcessedPython | ReadError] = process_python_file,
+    limits: Limits | None = None,
 ) -> Iterable[Match | MissingPath | ReadError | WalkError | NonElementReturned | FileFinished]:
     """
     Perform a recursive search through Python files.
 
+    `expression` can be a single XPath expression, a list of expressions, or
+    a mapping of rule ids to expressions. With multiple expressions, each file is
+    parsed once and all expressions are evaluated against it, and matches are
+    labelled with the rule id (or the expression, if no ids are given) in
+    `Match.rule_id`.
+
     Paths may include directories, e.g "." for the current directory.
     .gitignore rules will be applied automatically.
 
+    Archives (wheels, zip files, sdists) passed in `paths` are searched
+    without extracting them. Archives found while walking directories are
+    searched only if `search_archives=True`.
+
+    If `deduplicate=True`, files with identical contents are parsed and
+    searched only once, with the results being reported for each path.
+
+    If `result_cache` is passed, results are looked up in and saved to the
+    cache, keyed on file contents and the expression.
+
+    If `index` is passed, files that the index shows cannot match are skipped.
+    Files that are not in the index, or have changed since being indexed, are
+    always searched.
+
+    If `limits` is passed, files that exceed them are skipped, or searched only
+    partially, and reported with `SkippedFile`. If the time limit for the whole
+    search is reached, a `SkippedFile` is returned for the next file and the
+    search stops.
     """
+    start_time = time.monotonic()
     query_func = get_query_func(xpath2=xpath2)
-
-    for path in get_files_to_search(
+    rules = make_rules(expression)
+    # The index describes files on disk, so it can't be used with a custom processor
+    file_filter = (
+        index.file_filter([rule.expression for rule in rules])
+        if index is not None and python_file_processor is process_python_file
+        else None
+    )
+    # Archive members are often identical across versions of an archive,
+    # so we always search each distinct member only once.
+    searched_contents = SearchedContents()
+
+    files_to_search = get_files_to_search(
         paths,
         include_hidden=include_hidden,
         respect_global_ignores=respect_global_ignores,
         respect_vcs_ignores=respect_vcs_ignores,
         respect_dot_ignores=respect_dot_ignores,
-    ):
+        search_archives=search_archives,
+    )
+    for path in stats.timed_iter(files_to_search, "walk"):
+        if isinstance(path, Path):
+            stats.count("files_walked")
         if isinstance(path, MissingPath):
             yield path
         elif isinstance(path, WalkError):
             yield path
+        elif (exceeded := time_limit_exceeded(start_time, limits)) is not None:
+            yield SkippedFile(str(path) if isinstance(path, Path) else "<stdin>", exceeded)
+            return
+        elif isinstance(path, Path) and is_archive(path):
+            yield from search_archive(path, query_func, rules, searched_contents=searched_contents, limits=limits)
+        elif isinstance(path, Path) and file_filter is not None and not file_filter(path):
+            stats.count("files_skipped")
+            continue
         else:
-            yield from search_python_file(path, query_func, expression, python_file_processor=python_file_processor)
+            yield from limit_file_time(
+                search_python_file(
+                    path,
+                    query_func,
+                    rules,
+                    python_file_processor=python_file_processor,
+                    searched_contents=searched_contents if deduplicate else None,
+                    result_cache=result_cache,
+                    limits=limits,
+                ),
+                str(path) if isinstance(path, Path) else "<stdin>",
+                limits,
+            )
             yield FileFinished(path)
 
 
 def search_python_file(
     path: Path | BinaryIO,
     query_func: XMLQueryFunc,
-    expression: str,
+    rules: Sequence[Rule],
     *,
     python_file_processor: Callable[[Path], ProcessedPython | ReadError] = process_python_file,
+    searched_contents: SearchedContents | None = None,
+    result_cache: ResultCache | None = None,
+    limits: Limits | None = None,
 ) -> Iterable[Match | ReadError | NonElementReturned]:
+    """
+    Search a single file. Only the default `python_file_processor` applies `limits`
+    on file size and number of nodes.
+    """
+    if python_file_processor is not process_python_file:
+        # Contents are identified by what is on disk, which a custom processor
+        # might not use, e.g. if it reads files from the git index
+        searched_contents = None
+        result_cache = None
+    if isinstance(path, Path) and (searched_contents is not None or result_cache is not None):
+        # We need the contents up front, to find them in caches
+        try:
+            contents = read_file_within_limits(path, limits)
+        except LimitExceeded as ex:
+            yield SkippedFile(str(path), ex)
+            return
+        except OSError as ex:
+            yield ReadError(str(path), ex)
+            return
+        content_key = content_hash(contents)
+
+        def process() -> ProcessedPython | ReadError:
+            # Avoid reading the file twice
+            return process_python_source(filename=path, contents=contents, auto_dedent=False, limits=limits)
+
+        if result_cache is not None:
+            cache = result_cache
+
+            def search() -> Iterable[Match | ReadError | NonElementReturned]:
+                return search_with_result_cache(
+                    content_key, process, query_func, rules, result_cache=cache, limits=limits
+                )
+
+        else:
+
+            def search() -> Iterable[Match | ReadError | NonElementReturned]:
+                return process_and_search(process, query_func, rules)
+
+        if searched_contents is not None:
+            yield from searched_contents.search(path, content_key, search)
+        else:
+            yield from search()
+        return
+
     if isinstance(path, Path):
-        processed_python = python_file_processor(path)
+        if python_file_processor is process_python_file:
+            processed_python = process_python_file(path, limits=limits)
+        else:
+            processed_python = python_file_processor(path)
     else:
-        processed_python = process_python_source(filename="<stdin>", contents=path.read(), auto_dedent=True)
+        processed_python = process_python_source(
+            filename="<stdin>", contents=path.read(), auto_dedent=True, limits=limits
+        )
 
     if isinstance(processed_python, ReadError):
         yield processed_python
         return
 
+    yield from search_processed_python(processed_python, query_func, rules)
+
+
+def search_archive(
+    path: Path,
+    query_func: XMLQueryFunc,
+    rules: Sequence[Rule],
+    *,
+    searched_contents: SearchedContents,
+    limits: Limits | None = None,
+) -> Iterable[Match | ReadError | NonElementReturned | FileFinished]:
+    """
+    Search the Python files inside an archive.
+
+    Members with contents in `searched_contents` (e.g. identical members in
+    different versions of the same package) are not searched again.
+    """
+    for member in iter_archive_members(path):
+        if isinstance(member, ReadError):
+            yield member
+            continue
+        member_path, contents = member
+        yield from limit_file_time(
+            searched_contents.search(
+                member_path,
+                content_hash(contents),
+                lambda: process_and_search(
+                    lambda: process_python_source(
+                        filename=member_path, contents=contents, auto_dedent=False, limits=limits
+                    ),
+                    query_func,
+                    rules,
+                ),
+            ),
+            str(member_path),
+            limits,
+        )
+        yield FileFinished(member_path)
+
+
+def search_sources(
+    items: Iterable[tuple[str, bytes | str]],
+    expression: Expressions,
+    *,
+    xpath2: bool = False,
+    auto_dedent: bool = True,
+    limits: Limits | None = None,
+    executor: Executor | None = None,
+    batch_size: int = 100,
+) -> Iterator[Match | ReadError | NonElementReturned]:
+    """
+    Search Python source code held in memory, given as `(name, contents)` pairs,
+    without any filesystem access. `name` is used as the path of the results.
+    `str` contents are encoded as UTF-8.
+
+    With `auto_dedent=True`, code that is indented as a whole (e.g. a snippet
+    from a diff) is dedented before it is parsed.
+
+    If `executor` is passed, sources are parsed and searched in batches of
+    `batch_size` in the executor, which must use threads since results contain
+    lxml elements. Results are returned in the order of `items` either way.
+    """
+    if isinstance(executor, ProcessPoolExecutor):
+        raise TypeError("search_sources needs an executor that uses threads, not processes")
+    query_func = get_query_func(xpath2=xpath2)
+    rules = make_rules(expression)
+    if not xpath2:
+        # Report invalid expressions up front, rather than for each source
+        for rule in rules:
+            xml.compile_xpath(rule.expression)
+
+    def search_batch(batch: list[tuple[str, bytes | str]]) -> list[Match | ReadError | NonElementReturned]:
+        return [result for name, contents in batch for result in search_source(name, contents)]
+
+    def search_source(name: str, contents: bytes | str) -> Iterable[Match | ReadError | NonElementReturned]:
+        contents_bytes = contents.encode("utf-8") if isinstance(contents, str) else contents
+        return limit_file_time(
+            process_and_search(
+                lambda: process_python_source(
+                    filename=name, contents=contents_bytes, auto_dedent=auto_dedent, limits=limits
+                ),
+                query_func,
+                rules,
+            ),
+            name,
+            limits,
+        )
+
+    if executor is None:
+        for name, contents in items:
+            yield from search_source(name, contents)
+        return
+
+    # Only a few batches are submitted ahead, so that `items` can be a long
+    # or unbounded stream.
+    max_pending = 2 * (os.cpu_count() or 1)
+    pending: deque[Future[list[Match | ReadError | NonElementReturned]]] = deque()
+    try:
+        for batch in batched(items, batch_size):
+            pending.append(executor.submit(search_batch, batch))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+T = TypeVar("T")
+
+
+def batched(items: Iterable[T], size: int) -> Iterator[list[T]]:
+    batch: list[T] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def limit_file_time(
+    results: Iterable[Match | ReadError | NonElementReturned], path: str, limits: Limits | None
+) -> Iterable[Match | ReadError | NonElementReturned]:
+    """
+    Applies the time limit for a single file to the results of searching it.
+    If the limit is exceeded, results already returned stand, and a
+    `SkippedFile` is returned instead of the rest.
+    """
+    if limits is None or limits.file_timeout is None:
+        yield from results
+        return
+    try:
+        yield from with_deadline(
+            results, time.monotonic() + limits.file_timeout, f"file timeout of {limits.file_timeout}s exceeded"
+        )
+    except LimitExceeded as ex:
+        yield SkippedFile(path, ex)
+
+
+class SearchedContents:
+    """
+    Search results for file contents that have already been searched, so that
+    identical contents found at different paths are parsed and searched only once.
+
+    Contents are identified by a key, usually a hash of the contents.
+    """
+
+    def __init__(self) -> None:
+        self.results: dict[bytes | str, list[Match | ReadError | NonElementReturned]] = {}
+
+    def search(
+        self,
+        path: Pathlike,
+        key: bytes | str,
+        search: Callable[[], Iterable[Match | ReadError | NonElementReturned]],
+    ) -> Iterable[Match | ReadError | NonElementReturned]:
+        """
+        Return results for the contents identified by `key`, using `search` to
+        get them if they haven't been searched already.
+        """
+        stored_results = self.results.get(key)
+        if stored_results is not None:
+            stats.count("duplicate_contents")
+            for result in stored_results:
+                yield with_path(result, path)
+            return
+
+        results = []
+        for result in search():
+            results.append(result)
+            yield result
+        # ReadErrors are stored too, so that contents that can't be parsed are
+        # only parsed once. `with_path` fixes up error messages that refer to the path.
+        # Results are not stored if a time limit stopped the search part way.
+        self.results[key] = results
+
+
+def process_and_search(
+    process: Callable[[], ProcessedPython | ReadError],
+    query_func: XMLQueryFunc,
+    rules: Sequence[Rule],
+) -> Iterable[Match | ReadError | NonElementReturned]:
+    processed_python = process()
+    if isinstance(processed_python, ReadError):
+        yield processed_python
+        return
+    yield from search_processed_python(processed_python, query_func, rules)
+
+
+def search_with_result_cache(
+    content_key: bytes,
+    process: Callable[[], ProcessedPython | ReadError],
+    query_func: XMLQueryFunc,
+    rules: Sequence[Rule],
+    *,
+    result_cache: ResultCache,
+    limits: Limits | None = None,
+) -> Iterable[Match | ReadError | NonElementReturned]:
+    """
+    Return results for the contents identified by `content_key`, using
+    stored results from `result_cache` if available.
+
+    `process` must apply `limits`. With a limit on the number of nodes, the
+    contents are always parsed, to check the limit.
+    """
+    query_keys = [result_cache.query_key(query_func, rule.expression) for rule in rules]
+    all_cached_matches = [result_cache.get(content_key, query_key) for query_key in query_keys]
+    cache_misses = all_cached_matches.count(None)
+    stats.count("cache_hits", len(rules) - cache_misses)
+    stats.count("cache_misses", cache_misses)
+    if (limits is None or limits.max_nodes is None) and all(
+        cached_matches is not None and not cached_matches for cached_matches in all_cached_matches
+    ):
+        # The common case, for which we don't need to parse at all.
+        return
+
+    # For cached matches, we still need to parse to construct `Match` objects,
+    # which contain AST and XML nodes, but we can skip evaluating the expression.
+    processed_python = process()
+    if isinstance(processed_python, ReadError):
+        yield processed_python
+        return
     file_lines = processed_python.contents.splitlines()
-    matching_elements = query_func(processed_python.xml, expression)
+    elements: list[_Element] = []
+    element_indices: dict[_Element, int] = {}
+    results: list[Match | NonElementReturned] = []
+    uncached: list[tuple[Rule, bytes]] = []
+    for rule, query_key, cached_matches in zip(rules, query_keys, all_cached_matches):
+        if cached_matches is None:
+            uncached.append((rule, query_key))
+            continue
+        if cached_matches and not elements:
+            elements = list(processed_python.xml.iter())
+        for element_index, _, _ in cached_matches:
+            match = make_match(processed_python, file_lines, elements[element_index], rule_id=rule.id)
+            if match is not None:
+                results.append(match)
+
+    uncached_rules = [rule for rule, _ in uncached]
+    try:
+        for (rule, query_key), matching_elements in zip(
+            uncached, query_rules(processed_python.xml, query_func, uncached_rules, path=processed_python.path)
+        ):
+            rule_results: list[Match | NonElementReturned] = []
+            for result in rule_matches(processed_python, file_lines, rule, matching_elements):
+                rule_results.append(result)
+                results.append(result)
+            if not any(isinstance(result, NonElementReturned) for result in rule_results):
+                if rule_results and not element_indices:
+                    element_indices = {element: index for index, element in enumerate(processed_python.xml.iter())}
+                result_cache.put(
+                    content_key,
+                    query_key,
+                    [
+                        (element_indices[result.xml_element], result.position.lineno, result.position.col_offset)
+                        for result in rule_results
+                        if isinstance(result, Match)
+                    ],
+                )
+    except LimitExceeded:
+        # Return the matches found before a time limit was reached
+        yield from results if len(rules) == 1 else sorted_by_position(results)
+        raise
+    yield from results if len(rules) == 1 else sorted_by_position(results)
+
 
+def search_processed_python(
+    processed_python: ProcessedPython,
+    query_func: XMLQueryFunc,
+    rules: Sequence[Rule],
+) -> Iterable[Match | NonElementReturned]:
+    file_lines = processed_python.contents.splitlines()
+    if len(rules) == 1:
+        rule = rules[0]
+        with stats.timed("query", processed_python.path):
+            matching_elements = query_rule(processed_python.xml, query_func, rule)
+        yield from rule_matches(processed_python, file_lines, rule, matching_elements)
+        return
+    # Report matches in the same order as for a single expression
+    results: list[Match | NonElementReturned] = []
+    try:
+        for rule, matching_elements in zip(
+            rules, query_rules(processed_python.xml, query_func, rules, path=processed_python.path)
+        ):
+            for result in rule_matches(processed_python, file_lines, rule, matching_elements):
+                results.append(result)
+    except LimitExceeded:
+        # Return the matches found before a time limit was reached
+        yield from sorted_by_position(results)
+        raise
+    yield from sorted_by_position(results)
+
+
+def query_rules(
+    root: _Element, query_func: XMLQueryFunc, rules: Sequence[Rule], *, path: Pathlike | None = None
+) -> list[Iterable[_Element | _ElementUnicodeResult]]:
+    """
+    Evaluate all the rules, returning the results for each rule.
+    """
+    with stats.timed("query", path):
+        if len(rules) > 1 and query_func is xml.lxml_query:
+            # Evaluate together, with a single traversal for most rules
+            return compile_rule_set(tuple(rule.expression for rule in rules)).evaluate(root, query_func)
+        if len(rules) > 1:
+            # XPath 2.0, only imported if it is being used
+            from .xpath2 import elementpath_query, elementpath_query_all
+
+            if query_func is elementpath_query:
+                # Build the node tree for the document once, for all the rules
+                return list(elementpath_query_all(root, [rule.expression for rule in rules]))
+        return [query_rule(root, query_func, rule) for rule in rules]
+
+
+def query_rule(root: _Element, query_func: XMLQueryFunc, rule: Rule) -> Iterable[_Element | _ElementUnicodeResult]:
+    if query_func is xml.lxml_query and (evaluate := regex_query(rule.expression)) is not None:
+        return evaluate(root)
+    return query_func(root, rule.expression)
+
+
+def rule_matches(
+    processed_python: ProcessedPython,
+    file_lines: list[str],
+    rule: Rule,
+    matching_elements: Iterable[_Element | _ElementUnicodeResult],
+) -> Iterable[Match | NonElementReturned]:
     try:
         iterator = iter(matching_elements)
     except TypeError:
         yield NonElementReturned(matching_elements)
         return
 
+    # Matches are returned as they are made, so that those made before a time
+    # limit is reached are not lost.
+    yield from stats.timed_iter(
+        _rule_matches(processed_python, file_lines, rule, iterator), "materialize", processed_python.path
+    )
+
+
+def _rule_matches(
+    processed_python: ProcessedPython,
+    file_lines: list[str],
+    rule: Rule,
+    iterator: Iterator[_Element | _ElementUnicodeResult],
+) -> Iterator[Match | NonElementReturned]:
     for element in iterator:
         if not isinstance(element, _Element):
             # Most likely an _ElementUnicodeResult, the result of a query that terminated in
@@ -146,14 +638,54 @@ def search_python_file(
             yield NonElementReturned(element)
             continue
 
-        ast_node = processed_python.node_mappings.get(element, None)
-        if ast_node is not None:
-            position = position_from_node(ast_node)
-            if position is not None:
-                yield Match(
-                    path=processed_python.path,
-                    file_lines=file_lines,
-                    xml_element=element,
-                    position=position,
-                    ast_node=ast_node,
-                )
+        check_deadline()
+        match = make_match(processed_python, file_lines, element, rule_id=rule.id)
+        if match is not None:
+            stats.count("matches")
+            yield match
+
+
+def sorted_by_position(results: Iterable[Match | NonElementReturned]) -> list[Match | NonElementReturned]:
+    return sorted(
+        results,
+        key=lambda result: (
+            (result.position.lineno, result.position.col_offset) if isinstance(result, Match) else (0, -1)
+        ),
+    )
+
+
+def make_match(
+    processed_python: ProcessedPython, file_lines: list[str], element: _Element, *, rule_id: str | None = None
+) -> Match | None:
+    ast_node = processed_python.node_mappings.get(element, None)
+    if ast_node is None:
+        return None
+    position = position_from_node(ast_node)
+    if position is None:
+        return None
+    return Match(
+        path=processed_python.path,
+        file_lines=file_lines,
+        xml_element=element,
+        position=position,
+        ast_node=ast_node,
+        rule_id=rule_id,
+    )
+
+
+def with_path(result: Match | ReadError | NonElementReturned, path: Pathlike) -> Match | ReadError | NonElementReturned:
+    """
+    Returns a copy of the search result, for a different path.
+
+    This is used when the same contents are found at more than one path, so
+    that the contents only need to be searched once.
+    """
+    if isinstance(result, Match):
+        return dataclasses.replace(result, path=path)
+    if isinstance(result, ReadError):
+        exception = result.exception
+        if isinstance(exception, SyntaxError) and exception.filename == result.path:
+            exception = copy.copy(exception)
+            exception.filename = str(path)
+        return dataclasses.replace(result, path=str(path), exception=exception)
+    return result
@@ -0,0 +1,266 @@
+"""
+Statistics for a search: files and directories walked, bytes read, cache hits
+and time spent in each phase of the search.
+
+Collection is off by default, and is switched on for a block of code using
+`collect_stats()`. When it is off, `timed()` returns a shared no-op context
+manager and `count()` returns immediately, so the instrumentation in the rest
+of the code costs close to nothing.
+
+Timings are passed to all active recorders, which are `Stats` objects and
+other recorders such as `trace.Tracer`, added using `recording()`.
+
+Counts can also be collected for each subject (e.g. each directory or file)
+using `count_operations()`. This is used in tests to check that work is not
+repeated, e.g. that each directory is listed only once.
+
+Phases can be nested, e.g. "ignore" within "walk", and times are exclusive:
+time spent in a nested phase is not counted for the outer one. So the phase
+times add up to the total time. Each thread has its own stack of phases, and
+time that other threads spend in phases is added too, so with threads (e.g.
+`search_python_files_async`) the phase times can add up to more than the total.
+"""
+from __future__ import annotations
+
+import contextlib
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from typing import ContextManager, Iterable, Iterator, Protocol, TypeVar
+
+# Phases, in pipeline order. Time not in any phase is counted as "other".
+PHASES = ("walk", "ignore", "read", "parse", "link", "convert", "query", "materialize", "print", "other")
+
+# Counters, with descriptions
+COUNTERS = {
+    "dirs_visited": "Directories visited",
+    "stat_calls": "Stat calls",
+    "ignore_files_read": "Ignore files read",
+    "files_walked": "Files walked",
+    "files_ignored": "Files ignored",
+    "files_skipped": "Files skipped using index",
+    "files_parsed": "Files parsed",
+    "files_converted": "Files converted to XML",
+    "ast_nodes": "AST nodes converted",
+    "xpath_compiled": "XPath expressions compiled",
+    "xpath2_compiled": "XPath 2.0 expressions compiled",
+    "node_trees_built": "XPath 2.0 node trees built",
+    "bytes_read": "Bytes read",
+    "matches": "Matches",
+    "cache_hits": "Result cache hits",
+    "cache_misses": "Result cache misses",
+    "duplicate_contents": "Duplicate contents not searched again",
+}
+
+
+class Recorder(Protocol):
+    def enter(self, phase: str, subject: object = None) -> None:
+        """
+        Start timing `phase`, for `subject` (e.g. the path of a file or directory) if given.
+        """
+        ...
+
+    def exit(self) -> None:
+        """
+        Stop timing the most recently entered phase.
+        """
+        ...
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.counters: Counter[str] = Counter()
+        self.timings: dict[str, float] = dict.fromkeys(PHASES, 0.0)
+        self.start_time = time.perf_counter()
+        self.elapsed: float | None = None
+        self.peak_rss: int | None = None
+        # For each thread, the stack of current phases, and the time the top
+        # one was entered or resumed. Time in other threads outside any phase
+        # is not counted.
+        self._local = threading.local()
+        self._local.phases = ["other"]
+        self._local.mark = self.start_time
+
+    def _phases(self) -> list[str]:
+        try:
+            return self._local.phases  # type: ignore[no-any-return]
+        except AttributeError:
+            self._local.phases = []
+            return self._local.phases  # type: ignore[no-any-return]
+
+    def enter(self, phase: str, subject: object = None) -> None:
+        now = time.perf_counter()
+        phases = self._phases()
+        if phases:
+            self.timings[phases[-1]] += now - self._local.mark
+        phases.append(phase)
+        self._local.mark = now
+
+    def exit(self) -> None:
+        now = time.perf_counter()
+        self.timings[self._phases().pop()] += now - self._local.mark
+        self._local.mark = now
+
+    def finish(self) -> None:
+        while self._phases():
+            self.exit()
+        self.elapsed = time.perf_counter() - self.start_time
+        self.peak_rss = get_peak_rss()
+
+    def to_dict(self) -> dict[str, object]:
+        return {
+            "elapsed_seconds": None if self.elapsed is None else round(self.elapsed, 6),
+            "phase_seconds": {phase: round(seconds, 6) for phase, seconds in self.timings.items()},
+            "counters": {counter: self.counters[counter] for counter in COUNTERS},
+            "peak_rss_bytes": self.peak_rss,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    def to_text(self) -> str:
+        lines = []
+        for counter, description in COUNTERS.items():
+            lines.append(f"{description}: {self.counters[counter]}")
+        if self.peak_rss is not None:
+            lines.append(f"Peak RSS: {self.peak_rss / 1024 / 1024:.1f} MiB")
+        lines.append("Time (seconds):")
+        for phase, seconds in self.timings.items():
+            lines.append(f"  {phase:<12}{seconds:10.3f}")
+        if self.elapsed is not None:
+            lines.append(f"  {'total':<12}{self.elapsed:10.3f}")
+        return "\n".join(lines)
+
+
+# Stats object used for counters
+_current: Stats | None = None
+_recorders: list[Recorder] = []
+# Counts by counter and subject
+_operations: Counter[tuple[str, object]] | None = None
+
+
+class _Timer:
+    __slots__ = ("phase", "subject")
+
+    def __init__(self, phase: str, subject: object):
+        self.phase = phase
+        self.subject = subject
+
+    def __enter__(self) -> None:
+        for recorder in _recorders:
+            recorder.enter(self.phase, self.subject)
+
+    def __exit__(self, *exc_info: object) -> None:
+        for recorder in _recorders:
+            recorder.exit()
+
+
+_NULL_TIMER = contextlib.nullcontext()
+
+
+def timed(phase: str, subject: object = None) -> ContextManager[None]:
+    """
+    Context manager that records the time spent in the block for `phase`.
+
+    `subject` is the file or directory being processed, if any. To keep
+    disabled timers cheap, this should not be formatted before being passed.
+    """
+    if not _recorders:
+        return _NULL_TIMER
+    return _Timer(phase, subject)
+
+
+T = TypeVar("T")
+
+
+def timed_iter(iterable: Iterable[T], phase: str, subject: object = None) -> Iterable[T]:
+    """
+    Wraps an iterable (typically a generator), recording the time spent
+    producing each item for `phase`.
+    """
+    if not _recorders:
+        return iterable
+    return _timed_iter(iter(iterable), phase, subject)
+
+
+def _timed_iter(iterator: Iterator[T], phase: str, subject: object) -> Iterator[T]:
+    timer = _Timer(phase, subject)
+    while True:
+        try:
+            with timer:
+                item = next(iterator)
+        except StopIteration:
+            return
+        yield item
+
+
+def count(counter: str, amount: int = 1, *, subject: object = None) -> None:
+    """
+    Adds `amount` to `counter`, for `subject` (e.g. the path of a file or directory) if given.
+    """
+    if _current is not None:
+        _current.counters[counter] += amount
+    if _operations is not None:
+        _operations[counter, subject] += amount
+
+
+@contextlib.contextmanager
+def collect_stats() -> Iterator[Stats]:
+    """
+    Collect statistics for the code run in the block, returning a `Stats`
+    object which is complete when the block exits.
+    """
+    global _current
+    previous = _current
+    stats = Stats()
+    _current = stats
+    try:
+        with recording(stats):
+            yield stats
+    finally:
+        _current = previous
+        stats.finish()
+
+
+@contextlib.contextmanager
+def count_operations() -> Iterator[Counter[tuple[str, object]]]:
+    """
+    Count operations for the code run in the block, returning a Counter
+    keyed on (counter, subject) tuples.
+    """
+    global _operations
+    previous = _operations
+    operations: Counter[tuple[str, object]] = Counter()
+    _operations = operations
+    try:
+        yield operations
+    finally:
+        _operations = previous
+
+
+@contextlib.contextmanager
+def recording(recorder: Recorder) -> Iterator[None]:
+    """
+    Pass timings to `recorder` for the code run in the block.
+    """
+    _recorders.append(recorder)
+    try:
+        yield
+    finally:
+        _recorders.remove(recorder)
+
+
+def get_peak_rss() -> int | None:
+    """
+    Returns the peak resident set size of the process in bytes, if available.
+    """
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
@@ -0,0 +1,87 @@
+"""
+Export of the timings of the search pipeline as Chrome trace events, which
+can be loaded into Perfetto (https://ui.perfetto.dev) or chrome://tracing.
+
+There is a span for each phase of processing each file (read, parse, link,
+convert, query, materialize, and writing output), and for listing each
+directory walked and loading its ignore files. Each span records the process
+and thread it ran in. Timings without a file or directory, such as the time
+taken to produce each result, are not recorded, as there would be far too
+many of them to be useful.
+
+See https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+for the format.
+"""
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator
+
+from . import stats
+
+
+class Tracer:
+    """
+    Recorder of spans as trace events, for use with `stats.recording()`.
+    """
+
+    def __init__(self) -> None:
+        self.events: list[dict[str, Any]] = []
+        self.start_time = time.perf_counter()
+        self.pid = os.getpid()
+        self.thread_names: dict[int, str] = {}
+        self._local = threading.local()
+
+    def _stack(self) -> list[tuple[str, object, float]]:
+        try:
+            return self._local.stack  # type: ignore[no-any-return]
+        except AttributeError:
+            self._local.stack = []
+            self.thread_names[threading.get_native_id()] = threading.current_thread().name
+            return self._local.stack  # type: ignore[no-any-return]
+
+    def enter(self, phase: str, subject: object = None) -> None:
+        self._stack().append((phase, subject, time.perf_counter()))
+
+    def exit(self) -> None:
+        phase, subject, start = self._stack().pop()
+        if subject is None:
+            return
+        end = time.perf_counter()
+        event: dict[str, Any] = {
+            "name": f"{phase} {subject}",
+            "cat": phase,
+            "ph": "X",
+            "ts": round((start - self.start_time) * 1e6, 3),
+            "dur": round((end - start) * 1e6, 3),
+            "pid": self.pid,
+            "tid": threading.get_native_id(),
+            "args": {"path": str(subject)},
+        }
+        self.events.append(event)
+
+    def to_dict(self) -> dict[str, Any]:
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+            for tid, name in self.thread_names.items()
+        ]
+        return {"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}
+
+    def write(self, path: Path | str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+
+
+@contextlib.contextmanager
+def collect_trace() -> Iterator[Tracer]:
+    """
+    Record trace events for the code run in the block.
+    """
+    tracer = Tracer()
+    with stats.recording(tracer):
+        yield tracer
@@ -1,16 +1,73 @@
 from __future__ import annotations
 
 import re
+from functools import lru_cache, partial
 from typing import Any, Callable, Protocol, TypeVar, cast
 
 from lxml import etree
 from lxml.etree import _Element, _ElementUnicodeResult, tostring
 
+from . import stats
+from .limits import check_deadline
+from .xpath_syntax import tokenize
+
 __all__ = ["tostring", "lxml_query"]
 
 
 def lxml_query(element: _Element, expression: str) -> list[_Element | _ElementUnicodeResult]:
-    return element.xpath(expression)  # type: ignore[no-any-return]
+    return compile_xpath(expression)(element)  # type: ignore[no-any-return]
+
+
+XPathEvaluator = Callable[[_Element], Any]
+
+
+@lru_cache(maxsize=None)
+def compile_xpath(expression: str) -> XPathEvaluator:
+    """
+    Returns the compiled XPath for the expression, compiling each expression
+    only once however many files are searched.
+
+    Raises XPathError for invalid expressions.
+    """
+    stats.count("xpath_compiled", subject=expression)
+    etree.XPath(expression)  # Report errors using the original expression
+    compiled_expression = _without_regex_prefixes(expression)
+    if any(token.text == ":" for token in tokenize(compiled_expression)):
+        # Other namespace prefixes. libxml2 caches the namespace URI it looks up
+        # in the compiled expression, but lxml registers namespaces afresh for
+        # each evaluation, freeing the old ones, so reusing the compiled
+        # expression would read freed memory.
+        return partial(_evaluate_uncompiled, expression)
+    return etree.XPath(compiled_expression, extensions=_REGEX_EXTENSIONS)
+
+
+def _evaluate_uncompiled(expression: str, element: _Element) -> Any:
+    return element.xpath(expression)
+
+
+def _without_regex_prefixes(expression: str) -> str:
+    """
+    Rewrites calls to `re:match` and `re:search` as calls to the unprefixed
+    `re-match` and `re-search` extension functions, which can be compiled once
+    and reused safely (see `compile_xpath`).
+    """
+    tokens = tokenize(expression)
+    parts = []
+    last_end = 0
+    for idx in range(len(tokens) - 3):
+        prefix, colon, name, paren = tokens[idx : idx + 4]
+        if (
+            prefix.kind == "name"
+            and prefix.text == "re"
+            and colon.text == ":"
+            and name.text in ("match", "search")
+            and paren.text == "("
+        ):
+            parts.append(expression[last_end : prefix.start])
+            parts.append(f"re-{name.text}")
+            last_end = name.end
+    parts.append(expression[last_end:])
+    return "".join(parts)
 
 
 F = TypeVar("F", bound=Callable[..., Any])
@@ -21,15 +78,40 @@ class IdentityProto(Protocol):
         ...
 
 
-regex_ns = cast(IdentityProto, etree.FunctionNamespace("https://github.com/spookylukey/pyastgrep"))
+REGEX_NAMESPACE = "https://github.com/spookylukey/pyastgrep"
+
+regex_ns = cast(IdentityProto, etree.FunctionNamespace(REGEX_NAMESPACE))
 regex_ns.prefix = "re"  # type: ignore[attr-defined]
 
 
+@lru_cache(maxsize=None)
+def compile_regex(pattern: str) -> re.Pattern[str]:
+    return re.compile(pattern)
+
+
+# These are called by libxml2 for every candidate node, so need to be fast.
+# Where possible, expressions using them are evaluated without calling them,
+# see `rules.regex_query`.
+
+
 @regex_ns
 def match(ctx: None, pattern: str, strings: list[str]) -> bool:
-    return any(re.match(pattern, s) is not None for s in strings)
+    check_deadline()
+    match = compile_regex(pattern).match
+    for s in strings:
+        if match(s) is not None:
+            return True
+    return False
 
 
 @regex_ns
 def search(ctx: None, pattern: str, strings: list[str]) -> bool:
-    return any(re.search(pattern, s) is not None for s in strings)
+    check_deadline()
+    search = compile_regex(pattern).search
+    for s in strings:
+        if search(s) is not None:
+            return True
+    return False
+
+
+_REGEX_EXTENSIONS = {(None, "re-match"): match, (None, "re-search"): search}
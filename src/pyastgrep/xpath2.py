@@ -1,9 +1,110 @@
 # This is a separate module to avoid importing elementpath if we don't need it
+"""
+XPath 2.0 queries, using elementpath.
+
+Most of the cost of an elementpath query is building its node tree for the
+document and walking it, rather than parsing the expression. So we:
+
+- parse each expression only once, however many files are searched,
+- build the node tree once per document, however many expressions are
+  evaluated against it,
+- skip documents that don't contain the tag an anchored expression like
+  `.//Tag[...]` selects, without building the node tree at all.
+"""
 from __future__ import annotations
 
-import elementpath  # XPath 2.0 functions
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Iterable, Sequence
+
+from elementpath import XPath2Parser, XPathContext, XPathNode
+from elementpath.tree_builders import get_node_tree
+from elementpath.xpath_tokens import XPathToken
 from lxml.etree import _Element, _ElementUnicodeResult
 
+from . import stats
+from .limits import check_deadline
+from .rules import anchor_tag
+from .xml import REGEX_NAMESPACE, compile_regex
+
+
+@dataclass(frozen=True)
+class CompiledXPath2:
+    root_token: XPathToken
+    # The tag of every element the expression can select, if known
+    tag: str | None
+
 
 def elementpath_query(element: _Element, expression: str) -> list[_Element | _ElementUnicodeResult]:
-    return elementpath.select(element, expression)  # type: ignore[no-any-return]
+    return elementpath_query_all(element, [expression])[0]
+
+
+def elementpath_query_all(
+    element: _Element, expressions: Sequence[str]
+) -> list[list[_Element | _ElementUnicodeResult]]:
+    """
+    Evaluates each of the expressions, building the node tree for the
+    document only once, and only if needed.
+    """
+    # The node tree is not kept after this, so it is freed along with the document.
+    node_tree: Any = None
+    results: list[list[_Element | _ElementUnicodeResult]] = []
+    for expression in expressions:
+        compiled = compile_xpath2(expression)
+        if compiled.tag is not None and next(element.iter(compiled.tag), None) is None:
+            results.append([])
+            continue
+        if node_tree is None:
+            stats.count("node_trees_built")
+            node_tree = get_node_tree(element)  # type: ignore[arg-type]
+        results.append(compiled.root_token.get_results(XPathContext(node_tree)))  # type: ignore[arg-type]
+    return results
+
+
+@lru_cache(maxsize=None)
+def compile_xpath2(expression: str) -> CompiledXPath2:
+    """
+    Returns the parsed XPath 2.0 expression, parsing each expression only once.
+
+    Raises ElementPathError for invalid expressions.
+    """
+    stats.count("xpath2_compiled", subject=expression)
+    # Parsers aren't thread safe, and functions are registered per parser, so
+    # we use a new one each time.
+    parser = XPath2Parser(namespaces={"re": REGEX_NAMESPACE})
+    parser.external_function(regex_match, name="match", prefix="re", sequence_types=REGEX_SEQUENCE_TYPES)
+    parser.external_function(regex_search, name="search", prefix="re", sequence_types=REGEX_SEQUENCE_TYPES)
+    return CompiledXPath2(root_token=parser.parse(expression), tag=anchor_tag(expression))
+
+
+# Equivalents of the `re:match` and `re:search` functions in `xml`. The
+# strings are attribute nodes or other items, rather than strings.
+
+REGEX_SEQUENCE_TYPES = ("xs:string", "item()*", "xs:boolean")
+
+
+def regex_match(pattern: str, items: Any) -> bool:
+    check_deadline()
+    match = compile_regex(pattern).match
+    for s in _item_strings(items):
+        if match(s) is not None:
+            return True
+    return False
+
+
+def regex_search(pattern: str, items: Any) -> bool:
+    check_deadline()
+    search = compile_regex(pattern).search
+    for s in _item_strings(items):
+        if search(s) is not None:
+            return True
+    return False
+
+
+def _item_strings(items: Any) -> Iterable[str]:
+    if items is None:
+        return
+    if not isinstance(items, list):
+        items = [items]
+    for item in items:
+        yield item.string_value if isinstance(item, XPathNode) else str(item)
@@ -0,0 +1,136 @@
+"""
+A deliberately limited XPath tokenizer and parser, used for analysing
+expressions in order to optimise searches.
+
+It only needs to understand the common case of location paths with simple
+predicates. Code using it must treat anything it doesn't understand as
+"unknown", and fall back to evaluating the expression normally.
+"""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<string>"[^"]*"|'[^']*')
+    |(?P<number>\d+(?:\.\d*)?|\.\d+)
+    |(?P<op>//|::|\.\.|!=|<=|>=|[/\[\]()@,|=<>*+.$:-])
+    |(?P<name>[A-Za-z_][\w.-]*)
+    |(?P<space>\s+)
+    |(?P<other>.)
+    """,
+    re.VERBOSE,
+)
+
+
+@dataclass(frozen=True)
+class Token:
+    kind: str
+    text: str
+    # Position in the expression, -1 for tokens not from the expression
+    start: int = -1
+    end: int = -1
+
+
+def tokenize(expression: str) -> list[Token]:
+    tokens = []
+    for token_match in _TOKEN_RE.finditer(expression):
+        kind = token_match.lastgroup
+        assert kind is not None
+        if kind != "space":
+            tokens.append(Token(kind, token_match.group(), token_match.start(), token_match.end()))
+    return tokens
+
+
+def split_top_level(tokens: list[Token]) -> list[Token | list[Token]]:
+    """
+    Returns tokens at the top level, with bracketed predicates as nested lists
+    of the tokens inside the brackets. Raises ValueError if brackets are
+    unbalanced.
+    """
+    result: list[Token | list[Token]] = []
+    depth = 0
+    current: list[Token] = []
+    for token in tokens:
+        if token.text == "[" and token.kind == "op":
+            if depth > 0:
+                current.append(token)
+            depth += 1
+        elif token.text == "]" and token.kind == "op":
+            depth -= 1
+            if depth < 0:
+                raise ValueError("Unbalanced brackets")
+            if depth > 0:
+                current.append(token)
+            else:
+                result.append(current)
+                current = []
+        elif depth > 0:
+            current.append(token)
+        else:
+            result.append(token)
+    if depth != 0:
+        raise ValueError("Unbalanced brackets")
+    return result
+
+
+def is_name(item: Token | list[Token], text: str) -> bool:
+    return isinstance(item, Token) and item.kind == "name" and item.text == text
+
+
+def split_conjuncts(predicate: list[Token]) -> list[list[Token]] | None:
+    """
+    Splits the tokens of a predicate into the parts joined by top-level `and`.
+    Returns None if the predicate has a top-level `or`, or can't be parsed.
+    """
+    try:
+        items = split_top_level(predicate)
+    except ValueError:
+        return None
+    if any(is_name(item, "or") for item in items):
+        return None
+    conjuncts: list[list[Token]] = [[]]
+    for item in items:
+        if is_name(item, "and"):
+            conjuncts.append([])
+        elif isinstance(item, list):
+            # Re-flatten nested predicates
+            conjuncts[-1].extend([Token("op", "["), *item, Token("op", "]")])
+        else:
+            conjuncts[-1].append(item)
+    return conjuncts
+
+
+def attribute_equality(conjunct: list[Token]) -> tuple[str, str] | None:
+    """
+    For a conjunct of the form `@attr = "value"` or `"value" = @attr`,
+    returns (attr, value), otherwise None.
+    """
+    texts = [token.text for token in conjunct]
+    kinds = [token.kind for token in conjunct]
+    if kinds == ["op", "name", "op", "string"] and texts[0] == "@" and texts[2] == "=":
+        return texts[1], texts[3][1:-1]
+    if kinds == ["string", "op", "op", "name"] and texts[1] == "=" and texts[2] == "@":
+        return texts[3], texts[0][1:-1]
+    return None
+
+
+def attribute_regex(conjunct: list[Token]) -> tuple[str, str, str] | None:
+    """
+    For a conjunct of the form `re:match("pattern", @attr)` or
+    `re:search("pattern", @attr)`, returns (function name, attr, pattern),
+    otherwise None.
+    """
+    texts = [token.text for token in conjunct]
+    kinds = [token.kind for token in conjunct]
+    if (
+        kinds == ["name", "op", "name", "op", "string", "op", "op", "name", "op"]
+        and texts[:2] == ["re", ":"]
+        and texts[2] in ("match", "search")
+        and texts[3] == "("
+        and texts[5:7] == [",", "@"]
+        and texts[8] == ")"
+    ):
+        return texts[2], texts[7], texts[4][1:-1]
+    return None
@@ -0,0 +1,19 @@
+# flake8: noqa
+TOP = 1
+
+
+class MyClass:
+    @staticmethod
+    def method():
+        x = 1
+
+        def inner():
+            return x
+
+        return inner
+
+    y = 2
+
+
+async def func():
+    z = 3
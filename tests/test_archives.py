@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import io
+import tarfile
+import zipfile
+from pathlib import Path
+from unittest.mock import patch
+
+from pyastgrep.api import Match, search_python_files
+from pyastgrep.files import ReadError, get_files_to_search, process_python_source
+
+from tests.utils import chdir, run_print
+
+MODULE_CONTENTS = b"def in_archive():\n    pass\n"
+OTHER_CONTENTS = b"x = 1\n"
+
+
+def make_zip(path: Path, members: dict[str, bytes]) -> Path:
+    with zipfile.ZipFile(path, "w") as zip_file:
+        for name, contents in members.items():
+            zip_file.writestr(name, contents)
+    return path
+
+
+def make_tar_gz(path: Path, members: dict[str, bytes]) -> Path:
+    with tarfile.open(path, "w:gz") as tar_file:
+        for name, contents in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(contents)
+            tar_file.addfile(info, io.BytesIO(contents))
+    return path
+
+
+def test_search_wheel(tmp_path):
+    make_zip(
+        tmp_path / "package-1.0-py3-none-any.whl",
+        {"package/__init__.py": OTHER_CONTENTS, "package/mod.py": MODULE_CONTENTS, "package/README.txt": b"def x"},
+    )
+    output = run_print(tmp_path, ".//FunctionDef", ["package-1.0-py3-none-any.whl"])
+    assert output.stdout == "package-1.0-py3-none-any.whl!/package/mod.py:1:1:def in_archive():\n"
+    assert output.stderr == ""
+
+
+def test_search_sdist(tmp_path):
+    make_tar_gz(tmp_path / "package-1.0.tar.gz", {"package-1.0/package/mod.py": MODULE_CONTENTS})
+    output = run_print(tmp_path, ".//FunctionDef", ["package-1.0.tar.gz"])
+    assert output.stdout == "package-1.0.tar.gz!/package-1.0/package/mod.py:1:1:def in_archive():\n"
+
+
+def test_broken_archive(tmp_path):
+    (tmp_path / "broken.zip").write_bytes(b"not a zip file")
+    output = run_print(tmp_path, ".//FunctionDef", ["broken.zip"])
+    assert output.stderr == "broken.zip: File is not a zip file\n"
+
+
+def test_archives_found_when_walking_only_if_requested(tmp_path):
+    make_zip(tmp_path / "archive.zip", {"mod.py": MODULE_CONTENTS})
+    (tmp_path / "plain.py").write_bytes(OTHER_CONTENTS)
+    with chdir(tmp_path):
+        assert list(get_files_to_search([Path(".")])) == [Path("plain.py")]
+        found = [path for path in get_files_to_search([Path(".")], search_archives=True) if isinstance(path, Path)]
+        assert sorted(found) == [Path("archive.zip"), Path("plain.py")]
+
+
+def test_identical_members_searched_once(tmp_path):
+    make_zip(tmp_path / "package-1.0.zip", {"package/mod.py": MODULE_CONTENTS, "package/other.py": OTHER_CONTENTS})
+    make_zip(tmp_path / "package-1.1.zip", {"package/mod.py": MODULE_CONTENTS, "package/other.py": b"y = 2\n"})
+    with chdir(tmp_path):
+        with patch("pyastgrep.search.process_python_source", wraps=process_python_source) as process:
+            results = list(search_python_files([Path("package-1.0.zip"), Path("package-1.1.zip")], ".//FunctionDef"))
+    assert process.call_count == 3
+    assert [str(r.path) for r in results if isinstance(r, Match)] == [
+        "package-1.0.zip!/package/mod.py",
+        "package-1.1.zip!/package/mod.py",
+    ]
+    assert not [r for r in results if isinstance(r, ReadError)]
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import pytest
+from pyastgrep import stats
+from pyastgrep.api import Limits, Match, SkippedFile, search_python_files, search_python_files_async
+
+DIR = Path(__file__).parent / "examples"
+
+
+def summarize(results: list[Any]) -> list[tuple[object, ...]]:
+    return [
+        (type(result).__name__, str(result.path), result.position, result.rule_id)
+        if isinstance(result, Match)
+        else (type(result).__name__, repr(result))
+        for result in results
+    ]
+
+
+async def collect(*args: Any, **kwargs: Any) -> list[Any]:
+    return [result async for result in search_python_files_async(*args, **kwargs)]
+
+
+def make_files(directory: Path, count: int) -> None:
+    for i in range(count):
+        (directory / f"module{i:02}.py").write_text("def foo(x):\n    return bar(x)\n")
+
+
+def test_same_results_as_sync():
+    expressions = [".//Name", ".//FunctionDef", './/Call[re:match("b", func/Name/@id)]']
+    expected = summarize(list(search_python_files([DIR, Path("missing.py")], expressions)))
+    results = asyncio.run(collect([DIR, Path("missing.py")], expressions, max_pending=3))
+    assert summarize(results) == expected
+
+
+def test_shared_executor(tmp_path):
+    make_files(tmp_path, 10)
+
+    async def main() -> tuple[list[Any], list[Any]]:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            return await asyncio.gather(
+                collect([tmp_path], ".//Name", executor=executor),
+                collect([tmp_path], ".//Call", executor=executor),
+            )
+
+    names, calls = asyncio.run(main())
+    assert len([result for result in names if isinstance(result, Match)]) == 20
+    assert len([result for result in calls if isinstance(result, Match)]) == 10
+
+
+def test_backpressure_and_early_exit(tmp_path):
+    make_files(tmp_path, 20)
+
+    async def main() -> None:
+        results = search_python_files_async([tmp_path], ".//Name", max_pending=2)
+        first = await results.__anext__()
+        assert isinstance(first, Match)
+        # A slow consumer doesn't cause more files to be searched
+        await asyncio.sleep(0.1)
+        await results.aclose()
+
+    with stats.count_operations() as operations:
+        asyncio.run(main())
+    parsed = [subject for (counter, subject) in operations if counter == "files_parsed"]
+    assert 1 <= len(parsed) <= 2
+
+
+def test_time_limit(tmp_path):
+    make_files(tmp_path, 3)
+    [skipped] = asyncio.run(collect([tmp_path], ".//Name", limits=Limits(time_limit=0)))
+    assert isinstance(skipped, SkippedFile)
+
+
+def test_process_pool_rejected():
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        with pytest.raises(TypeError):
+            asyncio.run(collect([DIR], ".//Name", executor=executor))
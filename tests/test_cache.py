@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, Sequence
+from unittest.mock import patch
+
+from pyastgrep.api import Match, search_python_files
+from pyastgrep.cache import ResultCache
+from pyastgrep.files import ProcessedPython, ReadError, process_python_source
+
+from tests.utils import chdir
+
+DIR = Path(__file__).parent / "examples" / "test_cli"
+
+
+def search(paths: Sequence[Path], expression: str, cache_path: Path) -> tuple[list[Any], int]:
+    with ResultCache(cache_path) as result_cache:
+        with chdir(DIR):
+            with patch("pyastgrep.search.process_python_source", wraps=process_python_source) as process:
+                results = list(search_python_files(paths, expression, result_cache=result_cache))
+    return results, process.call_count
+
+
+def match_summary(results: list[Any]) -> list[tuple[object, ...]]:
+    return [
+        (str(r.path), r.position, type(r.ast_node).__name__, r.xml_element.tag) for r in results if isinstance(r, Match)
+    ]
+
+
+def test_cache_hits(tmp_path):
+    cache_path = tmp_path / "cache.sqlite"
+    results, call_count = search([Path(".")], ".//FunctionDef", cache_path)
+    assert len(match_summary(results)) > 0
+
+    cached_results, cached_call_count = search([Path(".")], ".//FunctionDef", cache_path)
+    assert match_summary(cached_results) == match_summary(results)
+    # Only files with matches need parsing, to construct Match objects
+    assert cached_call_count == len({r.path for r in results if isinstance(r, Match)})
+    assert cached_call_count < call_count
+
+
+def test_cache_no_matches_needs_no_parsing(tmp_path):
+    cache_path = tmp_path / "cache.sqlite"
+    search([Path(".")], './/Name[@id="does_not_exist"]', cache_path)
+    results, call_count = search([Path(".")], './/Name[@id="does_not_exist"]', cache_path)
+    assert match_summary(results) == []
+    assert call_count == 0
+
+
+def test_cache_keyed_on_expression(tmp_path):
+    cache_path = tmp_path / "cache.sqlite"
+    search([Path("misc.py")], ".//FunctionDef", cache_path)
+    _, call_count = search([Path("misc.py")], ".//ClassDef", cache_path)
+    assert call_count == 1
+
+
+def test_cache_shared_between_identical_files(tmp_path):
+    cache_path = tmp_path / "cache.sqlite"
+    # misc.py and subdir/subdir_file.py are identical
+    _, call_count = search([Path("misc.py"), Path("subdir/subdir_file.py")], ".//ClassDef", cache_path)
+    assert call_count == 1
+
+
+def test_cache_keyed_on_contents(tmp_path):
+    cache_path = tmp_path / "cache.sqlite"
+    source_file = tmp_path / "example.py"
+    source_file.write_text("def foo():\n    pass\n")
+    search([source_file], ".//FunctionDef", cache_path)
+    source_file.write_text("x = 1\n\n\ndef foo():\n    pass\n")
+    results, call_count = search([source_file], ".//FunctionDef", cache_path)
+    assert call_count == 1
+    assert [r.position.lineno for r in results if isinstance(r, Match)] == [4]
+
+
+def test_cache_not_used_for_non_element_results(tmp_path):
+    cache_path = tmp_path / "cache.sqlite"
+    search([Path("misc.py")], "count(.//FunctionDef)", cache_path)
+    _, call_count = search([Path("misc.py")], "count(.//FunctionDef)", cache_path)
+    assert call_count == 1
+
+
+def test_cache_not_used_with_custom_processor(tmp_path):
+    cache_path = tmp_path / "cache.sqlite"
+    source_file = tmp_path / "example.py"
+    source_file.write_text("x = 1\n")
+
+    # Searches contents that are not on disk, so the cache can't be keyed on what is on disk
+    def processor(path: Path) -> ProcessedPython | ReadError:
+        return process_python_source(filename=path, contents=b"def foo():\n    pass\n", auto_dedent=False)
+
+    with ResultCache(cache_path) as result_cache:
+        results = list(
+            search_python_files(
+                [source_file], ".//FunctionDef", result_cache=result_cache, python_file_processor=processor
+            )
+        )
+    assert len(match_summary(results)) == 1
+    results, _ = search([source_file], ".//FunctionDef", cache_path)
+    assert match_summary(results) == []
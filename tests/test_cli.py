@@ -187,6 +187,20 @@ for idx, x in enumerate(items):
     )
 
 
+def test_scope(capsys):
+    assert_output(capsys, ["--scope", ".//Name", "misc.py"], contains="misc.py:3:12:a_function:    return an_arg")
+    assert_output(
+        capsys,
+        ["--context=function", "--heading", './/Name[@id="an_arg"]', "misc.py"],
+        contains="def a_function(an_arg):\n    return an_arg\n",
+    )
+    assert_output(
+        capsys,
+        ["--scope", "--heading", ".//Name", "misc.py"],
+        error_equals="ERROR: --scope cannot be used with --heading.\n",
+    )
+
+
 def test_css_select_error(capsys):
     assert_output(
         capsys,
@@ -240,3 +254,9 @@ def test_pyastdump_remove_indent():
     result = subprocess.run("echo '    x = 1\n    y = 2' | pyastdump -", shell=True, capture_output=True)
     assert result.returncode == 0
     assert b"indent" not in result.stderr
+
+
+def test_max_columns_negative(capsys):
+    with pytest.raises(SystemExit):
+        main(["--max-columns", "-1", ".//Name"])
+    assert "--max-columns: must be 0 or more, not -1" in capsys.readouterr().err
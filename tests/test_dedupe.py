@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+from pathlib import Path
+from unittest.mock import patch
+
+from pyastgrep.api import Match, search_python_files
+from pyastgrep.files import ProcessedPython, ReadError, get_files_to_search, process_python_source
+
+from tests.utils import chdir
+
+CONTENTS = b"def func():\n    pass\n"
+
+
+def make_tree(root: Path) -> None:
+    (root / "src").mkdir()
+    (root / "vendor").mkdir()
+    (root / "src" / "mod.py").write_bytes(CONTENTS)
+    (root / "vendor" / "mod.py").write_bytes(CONTENTS)
+    (root / "src" / "other.py").write_bytes(b"x = 1\n")
+
+
+def test_deduplicate(tmp_path):
+    make_tree(tmp_path)
+    with chdir(tmp_path):
+        with patch("pyastgrep.search.process_python_source", wraps=process_python_source) as process:
+            results = list(search_python_files([Path(".")], ".//FunctionDef", deduplicate=True))
+    assert process.call_count == 2
+    matches = [r for r in results if isinstance(r, Match)]
+    assert sorted(str(m.path) for m in matches) == ["src/mod.py", "vendor/mod.py"]
+    assert all(m.position.lineno == 1 for m in matches)
+
+
+def test_deduplicate_not_done_with_custom_processor(tmp_path: Path) -> None:
+    make_tree(tmp_path)
+
+    # A processor that doesn't use the contents on disk, so identical files can have different results
+    def processor(path: Path) -> ProcessedPython | ReadError:
+        contents = CONTENTS.replace(b"func", path.parent.name.encode("ascii"))
+        return process_python_source(filename=path, contents=contents, auto_dedent=False)
+
+    with chdir(tmp_path):
+        results = list(
+            search_python_files([Path(".")], ".//FunctionDef", deduplicate=True, python_file_processor=processor)
+        )
+    lines = sorted(r.matching_line for r in results if isinstance(r, Match))
+    assert lines == ["def src():", "def src():", "def vendor():"]
+
+
+def test_overlapping_paths_searched_once(tmp_path):
+    make_tree(tmp_path)
+    with chdir(tmp_path):
+        files = [
+            path for path in get_files_to_search([Path("."), Path("src"), Path("src/mod.py")]) if isinstance(path, Path)
+        ]
+    assert sorted(files) == [Path("src/mod.py"), Path("src/other.py"), Path("vendor/mod.py")]
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import subprocess
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from pyastgrep.api import Match, ReadError
+from pyastgrep.cli import main
+from pyastgrep.files import process_python_source
+from pyastgrep.git import (
+    GitError,
+    get_changed_files,
+    get_changed_lines,
+    get_revisions_in_range,
+    restrict_to_paths,
+    search_git_revisions,
+)
+
+from tests.utils import chdir
+
+
+def git(repo: Path, *args: str) -> None:
+    subprocess.run(
+        ["git", "-c", "user.name=Test", "-c", "user.email=test@example.com", *args],
+        cwd=repo,
+        check=True,
+        capture_output=True,
+    )
+
+
+def run_main(capsys: pytest.CaptureFixture[str], repo: Path, args: list[str]) -> str:
+    with chdir(repo):
+        main(args)
+    return capsys.readouterr().out
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Path:
+    git(tmp_path, "init", "-q", "-b", "main")
+    (tmp_path / "unchanged.py").write_text("def unchanged():\n    pass\n")
+    (tmp_path / "modified.py").write_text("def first():\n    pass\n")
+    (tmp_path / "subdir").mkdir()
+    (tmp_path / "subdir" / "deleted.py").write_text("x = 1\n")
+    git(tmp_path, "add", ".")
+    git(tmp_path, "commit", "-q", "-m", "Initial")
+    git(tmp_path, "checkout", "-q", "-b", "feature")
+    (tmp_path / "modified.py").write_text("def first():\n    pass\n\n\ndef second():\n    pass\n")
+    (tmp_path / "subdir" / "deleted.py").unlink()
+    (tmp_path / "subdir" / "added.py").write_text("def added():\n    pass\n")
+    (tmp_path / "notes.txt").write_text("def not_python():\n")
+    git(tmp_path, "add", ".")
+    git(tmp_path, "commit", "-q", "-m", "Changes")
+    return tmp_path
+
+
+def test_get_changed_files(repo):
+    with chdir(repo):
+        changed = get_changed_files(since="main")
+    assert sorted(f.path for f in changed) == [Path("modified.py"), Path("subdir/added.py")]
+
+
+def test_get_changed_files_relative_to_cwd(repo):
+    with chdir(repo / "subdir"):
+        changed = get_changed_files(since="main")
+    assert [f.path for f in changed] == [Path("added.py")]
+
+
+def test_restrict_to_paths(repo):
+    with chdir(repo):
+        changed = get_changed_files(since="main")
+    assert [f.path for f in restrict_to_paths(changed, [Path("subdir")])] == [Path("subdir/added.py")]
+    assert len(restrict_to_paths(changed, [Path(".")])) == 2
+
+
+def test_changed_since_search(capsys, repo):
+    output = run_main(capsys, repo, ["--changed-since", "main", ".//FunctionDef"])
+    assert output == "modified.py:1:1:def first():\nmodified.py:5:1:def second():\nsubdir/added.py:1:1:def added():\n"
+
+
+def test_changed_lines(capsys, repo):
+    output = run_main(capsys, repo, ["--changed-since", "main", "--changed-lines", ".//FunctionDef"])
+    assert output == "modified.py:5:1:def second():\nsubdir/added.py:1:1:def added():\n"
+
+
+def test_staged_uses_index_contents(capsys, repo):
+    (repo / "unchanged.py").write_text("def staged():\n    pass\n")
+    git(repo, "add", "unchanged.py")
+    # Working tree changes that are not staged should not be searched
+    (repo / "unchanged.py").write_text("def not_staged():\n    pass\n")
+    output = run_main(capsys, repo, ["--staged", ".//FunctionDef"])
+    assert output == "unchanged.py:1:1:def staged():\n"
+
+
+def test_staged_deleted_from_working_tree(capsys, repo):
+    (repo / "new.py").write_text("def staged():\n    pass\n")
+    git(repo, "add", "new.py")
+    (repo / "new.py").unlink()
+    with chdir(repo):
+        assert main(["--staged", ".//FunctionDef"]) == 0
+    assert capsys.readouterr() == ("new.py:1:1:def staged():\n", "")
+
+
+def test_staged_dedupe_uses_index_contents(capsys, repo):
+    (repo / "a.py").write_text("def a_staged():\n    pass\n")
+    (repo / "b.py").write_text("def b_staged():\n    pass\n")
+    git(repo, "add", "a.py", "b.py")
+    # Identical in the working tree, but not in the index
+    (repo / "a.py").write_text("x = 1\n")
+    (repo / "b.py").write_text("x = 1\n")
+    output = run_main(capsys, repo, ["--staged", "--dedupe", ".//FunctionDef"])
+    assert output == "a.py:1:1:def a_staged():\nb.py:1:1:def b_staged():\n"
+
+
+def test_staged_with_cache(capsys, repo):
+    (repo / "unchanged.py").write_text("def staged():\n    pass\n")
+    git(repo, "add", "unchanged.py")
+    (repo / "unchanged.py").write_text("def not_staged():\n    pass\n")
+    output = run_main(capsys, repo, ["--staged", "--cache", "cache.db", ".//FunctionDef"])
+    assert output == "unchanged.py:1:1:def staged():\n"
+    # Results for the staged contents must not be used for the working tree
+    output = run_main(capsys, repo, ["--cache", "cache.db", ".//FunctionDef", "unchanged.py"])
+    assert output == "unchanged.py:1:1:def not_staged():\n"
+    # But are used when searching the staged contents again
+    with patch("pyastgrep.git.process_python_source", wraps=process_python_source) as process:
+        output = run_main(capsys, repo, ["--staged", "--cache", "cache.db", './/FunctionDef[@name="other"]'])
+        assert output == ""
+        output = run_main(capsys, repo, ["--staged", "--cache", "cache.db", './/FunctionDef[@name="other"]'])
+    assert output == ""
+    assert process.call_count == 1
+
+
+def test_staged_changed_lines(repo):
+    (repo / "modified.py").write_text(
+        "def first():\n    pass\n\n\ndef second():\n    pass\n\n\ndef third():\n    pass\n"
+    )
+    git(repo, "add", "modified.py")
+    with chdir(repo):
+        changed_lines = get_changed_lines(staged=True)
+    assert changed_lines.ranges == {Path("modified.py"): [(7, 11)]}
+    assert changed_lines.contains(Path("modified.py"), 9)
+    assert not changed_lines.contains(Path("modified.py"), 5)
+
+
+def test_changed_lines_path_with_space(capsys, repo):
+    (repo / "sp ace").mkdir()
+    (repo / "sp ace" / "m.py").write_text("def spaced():\n    pass\n")
+    git(repo, "add", ".")
+    output = run_main(capsys, repo, ["--staged", "--changed-lines", ".//FunctionDef"])
+    assert output == "sp ace/m.py:1:1:def spaced():\n"
+
+
+def test_bad_revision(repo):
+    with chdir(repo):
+        with pytest.raises(GitError):
+            get_changed_files(since="no-such-branch")
+
+
+def test_rev(capsys, repo):
+    # Working tree changes should not affect searching a revision
+    (repo / "unchanged.py").write_text("def working_tree():\n    pass\n")
+    output = run_main(capsys, repo, ["--rev", "main", ".//FunctionDef"])
+    assert output == "main:modified.py:1:1:def first():\nmain:unchanged.py:1:1:def unchanged():\n"
+
+
+def test_rev_with_path(capsys, repo):
+    output = run_main(capsys, repo, ["--rev", "feature", ".//FunctionDef", "subdir"])
+    assert output == "feature:subdir/added.py:1:1:def added():\n"
+
+
+def test_rev_range(capsys, repo):
+    (repo / "modified.py").write_text("def first():\n    pass\n")
+    git(repo, "commit", "-q", "-a", "-m", "Revert")
+    with chdir(repo):
+        revisions = get_revisions_in_range("main..feature")
+    assert len(revisions) == 2
+    output = run_main(capsys, repo, ["--rev-range", "main..feature", './/FunctionDef[@name="second"]'])
+    assert output == f"{revisions[0]}:modified.py:5:1:def second():\n"
+
+
+def test_search_git_revisions_parses_blobs_once(repo):
+    with chdir(repo):
+        with patch("pyastgrep.git.process_python_source", wraps=process_python_source) as process:
+            results = list(search_git_revisions(["main", "feature"], ".//FunctionDef[@name='unchanged']"))
+    matches = [r for r in results if isinstance(r, Match)]
+    assert [str(m.path) for m in matches] == ["main:unchanged.py", "feature:unchanged.py"]
+    # unchanged.py is shared, subdir/deleted.py, modified.py (2 versions), subdir/added.py
+    assert process.call_count == 5
+
+
+def test_search_git_revisions_parses_bad_blobs_once(repo):
+    (repo / "bad.py").write_text("def (\n")
+    git(repo, "add", "bad.py")
+    git(repo, "commit", "-q", "-m", "Bad")
+    git(repo, "tag", "with-bad")
+    (repo / "modified.py").write_text("def third():\n    pass\n")
+    git(repo, "commit", "-q", "-a", "-m", "More")
+    with chdir(repo):
+        with patch("pyastgrep.git.process_python_source", wraps=process_python_source) as process:
+            results = list(search_git_revisions(["with-bad", "HEAD"], ".//FunctionDef", paths=[Path("bad.py")]))
+    errors = [r for r in results if isinstance(r, ReadError)]
+    assert [e.path for e in errors] == ["with-bad:bad.py", "HEAD:bad.py"]
+    # The error message refers to the right path
+    assert "HEAD:bad.py" in str(errors[1].exception)
+    assert process.call_count == 1
+
+
+@pytest.mark.parametrize("option", [["--cache", "cache.db"], ["--index", "index.db"], ["--search-archives"]])
+def test_rev_unsupported_options(capsys, repo, option):
+    with chdir(repo):
+        assert main(["--rev", "main", *option, ".//FunctionDef"]) == 2
+    assert "cannot be used with --cache, --index or --search-archives" in capsys.readouterr().err
+    assert not (repo / "cache.db").exists()
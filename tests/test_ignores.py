@@ -146,6 +146,40 @@ def test_DirectoryPathSpec():
     # Path in subdir should match absolute rule from same dir
     assert dps_subdir.match_file(Path("subdir/bar"))
 
+    # Directory patterns only match directories
+    dps_dirs = DirectoryPathSpec(Path("."), GitIgnoreSpec.from_lines(["build/"]))
+    assert dps_dirs.match_file(Path("build"), is_dir=True)
+    assert not dps_dirs.match_file(Path("build"))
+
+
+def test_directory_patterns(tmp_path):
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".gitignore").write_text("build/\n!build/keep.py\n")
+    (tmp_path / "build").mkdir()
+    (tmp_path / "build" / "output.py").write_text("x = 1\n")
+    (tmp_path / "build" / "keep.py").write_text("x = 1\n")
+    (tmp_path / "module.py").write_text("x = 1\n")
+    with chdir(tmp_path):
+        files = list(get_files_to_search([Path(".")], respect_global_ignores=False))
+    # As with git, files can't be re-included if their directory is ignored,
+    # because ignored directories are not walked.
+    assert files == [Path("module.py")]
+
+
+def test_rgignore_files_read_once(tmp_path):
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".rgignore").write_text("ignored.py\n")
+    subdir = tmp_path / "subdir" / "subsubdir"
+    subdir.mkdir(parents=True)
+    (subdir / "ignored.py").write_text("x = 1\n")
+    (subdir / "module.py").write_text("x = 1\n")
+    with patch("pyastgrep.ignores.pathspec_for_rgignore", wraps=pyastgrep.ignores.pathspec_for_rgignore) as mock:
+        with chdir(tmp_path):
+            files = list(get_files_to_search([Path(".")], respect_global_ignores=False))
+    # The parent .rgignore applies to subdirectories, but is read only once
+    assert files == [Path("subdir/subsubdir/module.py")]
+    assert mock.call_count == 1
+
 
 def test_no_global_git_ignores():
     # Check what happens if return of get_global_gitignore is a missing file
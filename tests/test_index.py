@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from pyastgrep.api import Match, search_python_files
+from pyastgrep.cli import main
+from pyastgrep.files import ReadError
+from pyastgrep.index import SearchIndex, build_index, required_facts
+from pyastgrep.search import search_python_file
+
+from tests.utils import chdir
+
+
+@pytest.mark.parametrize(
+    "expression,facts",
+    [
+        (".//Name", {"Name"}),
+        ('.//Name[@id="foo"]', {"Name", "Name/@id=foo"}),
+        ("//FunctionDef[@name='x' and .//Return]", {"FunctionDef", "FunctionDef/@name=x", "Return"}),
+        ('.//Call[./func/Name[@id="print"]]', {"Call", "func", "Name", "Name/@id=print"}),
+        ('.//Name[@id="a" or @id="b"]', {"Name"}),
+        ('.//Name[not(@id="x")]', {"Name"}),
+        ('.//Name[re:match("x", @id)]', {"Name"}),
+        (".//Name | .//Call", set()),
+        (".//Name or .//Call", set()),
+        ('.//Name[@id="x"] and .//Call', set()),
+        (".//Name div 2", set()),
+        ("count(//Name)", set()),
+        ('.//*[@id="x"]', set()),
+        ("descendant-or-self::Name[@id = 'x']", {"Name", "Name/@id=x"}),
+    ],
+)
+def test_required_facts(expression, facts):
+    assert required_facts(expression) == facts
+
+
+@pytest.fixture
+def project(tmp_path: Path) -> Path:
+    (tmp_path / "uses_print.py").write_text("print(1)\n")
+    (tmp_path / "no_print.py").write_text("x = 1\n")
+    (tmp_path / "broken.py").write_text("print(\n")
+    return tmp_path
+
+
+def test_index_skips_files(project):
+    index_path = project / "index.sqlite"
+    with chdir(project):
+        assert build_index(index_path, [Path(".")]) == (3, 3)
+    with patch("pyastgrep.search.search_python_file", wraps=search_python_file) as searcher:
+        with chdir(project), SearchIndex(index_path) as index:
+            results = list(search_python_files([Path(".")], './/Name[@id="print"]', index=index))
+    # broken.py is searched because it failed to parse, so we report the error.
+    assert sorted(str(call.args[0]) for call in searcher.call_args_list) == ["broken.py", "uses_print.py"]
+    assert [str(r.path) for r in results if isinstance(r, Match)] == ["uses_print.py"]
+    assert [r.path for r in results if isinstance(r, ReadError)] == ["broken.py"]
+
+
+def test_index_changed_files_searched(project):
+    index_path = project / "index.sqlite"
+    with chdir(project):
+        build_index(index_path, [Path(".")])
+        (project / "no_print.py").write_text("print(2)\n")
+        (project / "new.py").write_text("print(3)\n")
+        with SearchIndex(index_path) as index:
+            results = list(search_python_files([Path(".")], './/Name[@id="print"]', index=index))
+    assert sorted(str(r.path) for r in results if isinstance(r, Match)) == ["new.py", "no_print.py", "uses_print.py"]
+
+
+def test_index_update_is_incremental(project):
+    index_path = project / "index.sqlite"
+    with chdir(project):
+        build_index(index_path, [Path(".")])
+        (project / "no_print.py").write_text("print(2)\n")
+        # Touched, but contents unchanged:
+        os.utime(project / "uses_print.py", ns=(0, 0))
+        (project / "broken.py").unlink()
+        assert build_index(index_path, [Path(".")], rebuild=False) == (2, 1)
+        with SearchIndex(index_path) as index:
+            assert sorted(Path(p).name for p in index.load_files()) == ["no_print.py", "uses_print.py"]
+            file_filter = index.file_filter(['.//Name[@id="print"]'])
+            assert file_filter is not None
+            assert file_filter(Path("no_print.py"))
+
+
+def test_index_update_only_removes_files_under_roots(project):
+    index_path = project / "index.sqlite"
+    (project / "subdir").mkdir()
+    (project / "subdir" / "sub.py").write_text("print(4)\n")
+    with chdir(project):
+        build_index(index_path, [Path(".")])
+        (project / "subdir" / "sub.py").unlink()
+        assert build_index(index_path, [Path("subdir")]) == (0, 0)
+        with SearchIndex(index_path) as index:
+            indexed = sorted(Path(p).name for p in index.load_files())
+    assert indexed == ["broken.py", "no_print.py", "uses_print.py"]
+
+
+def test_index_cli(capsys, project):
+    with chdir(project):
+        assert main(["index", "build", "--index", "idx.sqlite"]) == 0
+        capsys.readouterr()
+        main(["--index", "idx.sqlite", './/Name[@id="print"]', "uses_print.py", "no_print.py"])
+    assert capsys.readouterr().out == "uses_print.py:1:1:print(1)\n"
+
+
+def test_index_cli_missing_index(capsys, project):
+    with chdir(project):
+        assert main(["--index", "missing.sqlite", ".//Name"]) == 2
+    assert "does not exist" in capsys.readouterr().err
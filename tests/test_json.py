@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import io
+import json
+from pathlib import Path
+from typing import Any
+
+from pyastgrep.api import search_python_files
+from pyastgrep.cli import main
+from pyastgrep.printer import print_json_results
+from pyastgrep.search import Expressions
+
+from tests.utils import chdir
+
+DIR = Path(__file__).parent / "examples" / "test_cli"
+
+
+def json_records(paths: list[str], expression: Expressions, source: bool = False) -> tuple[list[dict[str, Any]], str]:
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    with chdir(DIR):
+        print_json_results(
+            search_python_files([Path(p) for p in paths], expression), stdout=stdout, stderr=stderr, source=source
+        )
+    return [json.loads(line) for line in stdout.getvalue().splitlines()], stderr.getvalue()
+
+
+def test_json_records():
+    records, _ = json_records(["misc.py"], ".//arg")
+    assert [record["type"] for record in records] == ["begin", "match", "end", "summary"]
+    assert records[0]["data"] == {"path": "misc.py"}
+    assert records[1]["data"] == {
+        "path": "misc.py",
+        "line": 2,
+        "column": 16,
+        "end_line": 2,
+        "end_column": 22,
+        "node_type": "arg",
+        "rule_id": None,
+    }
+    assert records[2]["data"] == {"path": "misc.py", "matches": 1}
+    summary = records[3]["data"]
+    assert summary["files_searched"] == 1
+    assert summary["files_with_matches"] == 1
+    assert summary["matches"] == 1
+    assert summary["errors"] == 0
+
+
+def test_json_multiline_source_and_rule_id():
+    records, _ = json_records(["misc.py"], {"functions": ".//FunctionDef"}, source=True)
+    match = records[1]["data"]
+    assert match["rule_id"] == "functions"
+    assert match["end_line"] == 3
+    assert match["source"] == "def a_function(an_arg):\n    return an_arg"
+
+
+def test_json_no_match_files():
+    records, _ = json_records(["misc.py", "other.py"], './/arg[@arg="another_arg"]')
+    assert [(record["type"], record["data"].get("path")) for record in records] == [
+        ("begin", "other.py"),
+        ("match", "other.py"),
+        ("end", "other.py"),
+        ("summary", None),
+    ]
+    assert records[-1]["data"]["files_searched"] == 2
+
+
+def test_json_errors_on_stderr():
+    records, stderr = json_records(["misc.py", "missing.py"], ".//arg")
+    assert stderr == "missing.py: No such file or directory\n"
+    assert records[-1]["data"]["errors"] == 1
+
+
+def test_json_cli(capsys):
+    with chdir(DIR):
+        assert main(["--json", ".//arg", "misc.py"]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert "source" not in json.loads(lines[1])["data"]
+
+
+def test_json_cli_source(capsys):
+    with chdir(DIR):
+        assert main(["--json", "--json-source", ".//arg", "misc.py"]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert json.loads(lines[1])["data"]["source"] == "an_arg"
+
+
+def test_json_cli_incompatible_options(capsys):
+    with chdir(DIR):
+        assert main(["--json", "-C", "1", ".//arg", "misc.py"]) == 2
+    assert "--json cannot be used" in capsys.readouterr().err
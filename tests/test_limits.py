@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import time
+from pathlib import Path
+from typing import Any, Iterator
+from unittest.mock import patch
+
+import pytest
+from lxml import etree
+from pyastgrep import search as search_module
+from pyastgrep import stats
+from pyastgrep.api import Limits, Match, ReadError, SkippedFile, search_python_files
+from pyastgrep.cache import ResultCache
+from pyastgrep.cli import filesize_parameter, main
+from pyastgrep.limits import LimitExceeded, check_deadline, with_deadline
+from pyastgrep.xml import lxml_query
+
+from tests.utils import chdir
+
+
+def make_files(directory: Path) -> None:
+    (directory / "small.py").write_text("x = 1\n")
+    (directory / "large.py").write_text("".join(f"x{i} = {i}\n" for i in range(100)))
+
+
+def search(directory: Path, limits: Limits) -> list[Match | ReadError]:
+    with chdir(directory):
+        return [
+            result
+            for result in search_python_files([Path(".")], ".//Name", limits=limits)
+            if isinstance(result, (Match, ReadError))
+        ]
+
+
+def test_max_filesize(tmp_path):
+    make_files(tmp_path)
+    results = search(tmp_path, Limits(max_filesize=100))
+    assert [str(result.path) for result in results if isinstance(result, Match)] == ["small.py"]
+    [skipped] = [result for result in results if isinstance(result, SkippedFile)]
+    assert skipped.path == "large.py"
+    assert str(skipped.exception) == "file size of 880 bytes exceeds limit of 100 bytes"
+
+
+def test_max_nodes(tmp_path):
+    make_files(tmp_path)
+    results = search(tmp_path, Limits(max_nodes=10))
+    assert [str(result.path) for result in results if isinstance(result, Match)] == ["small.py"]
+    [skipped] = [result for result in results if isinstance(result, SkippedFile)]
+    assert skipped.path == "large.py"
+    assert str(skipped.exception) == "more than 10 AST nodes"
+
+
+@pytest.mark.parametrize("options", ["deduplicate", "result_cache"])
+def test_limits_with_caches(tmp_path, options):
+    make_files(tmp_path)
+    with chdir(tmp_path), ResultCache(tmp_path / "cache.sqlite") as result_cache:
+
+        def search_errors(limits: Limits) -> list[ReadError]:
+            return [
+                result
+                for result in search_python_files(
+                    [Path("small.py"), Path("large.py")],
+                    './/Name[@id="missing"]',
+                    deduplicate=options == "deduplicate",
+                    result_cache=result_cache if options == "result_cache" else None,
+                    limits=limits,
+                )
+                if isinstance(result, ReadError)
+            ]
+
+        # Store empty results in the cache
+        assert search_errors(Limits()) == []
+
+        with stats.count_operations() as operations:
+            [skipped] = search_errors(Limits(max_filesize=100))
+        assert isinstance(skipped, SkippedFile)
+        assert str(skipped.exception) == "file size of 880 bytes exceeds limit of 100 bytes"
+        # The large file is not read at all
+        assert operations["bytes_read", Path("large.py")] == 0
+
+        [skipped] = search_errors(Limits(max_nodes=10))
+        assert isinstance(skipped, SkippedFile)
+        assert str(skipped.exception) == "more than 10 AST nodes"
+
+
+def test_file_timeout(tmp_path):
+    make_files(tmp_path)
+    results = search(tmp_path, Limits(file_timeout=0))
+    assert {str(result.path) for result in results} == {"small.py", "large.py"}
+    for result in results:
+        assert isinstance(result, SkippedFile)
+        assert str(result.exception) == "file timeout of 0s exceeded"
+
+
+@pytest.mark.parametrize("options", ["", "deduplicate", "result_cache", "rules"])
+def test_file_timeout_keeps_earlier_matches(tmp_path, options):
+    make_files(tmp_path)
+    make_match = search_module.make_match
+
+    def slow_make_match(*args: Any, **kwargs: Any) -> Match | None:
+        time.sleep(0.01)
+        return make_match(*args, **kwargs)
+
+    with chdir(tmp_path), ResultCache(tmp_path / "cache.sqlite") as result_cache:
+        with patch("pyastgrep.search.make_match", new=slow_make_match):
+            results = list(
+                search_python_files(
+                    [Path("large.py")],
+                    {"names": ".//Name", "constants": ".//Constant"} if options == "rules" else ".//Name",
+                    deduplicate=options == "deduplicate",
+                    result_cache=result_cache if options == "result_cache" else None,
+                    limits=Limits(file_timeout=0.1),
+                )
+            )
+    *matches, skipped, _ = results
+    assert 0 < len(matches) < 100
+    assert all(isinstance(match, Match) and str(match.path) == "large.py" for match in matches)
+    assert isinstance(skipped, SkippedFile)
+    assert str(skipped.exception) == "file timeout of 0.1s exceeded"
+
+
+def test_time_limit(tmp_path):
+    make_files(tmp_path)
+    results = search(tmp_path, Limits(time_limit=0))
+    # The search stops at the first file
+    [skipped] = results
+    assert isinstance(skipped, SkippedFile)
+    assert str(skipped.exception) == "time limit of 0s reached, search stopped"
+
+
+def test_no_limits(tmp_path):
+    make_files(tmp_path)
+    results = search(tmp_path, Limits())
+    assert len(results) == 101
+    assert all(isinstance(result, Match) for result in results)
+
+
+def test_deadline_partial_results():
+    def produce() -> Iterator[int]:
+        yield 1
+        time.sleep(0.02)
+        check_deadline()
+        yield 2
+
+    results = []
+    with pytest.raises(LimitExceeded):
+        for item in with_deadline(produce(), time.monotonic() + 0.01, "too slow"):
+            results.append(item)
+    assert results == [1]
+    # The deadline only applies inside the wrapped iterator
+    check_deadline()
+
+
+def test_deadline_regex_functions():
+    root = etree.fromstring('<Module><Name id="foo"/></Module>')
+
+    def produce() -> Iterator[object]:
+        yield lxml_query(root, './/Name[re:search("fo", @id)]')
+
+    with pytest.raises(LimitExceeded, match="too slow"):
+        list(with_deadline(produce(), time.monotonic() - 1, "too slow"))
+
+
+def test_binary_file(tmp_path):
+    (tmp_path / "binary.py").write_bytes(b"x = 1\n\0\xff\xfe")
+    results = search(tmp_path, Limits())
+    [error] = results
+    assert isinstance(error, ReadError) and not isinstance(error, SkippedFile)
+    assert str(error.exception) == "source code string cannot contain null bytes"
+
+
+def test_filesize_parameter():
+    assert filesize_parameter("100") == 100
+    assert filesize_parameter("2k") == 2048
+    assert filesize_parameter("3M") == 3 * 1024 * 1024
+    assert filesize_parameter("1G") == 1024**3
+    with pytest.raises(ValueError):
+        filesize_parameter("1T")
+
+
+def test_cli_skipped_files(tmp_path, capsys):
+    make_files(tmp_path)
+    with chdir(tmp_path):
+        retval = main(["--max-filesize", "1K", "--max-nodes", "10", ".//Name", "small.py", "large.py"])
+    output = capsys.readouterr()
+    assert output.out == "small.py:1:1:x = 1\n"
+    assert output.err == "large.py: skipped: more than 10 AST nodes\n"
+    # Skipped files are not errors
+    assert retval == 0
+
+
+def test_cli_json_skipped_files(tmp_path, capsys):
+    make_files(tmp_path)
+    with chdir(tmp_path):
+        main(["--json", "--max-nodes", "10", ".//Name", "large.py"])
+    output = capsys.readouterr()
+    assert output.err == "large.py: skipped: more than 10 AST nodes\n"
+    assert '"errors":0,"skipped":1' in output.out
@@ -0,0 +1,132 @@
+"""
+Tests that work is not repeated, using operation counts rather than timings,
+so that accidental quadratic behaviour is caught deterministically.
+"""
+from __future__ import annotations
+
+from collections import Counter
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from pyastgrep import stats
+from pyastgrep.api import Match, search_python_files
+from pyastgrep.files import get_files_to_search
+from pyastgrep.xml import compile_xpath
+from pyastgrep.xpath2 import compile_xpath2
+
+from tests.utils import chdir
+
+DEPTH = 6
+
+
+def make_tree(directory: Path) -> None:
+    # A deep tree, with ignore files at every level, and ignored directories
+    # that shouldn't be walked.
+    (directory / ".git").mkdir()
+    (directory / ".git" / "config.py").write_text("x = 1\n")
+    path = directory
+    for level in range(DEPTH):
+        (path / ".gitignore").write_text("ignored*.py\n")
+        (path / ".rgignore").write_text("build/\n")
+        (path / "module.py").write_text("def foo(x):\n    return bar(x)\n")
+        (path / "ignored.py").write_text("x = 1\n")
+        (path / "build").mkdir()
+        (path / "build" / "output.py").write_text("x = 1\n")
+        path = path / f"subdir{level}"
+        path.mkdir()
+
+
+@pytest.fixture(autouse=True)
+def no_global_gitignore():
+    with patch("pyastgrep.ignores.get_global_gitignore", lambda: None):
+        yield
+
+
+def operation_counts(operations: Counter[tuple[str, object]], counter: str) -> dict[object, int]:
+    return {subject: count for (name, subject), count in operations.items() if name == counter}
+
+
+def test_directories_listed_once(tmp_path):
+    make_tree(tmp_path)
+    with stats.count_operations() as operations, chdir(tmp_path):
+        files = list(get_files_to_search([Path(".")]))
+    assert len(files) == DEPTH
+    listed = operation_counts(operations, "dirs_visited")
+    # Each level plus the final empty directory, but not `build` or `.git`
+    assert len(listed) == DEPTH + 1
+    assert set(listed.values()) == {1}
+
+
+def test_ignore_files_read_once(tmp_path):
+    make_tree(tmp_path)
+    with stats.count_operations() as operations, chdir(tmp_path):
+        list(get_files_to_search([Path(".")]))
+    read = operation_counts(operations, "ignore_files_read")
+    assert len(read) == DEPTH * 2
+    assert set(read.values()) == {1}
+
+
+def test_stat_calls_per_directory(tmp_path):
+    make_tree(tmp_path)
+    with stats.count_operations() as operations, chdir(tmp_path):
+        list(get_files_to_search([Path(".")]))
+    stat_calls = operation_counts(operations, "stat_calls")
+    # Checks for `.gitignore`, `.rgignore` and `.git` in the starting
+    # directory, and only the ignore files in subdirectories, however deep.
+    assert stat_calls[tmp_path] == 4
+    assert max(count for subject, count in stat_calls.items() if subject != tmp_path) == 2
+
+
+def test_files_parsed_once(tmp_path):
+    make_tree(tmp_path)
+    with stats.count_operations() as operations, chdir(tmp_path):
+        results = list(search_python_files([Path(".")], [".//Name", ".//Call", ".//FunctionDef"]))
+    assert len([result for result in results if isinstance(result, Match)]) == DEPTH * 4
+    for counter in ["files_parsed", "files_converted", "bytes_read"]:
+        counts = operation_counts(operations, counter)
+        assert len(counts) == DEPTH
+    assert set(operation_counts(operations, "files_parsed").values()) == {1}
+    assert set(operation_counts(operations, "files_converted").values()) == {1}
+
+
+def test_expressions_compiled_once(tmp_path):
+    make_tree(tmp_path)
+    expressions = [".//Name", './/Call[func/Name[@id="bar"]]', ".//FunctionDef[args/arguments/args/arg]"]
+    compile_xpath.cache_clear()
+    with stats.count_operations() as operations, chdir(tmp_path):
+        results = list(search_python_files([Path(".")], expressions))
+    assert len([result for result in results if isinstance(result, Match)]) == DEPTH * 4
+    compiled = operation_counts(operations, "xpath_compiled")
+    # `.//Name` is evaluated with a single traversal for all the rules, rather than compiled
+    assert './/Call[func/Name[@id="bar"]]' in compiled
+    assert set(compiled.values()) == {1}
+
+
+def test_xpath2_node_trees_built_once(tmp_path):
+    make_tree(tmp_path)
+    expressions = [
+        ".//Name",
+        './/FunctionDef[starts-with(@name, "f")]',
+        ".//ClassDef",
+        './/Call[func/Name/@id = "bar"]',
+    ]
+    compile_xpath2.cache_clear()
+    with stats.count_operations() as operations, chdir(tmp_path):
+        results = list(search_python_files([Path(".")], expressions, xpath2=True))
+        results2 = list(search_python_files([Path(".")], expressions, xpath2=True))
+    assert len([result for result in results if isinstance(result, Match)]) == DEPTH * 4
+    assert len(results2) == len(results)
+    assert set(operation_counts(operations, "xpath2_compiled").values()) == {1}
+    # One node tree per file and search for all the expressions, and none for
+    # `.//ClassDef`, since the files have no classes.
+    assert operation_counts(operations, "node_trees_built") == {None: DEPTH * 2}
+
+
+def test_disabled():
+    assert stats._operations is None
+    stats.count("files_parsed", subject="foo.py")
+    with stats.count_operations() as operations:
+        stats.count("files_parsed", subject="foo.py")
+    stats.count("files_parsed", subject="foo.py")
+    assert operations == {("files_parsed", "foo.py"): 1}
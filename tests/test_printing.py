@@ -1,11 +1,26 @@
+import ast
+import gc
 import io
+import weakref
 from pathlib import Path
 
 import pytest
-from pyastgrep.color import Colors, Styles, make_default_colorer
-from pyastgrep.context import StatementContext, StaticContext
+from pyastgrep.api import Match, search_python_files
+from pyastgrep.ast_utils import (
+    SCOPE_AST,
+    ScopeIndex,
+    StatementSpans,
+    get_ast_statement_node,
+    get_scope_index,
+    get_statement_span,
+)
+from pyastgrep.color import Colors, NullColorer, Styles, make_default_colorer
+from pyastgrep.context import ScopeContext, StatementContext, StaticContext
+from pyastgrep.files import ProcessedPython, process_python_file
+from pyastgrep.printer import DefaultContextHandler, DefaultFormatter, LineSet, print_results
+from pyastgrep.search import FileFinished
 
-from tests.utils import run_print
+from tests.utils import chdir, run_print
 
 DIR = Path(__file__).parent / "examples" / "test_printing"
 
@@ -328,3 +343,267 @@ def test_coloring_for_nodes_without_lineno():
     # Any 'load' value (lvalue) has `Load` nodes that don't have 'lineno'
     output = run_print(DIR, ".//*", ["loadvalue.py"], colorer=make_default_colorer())
     assert output.stderr == ""
+
+
+def make_long_lines(directory: Path) -> None:
+    data = ", ".join(str(i) for i in range(100))
+    (directory / "long_lines.py").write_text(f"DATA = [{data}, marker, {data}]\nx = DATA\n")
+
+
+def test_max_columns(tmp_path):
+    make_long_lines(tmp_path)
+    output = run_print(tmp_path, ".//Name", ["long_lines.py"], max_columns=100, context=StaticContext(after=1))
+    assert output.stdout == (
+        "long_lines.py:1:1:[Omitted long matching line]\n"
+        "long_lines.py:1:399:[Omitted long matching line]\n"
+        "long_lines.py:2:1:x = DATA\n"
+        "long_lines.py:2:5:x = DATA\n"
+    )
+    output = run_print(
+        tmp_path, './/Name[@id="x"]', ["long_lines.py"], max_columns=100, context=StaticContext(before=1)
+    )
+    assert output.stdout == "long_lines.py-1-[Omitted long context line]\nlong_lines.py:2:1:x = DATA\n"
+
+
+def test_max_columns_statement_heading(tmp_path):
+    make_long_lines(tmp_path)
+    output = run_print(
+        tmp_path, './/Name[@id="marker"]', ["long_lines.py"], max_columns=40, heading=True, context=StatementContext()
+    )
+    assert output.stdout == "# long_lines.py:1:\n[Omitted long context line]\n"
+    output = run_print(
+        tmp_path,
+        './/Name[@id="marker"]',
+        ["long_lines.py"],
+        max_columns=40,
+        max_columns_preview=True,
+        heading=True,
+        context=StatementContext(),
+    )
+    assert output.stdout == "# long_lines.py:1:\nDATA = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10 [...]\n"
+
+
+def test_max_columns_preview(tmp_path):
+    make_long_lines(tmp_path)
+    output = run_print(
+        tmp_path, ".//Name", ["long_lines.py"], max_columns=40, max_columns_preview=True, context=StaticContext(after=1)
+    )
+    assert output.stdout == (
+        "long_lines.py:1:1:DATA = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10 [...]\n"
+        "long_lines.py:1:399:[...], 98, 99, marker, 0, 1, 2, 3, 4, 5, 6, 7 [...]\n"
+        "long_lines.py:2:1:x = DATA\n"
+        "long_lines.py:2:5:x = DATA\n"
+    )
+
+
+def test_max_columns_preview_coloring(tmp_path):
+    make_long_lines(tmp_path)
+    output = run_print(
+        tmp_path,
+        './/Name[@id="marker"]',
+        ["long_lines.py"],
+        max_columns=40,
+        max_columns_preview=True,
+        colorer=make_default_colorer(),
+        heading=True,
+    )
+    assert output.stdout.splitlines()[1] == (
+        f"[...], 98, 99, {Colors.RED}{Styles.BOLD}marker{Styles.END}, 0, 1, 2, 3, 4, 5, 6, 7 [...]"
+    )
+
+
+class RecordingStream(io.StringIO):
+    def __init__(self, tty: bool):
+        super().__init__()
+        self.tty = tty
+        self.writes: list[str] = []
+
+    def isatty(self) -> bool:
+        return self.tty
+
+    def write(self, text: str) -> int:
+        self.writes.append(text)
+        return super().write(text)
+
+
+def search_and_print(stdout: io.StringIO) -> None:
+    with chdir(DIR):
+        print_results(search_python_files([Path("context_example.py"), Path("multiple.py")], ".//Name"), stdout=stdout)
+
+
+def test_output_buffered_per_file():
+    stdout = RecordingStream(tty=False)
+    search_and_print(stdout)
+    # One write for each file
+    assert len(stdout.writes) == 2
+    assert stdout.getvalue().count("\n") > 2
+
+
+def test_output_line_buffered_when_interactive():
+    stdout = RecordingStream(tty=True)
+    search_and_print(stdout)
+    assert len(stdout.writes) == stdout.getvalue().count("\n")
+
+
+def test_line_set():
+    lines = LineSet()
+    lines.add_range(5, 10)
+    lines.add(10)
+    lines.add_range(2, 3)
+    assert (lines.starts, lines.stops) == ([2, 5], [3, 11])
+    assert 2 in lines
+    assert 3 not in lines
+    assert 10 in lines
+    assert 11 not in lines
+    assert list(lines.gaps(0, 20)) == [(0, 2), (3, 5), (11, 20)]
+    assert list(lines.gaps(5, 11)) == []
+    lines.add_range(3, 5)
+    assert (lines.starts, lines.stops) == ([2], [11])
+
+
+def test_context_state_reset_for_each_file():
+    printed: list[str] = []
+    handler = DefaultContextHandler(
+        context_type=StaticContext(before=1, after=1),
+        line_printer=printed.append,
+        formatter=DefaultFormatter(colorer=NullColorer()),
+    )
+    with chdir(DIR):
+        for result in search_python_files([Path("context_example.py"), Path("multiple.py")], ".//Name"):
+            if isinstance(result, Match):
+                handler.handle_result(result)
+                # Only lines from the current file are tracked
+                assert result.path == handler.current_path
+            elif isinstance(result, FileFinished):
+                handler.flush()
+                assert handler.printed_lines.starts == []
+    output = "\n".join(printed)
+    assert "context_example.py" in output
+    assert "multiple.py" in output
+
+
+@pytest.mark.parametrize("filename", ["context_example.py", "statements.py", "decorators.py", "multiple.py"])
+def test_statement_spans(filename):
+    processed = process_python_file(DIR / filename)
+    assert isinstance(processed, ProcessedPython)
+    spans = StatementSpans(processed.ast).spans
+    for node in ast.walk(processed.ast):
+        if not hasattr(node, "lineno"):
+            # Module, or shared nodes like Load()
+            continue
+        statement_node = get_ast_statement_node(node)
+        assert isinstance(statement_node, (ast.stmt, ast.excepthandler))
+        first_line = min([statement_node.lineno] + [d.lineno for d in getattr(statement_node, "decorator_list", [])])
+        assert spans[node] == (first_line, statement_node.end_lineno)
+
+
+def test_statement_spans_freed_with_tree():
+    processed = process_python_file(DIR / "statements.py")
+    assert isinstance(processed, ProcessedPython)
+    other = process_python_file(DIR / "decorators.py")
+    assert isinstance(other, ProcessedPython)
+    node = next(node for node in ast.walk(processed.ast) if isinstance(node, ast.Name))
+    other_node = next(node for node in ast.walk(other.ast) if isinstance(node, ast.Name))
+    # Spans for more than one tree can be used at once
+    span = get_statement_span(node)
+    get_statement_span(other_node)
+    assert get_statement_span(node) == span
+
+    tree = weakref.ref(processed.ast)
+    del processed, node
+    gc.collect()
+    assert tree() is None
+
+
+def test_scope_column():
+    output = run_print(DIR, ".//Name", ["scopes.py"], scope=True).stdout
+    assert (
+        output
+        == """
+scopes.py:2:1:<module>:TOP = 1
+scopes.py:8:9:MyClass.method:        x = 1
+scopes.py:11:20:MyClass.method.inner:            return x
+scopes.py:13:16:MyClass.method:        return inner
+scopes.py:6:6:MyClass:    @staticmethod
+scopes.py:15:5:MyClass:    y = 2
+scopes.py:19:5:func:    z = 3
+""".lstrip()
+    )
+
+
+def test_function_context_heading():
+    # Second match is in a function already printed
+    output = run_print(DIR, './/Name[@id="x"]', ["scopes.py"], context=ScopeContext("function"), heading=True).stdout
+    assert (
+        output
+        == """
+# scopes.py:6:
+@staticmethod
+def method():
+    x = 1
+
+    def inner():
+        return x
+
+    return inner
+""".lstrip()
+    )
+
+
+def test_class_context():
+    output = run_print(DIR, './/Name[@id="y" or @id="TOP"]', ["scopes.py"], context=ScopeContext("class")).stdout
+    assert (
+        output
+        == """
+scopes.py:2:1:TOP = 1
+scopes.py-5-class MyClass:
+scopes.py-6-    @staticmethod
+scopes.py-7-    def method():
+scopes.py-8-        x = 1
+scopes.py-9-
+scopes.py-10-        def inner():
+scopes.py-11-            return x
+scopes.py-12-
+scopes.py-13-        return inner
+scopes.py-14-
+scopes.py:15:5:    y = 2
+""".lstrip()
+    )
+
+
+@pytest.mark.parametrize("filename", ["scopes.py", "decorators.py", "context_example.py"])
+def test_scope_index(filename):
+    processed = process_python_file(DIR / filename)
+    assert isinstance(processed, ProcessedPython)
+    index = ScopeIndex(processed.ast)
+    for node in ast.walk(processed.ast):
+        lineno: int | None = getattr(node, "lineno", None)
+        col_offset: int | None = getattr(node, "col_offset", None)
+        if lineno is None or col_offset is None:
+            continue
+        # Innermost scope whose span, from the `def` or `class`, contains the node
+        expected: ast.AST | None = None
+        expected_lineno = 0
+        for scope_node in ast.walk(processed.ast):
+            if isinstance(scope_node, SCOPE_AST) and (scope_node.lineno, scope_node.col_offset) <= (
+                lineno,
+                col_offset,
+            ) < (scope_node.end_lineno or 0, scope_node.end_col_offset or 0):
+                if expected is None or scope_node.lineno > expected_lineno:
+                    expected, expected_lineno = scope_node, scope_node.lineno
+        scope = index.find(lineno, col_offset)
+        assert (scope.node if scope else None) is expected
+
+
+def test_scope_index_freed_with_tree():
+    processed = process_python_file(DIR / "scopes.py")
+    assert isinstance(processed, ProcessedPython)
+    node = next(node for node in ast.walk(processed.ast) if isinstance(node, ast.Name))
+    assert get_scope_index(node) is get_scope_index(processed.ast)
+
+    tree = weakref.ref(processed.ast)
+    del processed, node
+    # Shared nodes like Load() have a `parent` in the last tree parsed
+    process_python_file(DIR / "multiple.py")
+    gc.collect()
+    assert tree() is None
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import ast
+import pstats
+from pathlib import Path
+
+from pyastgrep.api import search_python_files
+from pyastgrep.cli import main
+from pyastgrep.profiling import collect_profile
+
+from tests.utils import chdir
+
+DIR = Path(__file__).parent / "examples" / "test_cli"
+
+
+def test_collect_profile():
+    with chdir(DIR):
+        with collect_profile() as profiler:
+            list(search_python_files([Path(".")], ".//arg"))
+    profiles = {profile.path: profile for profile in profiler.slowest_files()}
+    misc = profiles["misc.py"]
+    assert misc.size == (DIR / "misc.py").stat().st_size
+    assert misc.nodes == len(list(ast.walk(ast.parse((DIR / "misc.py").read_text()))))
+    assert misc.phase_seconds["parse"] > 0
+    assert misc.phase_seconds["convert"] > 0
+    assert misc.phase_seconds["query"] > 0
+    assert "subdir/subdir_file.py" in profiles
+    # Sorted by time
+    totals = [profile.total_seconds for profile in profiler.slowest_files()]
+    assert totals == sorted(totals, reverse=True)
+    assert len(profiler.slowest_files(1)) == 1
+
+
+def test_cli_profile(capsys, tmp_path):
+    profile_file = tmp_path / "search.prof"
+    with chdir(DIR):
+        main(["--profile", str(profile_file), ".//arg", "misc.py"])
+    output = capsys.readouterr()
+    assert "misc.py:2:16:" in output.out
+    assert "Slowest files" in output.err
+    assert output.err.splitlines()[-1].endswith("  misc.py")
+    functions = {function for _, _, function in pstats.Stats(str(profile_file)).stats}  # type: ignore[attr-defined]
+    assert "ast_to_xml" in functions
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from pyastgrep.api import Match, search_python_files
+from pyastgrep.cli import main
+from pyastgrep.files import ReadError, process_python_source
+from pyastgrep.rules import RuleSet, anchor_rule, regex_query
+from pyastgrep.xml import lxml_query
+
+from tests.utils import chdir
+
+DIR = Path(__file__).parent / "examples" / "test_cli"
+
+
+def run_main(capsys, args: list[str]) -> tuple[int, str, str]:
+    with chdir(DIR):
+        exit_code = main(args)
+    output = capsys.readouterr()
+    return exit_code, output.out, output.err
+
+
+def test_multiple_expressions_parse_once():
+    with chdir(DIR):
+        with patch("pyastgrep.files.process_python_source", wraps=process_python_source) as process:
+            results = list(
+                search_python_files(
+                    [Path("misc.py")],
+                    {"func": ".//FunctionDef", "arg": ".//arg", "none": ".//ClassDef"},
+                )
+            )
+    assert process.call_count == 1
+    matches = [r for r in results if isinstance(r, Match)]
+    # In order of position, as with a single expression
+    assert [(m.rule_id, m.position.lineno, m.position.col_offset) for m in matches] == [
+        ("func", 2, 0),
+        ("arg", 2, 15),
+    ]
+
+
+def test_expression_list_labels_with_expression():
+    with chdir(DIR):
+        results = list(search_python_files([Path("misc.py")], [".//FunctionDef"]))
+    assert [r.rule_id for r in results if isinstance(r, Match)] == [".//FunctionDef"]
+
+
+def test_single_expression_not_labelled():
+    with chdir(DIR):
+        results = list(search_python_files([Path("misc.py")], ".//FunctionDef"))
+    assert [r.rule_id for r in results if isinstance(r, Match)] == [None]
+
+
+def test_cli_multiple_e(capsys):
+    exit_code, out, _ = run_main(capsys, ["-e", ".//FunctionDef", "-e", ".//arg", "misc.py"])
+    assert exit_code == 0
+    assert (
+        out == "misc.py:2:1:[.//FunctionDef] def a_function(an_arg):\nmisc.py:2:16:[.//arg] def a_function(an_arg):\n"
+    )
+
+
+def test_cli_single_e(capsys):
+    # Positional arguments are all paths
+    _, out, _ = run_main(capsys, ["-e", ".//FunctionDef", "misc.py"])
+    assert out == "misc.py:2:1:def a_function(an_arg):\n"
+
+
+def test_cli_rules_file(capsys, tmp_path):
+    rules_file = tmp_path / "rules.txt"
+    rules_file.write_text("# Comment\n\nno-functions: .//FunctionDef\nno-classes: .//ClassDef\n")
+    exit_code, out, _ = run_main(capsys, ["-f", str(rules_file), "misc.py"])
+    assert exit_code == 0
+    assert out == "misc.py:2:1:[no-functions] def a_function(an_arg):\n"
+
+
+def test_cli_rules_file_invalid(capsys, tmp_path):
+    rules_file = tmp_path / "rules.txt"
+    rules_file.write_text("no-functions .//FunctionDef\n")
+    exit_code, _, err = run_main(capsys, ["-f", str(rules_file), "misc.py"])
+    assert exit_code == 2
+    assert err == f"ERROR: {rules_file}:1: expected `rule_id: expression`\n"
+
+
+def test_cli_invalid_expression_in_multiple(capsys):
+    exit_code, _, err = run_main(capsys, ["-e", ".//FunctionDef", "-e", "some nonsense", "misc.py"])
+    assert exit_code == 2
+    assert err == "Invalid XPath expression: some nonsense\n"
+
+
+def test_cli_no_expression(capsys):
+    exit_code, _, err = run_main(capsys, [])
+    assert exit_code == 2
+    assert err == "ERROR: No expression given.\n"
+
+
+EXAMPLE_SOURCE = """
+import os
+from os import path
+
+
+class Thing:
+    def method(self, arg):
+        print(self, arg)
+        return os.path.join(arg, "x")
+
+
+def func(a, b=1):
+    if a is None:
+        print("none")
+    return [x for x in a if x]
+"""
+
+
+@pytest.mark.parametrize(
+    "expression,anchored",
+    [
+        (".//Call", True),
+        ("//Module", True),
+        (".//Module", True),
+        ('.//Call[func/Name[@id="print"]]', True),
+        ('.//Name[@id="print"]', True),
+        ('.//FunctionDef[@name="method" and .//Return]', True),
+        (".//Compare[ops/Is][comparators/Constant]", True),
+        ('.//Name[re:match("^a", @id)]', True),
+        ('.//Name[re:search("a", @id)]', True),
+        ('.//FunctionDef[@name="func"][re:search("c$", @name) and re:match("f", @name)]', True),
+        ('.//Name[re:match("a", @id) and .//Load]', True),
+        ('.//Name[re:match("a", @missing)]', True),
+        ('.//Name[not(re:match("a", @id))]', True),
+        ('.//Call[re:search("^p", func/Name/@id)]', True),
+        (".//Name[not(@id='os')]", True),
+        ("descendant-or-self::arg", True),
+        # Positional predicates depend on the step, so can't be anchored:
+        (".//Name[1]", False),
+        (".//Name[last()]", False),
+        (".//Name[position() > 1]", False),
+        (".//Call/func", False),
+        (".//Name/@id", False),
+        (".//*[@id]", False),
+        (".//Name | .//Call", False),
+        ("count(.//Name)", False),
+    ],
+)
+def test_rule_set_matches_naive_evaluation(expression, anchored, monkeypatch):
+    # Always use the residual for anchored rules, however common the tag
+    monkeypatch.setattr("pyastgrep.rules.RESIDUAL_COST_FACTOR", 0)
+    processed = process_python_source(filename="example.py", contents=EXAMPLE_SOURCE.encode(), auto_dedent=False)
+    assert not isinstance(processed, ReadError)
+    assert (anchor_rule(0, expression) is not None) == anchored
+    # Include another expression, so that the document facts include more tags
+    expressions = (expression, ".//Name")
+    rule_set = RuleSet(expressions)
+    for rule_results, expr in zip(rule_set.evaluate(processed.xml, lxml_query), expressions):
+        expected = lxml_query(processed.xml, expr)
+        if isinstance(expected, list):
+            assert list(rule_results) == expected
+        else:
+            assert rule_results == expected
+
+
+@pytest.mark.parametrize(
+    "expression,checked",
+    [
+        ('.//Name[re:match("a", @id)]', True),
+        ('.//Name[re:search("a$", @id)]', True),
+        ('//Name[@id="arg"][re:search("r", @id)]', True),
+        ('.//Name[re:match("a", @missing)]', True),
+        ('.//Name[re:match("a", @id) and .//Load]', False),
+        ('.//Name[not(re:match("a", @id))]', False),
+        ('.//Name[re:match("(", @id)]', False),
+        ('.//Name[@id="a"]', False),
+    ],
+)
+def test_regex_query(expression, checked):
+    processed = process_python_source(filename="example.py", contents=EXAMPLE_SOURCE.encode(), auto_dedent=False)
+    assert not isinstance(processed, ReadError)
+    evaluate = regex_query(expression)
+    assert (evaluate is not None) == checked
+    if evaluate is not None:
+        assert evaluate(processed.xml) == lxml_query(processed.xml, expression)
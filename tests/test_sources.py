@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from lxml.etree import XPathError
+from pyastgrep import stats
+from pyastgrep.api import Match, Position, ReadError, search_sources
+
+
+def test_search_sources():
+    results = list(
+        search_sources(
+            [("a.py", "x = 1\n"), ("b.py", b"def f():\n    return y\n"), ("bad.py", "def (\n")],
+            ".//Name",
+        )
+    )
+    assert [
+        (result.path, result.position, result.matching_line) for result in results if isinstance(result, Match)
+    ] == [
+        ("a.py", Position(1, 0), "x = 1"),
+        ("b.py", Position(2, 11), "    return y"),
+    ]
+    [error] = [result for result in results if isinstance(result, ReadError)]
+    assert error.path == "bad.py"
+
+
+def test_auto_dedent():
+    snippet = "    if x:\n        foo()\n"
+    [match] = search_sources([("snippet", snippet)], ".//Call")
+    assert isinstance(match, Match)
+    assert match.matching_line == "    foo()"
+    [error] = search_sources([("snippet", snippet)], ".//Call", auto_dedent=False)
+    assert isinstance(error, ReadError)
+
+
+def test_multiple_expressions():
+    results = list(search_sources([("a.py", "foo(x)\n")], {"call": ".//Call", "name": './/Name[@id="x"]'}))
+    assert [result.rule_id for result in results if isinstance(result, Match)] == ["call", "name"]
+
+
+def test_no_filesystem_access():
+    with stats.count_operations() as operations:
+        list(search_sources([("a.py", "x = 1\n")], ".//Name"))
+    assert {counter for counter, subject in operations} == {"files_parsed", "files_converted", "ast_nodes", "matches"}
+
+
+def test_executor():
+    items = [(f"module{i}.py", f"x{i} = y{i}\n") for i in range(50)]
+    expected = [(match.path, match.position) for match in search_sources(items, ".//Name") if isinstance(match, Match)]
+    assert len(expected) == 100
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(search_sources(iter(items), ".//Name", executor=executor, batch_size=7))
+    assert [(match.path, match.position) for match in results if isinstance(match, Match)] == expected
+
+
+def test_invalid_expression():
+    with pytest.raises(XPathError):
+        list(search_sources([("a.py", "x = 1\n")], ".//Name["))
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from pyastgrep import stats
+from pyastgrep.api import Match, search_python_files
+from pyastgrep.cli import main
+
+from tests.utils import chdir
+
+DIR = Path(__file__).parent / "examples" / "test_cli"
+
+
+def test_collect_stats():
+    with chdir(DIR):
+        with stats.collect_stats() as collected:
+            results = list(search_python_files([Path(".")], ".//arg"))
+    counters = collected.counters
+    assert counters["files_walked"] == counters["files_parsed"] == 5
+    assert counters["dirs_visited"] == 2
+    assert counters["bytes_read"] == sum(p.stat().st_size for p in DIR.rglob("*.py"))
+    assert counters["matches"] == len([result for result in results if isinstance(result, Match)]) > 0
+    for phase in ["walk", "read", "parse", "link", "convert", "query"]:
+        assert collected.timings[phase] > 0
+    # Phase times are exclusive, so add up to the total
+    assert collected.elapsed is not None
+    assert sum(collected.timings.values()) == pytest.approx(collected.elapsed, abs=0.001)
+
+
+def test_disabled():
+    assert stats._current is None
+    assert stats.timed("parse") is stats._NULL_TIMER
+    items = [1, 2]
+    assert stats.timed_iter(items, "walk") is items
+
+
+def test_nested_phases():
+    with stats.collect_stats() as collected:
+        with stats.timed("walk"):
+            with stats.timed("ignore"):
+                pass
+        assert list(stats.timed_iter(iter([1, 2]), "read")) == [1, 2]
+    assert collected.timings["ignore"] > 0
+    assert collected.timings["read"] > 0
+    assert stats._current is None
+
+
+def test_phases_in_threads():
+    entered = threading.Event()
+    exited = threading.Event()
+
+    def worker() -> None:
+        with stats.timed("parse"):
+            entered.set()
+            exited.wait()
+            time.sleep(0.01)
+
+    with stats.collect_stats() as collected:
+        with stats.timed("walk"):
+            thread = threading.Thread(target=worker)
+            thread.start()
+            entered.wait()
+        # Leaving "walk" while the thread is still in "parse" doesn't end "parse"
+        exited.set()
+        thread.join()
+    assert collected.timings["parse"] >= 0.01
+    assert collected.timings["walk"] < 0.01
+
+
+def test_cli_stats_json(capsys):
+    with chdir(DIR):
+        main(["--stats-json", ".//arg", "misc.py"])
+    output = capsys.readouterr()
+    assert "misc.py:2:16:" in output.out
+    data = json.loads(output.err)
+    assert data["counters"]["files_parsed"] == 1
+    assert data["counters"]["matches"] == 1
+    assert set(data["phase_seconds"]) == set(stats.PHASES)
+
+
+def test_cli_stats_xpath2(capsys):
+    with chdir(DIR):
+        main(["--stats-json", "--xpath2", ".//arg", "misc.py"])
+    counters = json.loads(capsys.readouterr().err)["counters"]
+    assert counters["node_trees_built"] == 1
+    # Expressions are compiled when checked, before stats are collected
+    assert "xpath2_compiled" in counters
+
+
+def test_cli_stats_text(capsys):
+    with chdir(DIR):
+        main(["--stats", ".//arg", "misc.py"])
+    output = capsys.readouterr()
+    assert "Files parsed: 1\n" in output.err
+    assert "  parse " in output.err
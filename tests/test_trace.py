@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+from pyastgrep.api import search_python_files
+from pyastgrep.cli import main
+from pyastgrep.trace import collect_trace
+
+from tests.utils import chdir
+
+DIR = Path(__file__).parent / "examples" / "test_cli"
+
+
+def test_collect_trace():
+    with chdir(DIR):
+        with collect_trace() as tracer:
+            list(search_python_files([Path(".")], ".//arg"))
+    spans = {(event["cat"], event["args"]["path"]) for event in tracer.events}
+    for phase in ["read", "parse", "link", "convert", "query", "materialize"]:
+        assert (phase, "misc.py") in spans
+        assert (phase, "subdir/subdir_file.py") in spans
+    assert ("walk", str(DIR)) in spans
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in tracer.events)
+
+
+def test_cli_trace(capsys, tmp_path):
+    trace_file = tmp_path / "trace.json"
+    with chdir(DIR):
+        main(["--trace", str(trace_file), ".//arg", "misc.py"])
+    assert "misc.py:2:16:" in capsys.readouterr().out
+    events = json.loads(trace_file.read_text())["traceEvents"]
+    assert events[0]["ph"] == "M"
+    assert {event["name"] for event in events if event["ph"] == "X"} == {
+        f"{phase} misc.py" for phase in ["read", "parse", "link", "convert", "query", "materialize", "print"]
+    }
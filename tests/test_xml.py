@@ -1,10 +1,13 @@
+import gc
 import re
 import sys
 from pathlib import Path
 
 import lxml.etree
 from pyastgrep.asts import ast_to_xml
-from pyastgrep.files import parse_python_file
+from pyastgrep.files import ReadError, parse_python_file, process_python_source
+from pyastgrep.xml import compile_xpath, lxml_query
+from pyastgrep.xpath2 import elementpath_query, elementpath_query_all
 
 from tests.utils import run_print
 
@@ -45,6 +48,26 @@ def test_lower_case():
     assert "MyClass" in output
 
 
+def test_re_match_xpath2():
+    output = run_print(DIR, './/Name[re:match("assigned_.*", @id)]', xpath2=True).stdout
+    assert "assigned_int" in output
+    assert "assigned_str" in output
+
+    output2 = run_print(DIR, './/Name[re:search("_.nt", lower-case(@id))]', xpath2=True).stdout
+    assert "assigned_int" in output2
+    assert "assigned_str" not in output2
+
+
+def test_xpath2_node_tree_not_kept():
+    root = lxml.etree.fromstring('<Module><Name id="x"/><Name id="y"/></Module>')
+    refcount = sys.getrefcount(root)
+    assert len(elementpath_query(root, ".//Name")) == 2
+    assert [len(results) for results in elementpath_query_all(root, [".//Name", './/Name[@id="x"]'])] == [2, 1]
+    gc.collect()
+    # Nothing refers to the document after querying it, so it can be freed
+    assert sys.getrefcount(root) == refcount
+
+
 def test_attribute():
     """
     XPath expressions resolving to attributes don't return anything
@@ -429,3 +452,24 @@ def test_xml_everything():
         EXPECTED = re.subn(r" *<type_params/>\n", "", EXPECTED)[0]
 
     assert _file_to_xml(DIR / "everything.py") == EXPECTED
+
+
+def test_re_match_many_documents():
+    # Regression test: compiled expressions with `re:` functions must be
+    # safe to evaluate against many documents.
+    expression = './/Name[re:match("^a", @id)]'
+    source = b"import os\nabc = os.path\ndef f(a, b):\n    return a\n"
+    for i in range(500):
+        processed = process_python_source(filename="example.py", contents=source, auto_dedent=False)
+        assert not isinstance(processed, ReadError)
+        assert len(lxml_query(processed.xml, expression)) == 2
+        # Other evaluations that use the `re` namespace
+        assert len(processed.xml.xpath('.//Name[re:search("b", @id)]')) == 1
+        if i % 100 == 0:
+            gc.collect()
+
+
+def test_re_functions_compiled():
+    compiled = compile_xpath('.//Name[re:match("^re:match(", @id) or re:search("x", @id)]')
+    assert isinstance(compiled, lxml.etree.XPath)
+    assert compiled.path == './/Name[re-match("^re:match(", @id) or re-search("x", @id)]'
@@ -47,6 +47,9 @@ def run_print(
     context: ContextType = StaticContext(before=0, after=0),
     heading=False,
     colorer: Colorer | None = None,
+    scope: bool = False,
+    max_columns: int | None = None,
+    max_columns_preview: bool = False,
 ) -> Output:
     # As much as possible, we're avoiding capsys or other techniques that
     # capture stdin/out, because they interacts badly with trying to do REPL
@@ -68,5 +71,8 @@ def run_print(
             context=context,
             heading=heading,
             colorer=colorer,
+            scope=scope,
+            max_columns=max_columns,
+            max_columns_preview=max_columns_preview,
         )
     return Output(stdout=stdout.getvalue(), stderr=stderr.getvalue(), retval=retval)